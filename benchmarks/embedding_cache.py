@@ -0,0 +1,103 @@
+"""
+Speed of prompt-only changes with the SAM embedding cache.
+
+Segments sample tiles a first time with an empty `EmbeddingCache` (the encoder runs and the
+embeddings are cached), then again with other prompts (another `dist_thresh`), as when re-running
+with other watershed or centers parameters. The second run only decodes the prompts. Its masks are
+checked against a run without cache:
+
+    python benchmarks/embedding_cache.py --model models/sam2_b.pt
+    python benchmarks/embedding_cache.py --model models/sam2_b.pt --onnx-dir models/ --cache-dir /tmp/embeddings
+
+With `--cache-dir`, the embeddings are written to disk too. Use an empty directory, so that the
+first run encodes the tiles.
+
+Without `--images`, synthetic images are used. The script exits with an error if the masks of the
+cached run differ from the masks of the run without cache.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from sam_precision import sample_tiles
+
+from sfai.cache import EmbeddingCache
+from sfai.data import ImageTiler
+from sfai.operators import SAMSegmentation, SAMOnnxSegmentation
+from sfai.pipeline import PipelineContext
+
+def run(operator: SAMSegmentation, ctxs: List[PipelineContext]) -> tuple[List[np.ndarray], float]:
+    """Segments copies of the tiles
+
+    Returns:
+        tuple[List[np.ndarray], float]: Label mask of each tile, and time per tile in seconds
+    """
+    copies = [
+        PipelineContext(index=ctx.index, image=ctx.image, image_info=ctx.image_info, points=ctx.points, metadata={})
+        for ctx in ctxs
+    ]
+
+    start = time.perf_counter()
+    results = operator.run_batch(copies)
+    elapsed = time.perf_counter() - start
+
+    return [ctx.sam_mask for ctx in results], elapsed / len(ctxs)
+
+def main():
+    parser = argparse.ArgumentParser(description='Speed of prompt-only changes with the SAM embedding cache')
+    parser.add_argument('--model', required=True, help='SAM model')
+    parser.add_argument('--images', nargs='*', default=[], help='Sample image files or folders. Default: synthetic images')
+    parser.add_argument('--onnx-dir', default=None, help='Folder of the ONNX export of the model. Default: ultralytics backend')
+    parser.add_argument('--cache-dir', default=None, help='Directory of the on-disk embedding cache. Default: memory only')
+    parser.add_argument('--tiles', type=int, default=8, help='Number of sample tiles. Default: 8')
+    parser.add_argument('--tile-size', type=int, default=1024, help='Maximum tile size. Default: 1024')
+    parser.add_argument('--dist-thresh', type=float, nargs=2, default=[20, 40], help='Prompt merge distance of the first and second runs. Default: 20 40')
+    args = parser.parse_args()
+
+    ctxs = sample_tiles([Path(p) for p in args.images], args.tiles, ImageTiler(rows=8, cols=8, tile_size=args.tile_size))
+
+    if not ctxs:
+        sys.exit('No tile with objects in the sample images')
+
+    first, second = args.dist_thresh
+
+    embeddings = EmbeddingCache(directory=Path(args.cache_dir) if args.cache_dir else None)
+
+    def build(embeddings: EmbeddingCache | None, dist_thresh: float) -> SAMSegmentation:
+        if args.onnx_dir is not None:
+            return SAMOnnxSegmentation(args.model, dist_thresh=dist_thresh, onnx_dir=args.onnx_dir, embeddings=embeddings)
+
+        return SAMSegmentation(args.model, dist_thresh=dist_thresh, embeddings=embeddings)
+
+    operator = build(embeddings, first)
+
+    # Warm-up, not timed: builds the predictor or the sessions
+    build(None, first).run_batch(ctxs[:1])
+
+    _, cold = run(operator, ctxs)
+
+    operator.dist_thresh = second
+    warm_masks, warm = run(operator, ctxs)
+
+    reference, _ = run(build(None, second), ctxs)
+
+    print(f'{len(ctxs)} tiles, prompt merge distance {first} then {second}')
+    print(f'cold (encoder + decoder): {cold:.3f} s/tile')
+    print(f'warm (decoder only):      {warm:.3f} s/tile ({cold / warm:.1f}x faster)')
+    print(f'embedding cache: {embeddings.hits} hits, {embeddings.misses} misses')
+
+    mismatches = sum(not np.array_equal(a, b) for a, b in zip(warm_masks, reference))
+
+    if mismatches:
+        sys.exit(f'{mismatches} tiles differ from the run without cache')
+
+    print('masks identical to the run without cache')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Import-time budget of the CLI.
+
+Each check runs in a fresh interpreter, imports the CLI, builds the parser of a subcommand and
+reports the elapsed time and the heavy modules loaded. It fails if a subcommand goes over its time
+budget or loads a heavy module it does not need:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget 0.5
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+HEAVY_MODULES = ['torch', 'ultralytics', 'skimage', 'matplotlib', 'shapely', 'pandas']
+"""Modules no subcommand should load before running
+"""
+
+CHECKS = {
+    'import sfai.sfai': [],
+    'sfai cpfiles --help': ['cpfiles', '--help'],
+    'sfai coco2biigle --help': ['coco2biigle', '--help'],
+    'sfai segment --help': ['segment', '--help'],
+    'sfai serve --help': ['serve', '--help'],
+    'sfai export-onnx --help': ['export-onnx', '--help'],
+}
+"""Command line arguments of each check. An empty list only imports the CLI.
+"""
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import sfai.sfai as cli
+args = json.loads(sys.argv[1])
+if args:
+    try:
+        cli.parser.parse_args(args)
+    except SystemExit:
+        pass
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in json.loads(sys.argv[2]) if m in sys.modules]}))
+'''
+
+def probe(args: list, repeat: int) -> dict:
+    """Runs a check in fresh interpreters
+
+    Args:
+        args (list): Command line arguments of the subcommand
+        repeat (int): Number of runs. The fastest one is kept.
+
+    Returns:
+        dict: Elapsed time in seconds and heavy modules loaded
+    """
+    src = str(Path(__file__).parent.parent / 'src')
+    best = None
+
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, '-c', f'import sys; sys.path.insert(0, {src!r})\n{PROBE}', json.dumps(args), json.dumps(HEAVY_MODULES)],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+
+        if best is None or result['elapsed'] < best['elapsed']:
+            best = result
+
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Import-time budget of the CLI')
+    parser.add_argument('--budget', type=float, default=1.0, help='Time budget of each check in seconds. Default: 1.0')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per check. The fastest one is kept. Default: 3')
+    args = parser.parse_args()
+
+    failures = 0
+
+    for name, cli_args in CHECKS.items():
+        result = probe(cli_args, args.repeat)
+
+        problems = []
+
+        if result['elapsed'] > args.budget:
+            problems.append(f'over budget ({args.budget:.2f}s)')
+
+        if result['loaded']:
+            problems.append(f'loads {", ".join(result["loaded"])}')
+
+        failures += bool(problems)
+        status = 'FAIL ' + '; '.join(problems) if problems else 'ok'
+
+        print(f'{name:<28} {result["elapsed"]:>7.3f}s  {status}')
+
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Mask agreement and speed of the reduced SAM precisions against fp32.
+
+Runs the classical operators on sample tiles to get the SAM prompts, then segments the same tiles
+with SAM in fp32 and in each reduced precision. For each precision, it reports:
+
+- foreground IoU: IoU of the union of all the objects of a tile, averaged over the tiles;
+- object IoU: IoU of each fp32 object with its best match, averaged over the objects;
+- matched: fraction of the fp32 objects matched with an IoU of at least 0.5;
+- the inference time per tile and the speedup.
+
+With `--onnx-dir`, the ONNX export of the model (`sfai export-onnx`) run by onnxruntime is compared
+with fp32 too.
+
+    python benchmarks/sam_precision.py --model models/sam2_b.pt --images samples/
+    python benchmarks/sam_precision.py --model models/sam2_b.pt --min-iou 0.95
+    python benchmarks/sam_precision.py --model models/sam2_b.pt --precisions --onnx-dir models/
+
+Without `--images`, synthetic images are used. The script exits with an error if the object IoU
+of a precision is below `--min-iou`.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from synthetic import generate_image
+
+from sfai.data import ImageTiler, generate_datasets
+from sfai.data.dataset import ImageInfo
+from sfai.operators import ForegroundExtraction, WatershedSegmentation, CentersDetection, SAMSegmentation, SAMOnnxSegmentation
+from sfai.operators.sam import SAM_PRECISIONS
+from sfai.pipeline import PipelineContext
+
+def sample_tiles(images: List[Path], count: int, tiler: ImageTiler) -> List[PipelineContext]:
+    """Picks tiles with SAM prompts from sample images, the classical operators already applied
+
+    Args:
+        images (List[Path]): Image files or folders. Synthetic images if empty.
+        count (int): Maximum number of tiles
+        tiler (ImageTiler): Splits the images into tiles
+
+    Returns:
+        List[PipelineContext]: Contexts of the tiles, ready for SAM
+    """
+    if images:
+        sources = (item for dataset in generate_datasets(images) for item in dataset)
+    else:
+        sources = (
+            (ImageInfo(id=seed, name=f'synthetic{seed}', file_name=f'synthetic{seed}.png', path=Path(f'synthetic{seed}.png'), width=2048, height=2048), generate_image(2048, 2048, density=100, seed=seed))
+            for seed in range(100)
+        )
+
+    operators = [ForegroundExtraction(), WatershedSegmentation(), CentersDetection()]
+    ctxs = []
+
+    for image_info, image in sources:
+        for index, tile in enumerate(tiler.iter_tiles(image)):
+            ctx = PipelineContext(index=index, image=np.ascontiguousarray(tile.image), image_info=image_info, metadata={})
+
+            for op in operators:
+                ctx = op(ctx)
+
+            if ctx.points:
+                ctxs.append(ctx)
+
+            if len(ctxs) >= count:
+                return ctxs
+
+    return ctxs
+
+def segment(model: Path, precision: str, ctxs: List[PipelineContext], batch_size: int, onnx_dir: Path | None = None) -> tuple[List[np.ndarray], float]:
+    """Segments the tiles with SAM in a given precision, or with the ONNX export in `onnx_dir` if given
+
+    Returns:
+        tuple[List[np.ndarray], float]: Label mask of each tile, and inference time per tile in seconds
+    """
+    if onnx_dir is not None:
+        operator = SAMOnnxSegmentation(model, batch_size=batch_size, onnx_dir=onnx_dir)
+    else:
+        operator = SAMSegmentation(model, batch_size=batch_size, precision=precision)
+
+    copies = [
+        PipelineContext(index=ctx.index, image=ctx.image, image_info=ctx.image_info, points=ctx.points, metadata={})
+        for ctx in ctxs
+    ]
+
+    # Warm-up, not timed: builds the predictor (and quantizes the encoder)
+    operator.run_batch(copies[:1])
+
+    start = time.perf_counter()
+    results = operator.run_batch(copies)
+    elapsed = time.perf_counter() - start
+
+    return [ctx.sam_mask for ctx in results], elapsed / len(ctxs)
+
+def object_ious(reference: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """IoU of each object of a label mask with its best match in another label mask
+
+    Args:
+        reference (np.ndarray): Reference label mask
+        other (np.ndarray): Label mask to compare
+
+    Returns:
+        np.ndarray: Best IoU of each reference object
+    """
+    n = int(reference.max()) + 1
+    m = int(other.max()) + 1
+
+    reference = reference.astype(np.int64).ravel()
+    other = other.astype(np.int64).ravel()
+
+    intersections = np.bincount(reference * m + other, minlength=n * m).reshape(n, m)
+    ref_areas = intersections.sum(axis=1)
+    other_areas = intersections.sum(axis=0)
+
+    unions = ref_areas[:, None] + other_areas[None, :] - intersections
+    ious = np.divide(intersections, unions, out=np.zeros(intersections.shape), where=unions > 0)
+
+    present = ref_areas[1:] > 0
+
+    return ious[1:, 1:].max(axis=1, initial=0.0)[present]
+
+def compare(reference: List[np.ndarray], masks: List[np.ndarray]) -> Dict[str, float]:
+    """Mask agreement of a precision with fp32, over all the tiles
+    """
+    foreground = []
+    objects = []
+
+    for ref, mask in zip(reference, masks):
+        a, b = ref > 0, mask > 0
+        union = np.count_nonzero(a | b)
+
+        foreground.append(np.count_nonzero(a & b) / union if union else 1.0)
+        objects.append(object_ious(ref, mask))
+
+    objects = np.concatenate(objects) if objects else np.zeros(0)
+
+    return {
+        'foreground_iou': float(np.mean(foreground)),
+        'object_iou': float(objects.mean()) if objects.size else 1.0,
+        'matched': float((objects >= 0.5).mean()) if objects.size else 1.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Mask agreement and speed of the reduced SAM precisions against fp32')
+    parser.add_argument('--model', required=True, help='SAM model')
+    parser.add_argument('--images', nargs='*', default=[], help='Sample image files or folders. Default: synthetic images')
+    parser.add_argument('--precisions', nargs='*', default=[p for p in SAM_PRECISIONS if p != 'fp32'], help='Precisions compared with fp32')
+    parser.add_argument('--tiles', type=int, default=16, help='Number of sample tiles. Default: 16')
+    parser.add_argument('--tile-size', type=int, default=1024, help='Maximum tile size. Default: 1024')
+    parser.add_argument('--batch-size', type=int, default=1, help='SAM batch size. Default: 1')
+    parser.add_argument('--onnx-dir', default=None, help='Folder of the ONNX export of the model, compared with fp32 too. Default: not compared')
+    parser.add_argument('--min-iou', type=float, default=0.9, help='Minimum object IoU of an acceptable precision. Default: 0.9')
+    args = parser.parse_args()
+
+    ctxs = sample_tiles([Path(p) for p in args.images], args.tiles, ImageTiler(rows=8, cols=8, tile_size=args.tile_size))
+
+    if not ctxs:
+        sys.exit('No tile with objects in the sample images')
+
+    print(f'{len(ctxs)} tiles, {sum(len(ctx.points) for ctx in ctxs)} prompts')
+
+    reference, reference_time = segment(args.model, 'fp32', ctxs, args.batch_size)
+
+    print(f'\n{"precision":<14} {"s/tile":>8} {"speedup":>8} {"fg IoU":>8} {"obj IoU":>8} {"matched":>8}')
+    print(f'{"fp32":<14} {reference_time:>8.3f} {1:>8.2f} {1:>8.4f} {1:>8.4f} {1:>8.1%}')
+
+    failures = 0
+
+    variants = [(precision, None) for precision in args.precisions]
+
+    if args.onnx_dir is not None:
+        variants.append(('onnx', Path(args.onnx_dir)))
+
+    for precision, onnx_dir in variants:
+        masks, elapsed = segment(args.model, precision, ctxs, args.batch_size, onnx_dir)
+        scores = compare(reference, masks)
+
+        flag = ''
+
+        if scores['object_iou'] < args.min_iou:
+            failures += 1
+            flag = f'  below {args.min_iou}'
+
+        print(
+            f'{precision:<14} {elapsed:>8.3f} {reference_time / elapsed:>8.2f} '
+            f'{scores["foreground_iou"]:>8.4f} {scores["object_iou"]:>8.4f} {scores["matched"]:>8.1%}{flag}'
+        )
+
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
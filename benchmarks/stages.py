@@ -0,0 +1,235 @@
+"""
+Per-stage benchmark of the segmentation pipeline on synthetic images.
+
+Times tiling, each classical operator, stitching, polygonization and COCO export separately, over
+several image sizes and object densities. SAM is only timed when a model is given; otherwise the
+watershed labels of each tile stand in for its SAM mask, so that stitching and polygonization run
+on realistic label masks.
+
+Results are written as JSON and can be compared against a stored baseline:
+
+    python benchmarks/stages.py --output bench.json
+    python benchmarks/stages.py --output new.json --baseline bench.json
+"""
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from synthetic import generate_image
+
+from sfai.data import ImageInfo, ImageTiler
+from sfai.export import JsonlBufferedWriter, StreamingCocoWriter
+from sfai.export.data import CocoImage, DEFAULT_CATEGORY
+from sfai.mask import MaskProcessor
+from sfai.operators import (
+    HSVBackgroundRemoval,
+    BinaryTransform,
+    ForegroundExtraction,
+    WatershedSegmentation,
+    CentersDetection,
+)
+from sfai.pipeline import PipelineContext
+from sfai.runners import TileResult
+from sfai.stitch import MaskStitcher
+
+def timed(stats: Dict[str, float], stage: str):
+    """Context manager adding the wall time of its block to `stats[stage]`
+    """
+    class Timer:
+        def __enter__(self):
+            self.start = time.perf_counter()
+
+        def __exit__(self, *exc):
+            stats[stage] += time.perf_counter() - self.start
+
+    return Timer()
+
+def bench_image(image: np.ndarray, tiler: ImageTiler, sam=None) -> Dict[str, float]:
+    """Runs every stage once on an image
+
+    Args:
+        image (np.ndarray): BGR image
+        tiler (ImageTiler): Tiler splitting the image
+        sam (SAMSegmentation | None, optional): SAM operator. Defaults to None.
+
+    Returns:
+        Dict[str, float]: Wall time of each stage in seconds
+    """
+    stats: Dict[str, float] = defaultdict(float)
+    info = ImageInfo(id=1, name='synthetic', file_name='synthetic.png', path=Path('synthetic.png'), width=image.shape[1], height=image.shape[0])
+
+    with timed(stats, 'tiling'):
+        tiles = tiler.split(image)
+
+    legacy = [HSVBackgroundRemoval(), BinaryTransform()]
+    operators = [ForegroundExtraction(), WatershedSegmentation(), CentersDetection()]
+
+    results = []
+
+    for index, tile in enumerate(tiles):
+        ctx = PipelineContext(index=index, image=tile.image, image_info=info, metadata={})
+
+        for op in legacy:
+            with timed(stats, f'operator.{type(op).__name__}'):
+                op(ctx)
+
+        for op in operators:
+            with timed(stats, f'operator.{type(op).__name__}'):
+                ctx = op(ctx)
+
+        if sam is not None:
+            with timed(stats, f'operator.{type(sam).__name__}'):
+                ctx = sam(ctx)
+        else:
+            labels = ctx.metadata['labels']
+            ctx.sam_mask = labels.astype(np.uint16)
+            ctx.metadata['label_count'] = int(labels.max())
+
+        results.append(TileResult(tile=tile, ctx=ctx))
+
+    with timed(stats, 'stitching'):
+        label_image = MaskStitcher().stitch(results, image.shape[:2])
+
+    with timed(stats, 'polygonization'):
+        annotations = list(MaskProcessor().build_annotations(label_image, image_id=1, category_id=1))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+
+        with timed(stats, 'coco_export'):
+            images_writer = JsonlBufferedWriter(tmp / 'images.jsonl')
+            annotations_writer = JsonlBufferedWriter(tmp / 'annotations.jsonl')
+
+            images_writer.write(CocoImage(id=1, width=info.width, height=info.height, file_name=info.file_name))
+            annotations_writer.write_list(annotations)
+
+            images_writer.close()
+            annotations_writer.close()
+
+            StreamingCocoWriter(tmp / 'images.jsonl', tmp / 'annotations.jsonl', [DEFAULT_CATEGORY], tmp / 'result.json').write()
+
+    stats['annotations'] = len(annotations)
+
+    return dict(stats)
+
+def run(sizes: List[str], densities: List[float], repeat: int, tiler: ImageTiler, sam=None) -> Dict[str, Dict[str, float]]:
+    """Benchmarks every size and density. Each stage keeps its best time over `repeat` runs.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Stage times of each case, keyed by `HEIGHTxWIDTH@density`
+    """
+    results = {}
+
+    for size in sizes:
+        h, w = (int(v) for v in size.split('x'))
+
+        for density in densities:
+            case = f'{size}@{density:g}'
+            image = generate_image(h, w, density=density, seed=0)
+
+            runs = [bench_image(image, tiler, sam) for _ in range(repeat)]
+
+            results[case] = {stage: min(r[stage] for r in runs) for stage in runs[0]}
+
+            total = sum(v for k, v in results[case].items() if k != 'annotations')
+            print(f'{case}: {total:.3f}s, {results[case]["annotations"]:.0f} annotations', flush=True)
+
+    return results
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float, min_delta: float = 0.005) -> int:
+    """Prints the ratio of each stage time to its baseline
+
+    Args:
+        results (Dict[str, Dict[str, float]]): Current results
+        baseline (Dict[str, Dict[str, float]]): Baseline results
+        tolerance (float): Relative slowdown above which a stage is reported as a regression
+        min_delta (float, optional): Absolute slowdown in seconds under which a stage is never reported, to ignore timer noise on short stages. Defaults to 0.005.
+
+    Returns:
+        int: Number of regressions
+    """
+    regressions = 0
+
+    print(f'\n{"case":<22} {"stage":<36} {"baseline":>10} {"current":>10} {"ratio":>7}')
+
+    for case, stages in results.items():
+        for stage, current in stages.items():
+            previous = baseline.get(case, {}).get(stage)
+
+            if stage == 'annotations' or not previous:
+                continue
+
+            ratio = current / previous
+            flag = ''
+
+            if ratio > 1 + tolerance and current - previous > min_delta:
+                regressions += 1
+                flag = '  REGRESSION'
+
+            print(f'{case:<22} {stage:<36} {previous:>10.4f} {current:>10.4f} {ratio:>7.2f}{flag}')
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-stage benchmark of the segmentation pipeline on synthetic images')
+    parser.add_argument('--sizes', nargs='+', default=['1024x1024', '2048x2048', '4096x4096'], help='Image sizes, as HEIGHTxWIDTH')
+    parser.add_argument('--densities', nargs='+', type=float, default=[50, 200], help='Objects per megapixel')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case. The best time of each stage is kept. Default: 3')
+    parser.add_argument('--tile-size', type=int, default=None, help='Maximum tile size. Default: 8 x 8 grid')
+    parser.add_argument('--model', default=None, help='SAM model. If set, SAM is benchmarked too')
+    parser.add_argument('--output', default='bench.json', help='Output JSON file. Default: bench.json')
+    parser.add_argument('--baseline', default=None, help='Baseline JSON file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative slowdown reported as a regression. Default: 0.1')
+    args = parser.parse_args()
+
+    tiler = ImageTiler(rows=8, cols=8, tile_size=args.tile_size)
+    sam = None
+
+    if args.model:
+        from sfai.operators import SAMSegmentation
+
+        sam = SAMSegmentation(args.model)
+
+    results = run(args.sizes, args.densities, args.repeat, tiler, sam)
+
+    report = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'repeat': args.repeat,
+            'tile_size': args.tile_size,
+            'model': args.model,
+        },
+        'results': results,
+    }
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+        regressions = compare(results, baseline, args.tolerance)
+
+        if regressions:
+            print(f'\n{regressions} stage(s) slower than the baseline by more than {args.tolerance:.0%}')
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Deterministic synthetic soil-fauna images: a blue filter-paper background with many blobs of
+random size, color and orientation.
+"""
+import cv2
+import numpy as np
+
+BACKGROUND_BGR = (185, 115, 45)
+"""Blue background, inside the default HSV background range
+"""
+
+OBJECT_COLORS_BGR = [
+    (40, 70, 110),
+    (60, 100, 150),
+    (30, 50, 70),
+    (90, 150, 200),
+    (200, 210, 220),
+]
+"""Brownish, orange and pale object colors, outside the default HSV background range
+"""
+
+def generate_image(
+    height: int,
+    width: int,
+    density: float = 100,
+    min_radius: int = 8,
+    max_radius: int = 40,
+    seed: int = 0
+) -> np.ndarray:
+    """Generates a synthetic image
+
+    Args:
+        height (int): Image height
+        width (int): Image width
+        density (float, optional): Number of objects per megapixel. Defaults to 100.
+        min_radius (int, optional): Minimum object half-axis in pixels. Defaults to 8.
+        max_radius (int, optional): Maximum object half-axis in pixels. Defaults to 40.
+        seed (int, optional): Random seed. The same arguments always give the same image. Defaults to 0.
+
+    Returns:
+        np.ndarray: BGR image (uint8)
+    """
+    rng = np.random.default_rng(seed)
+
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = BACKGROUND_BGR
+
+    noise = rng.integers(-8, 9, size=(height, width, 1), dtype=np.int16)
+    image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+    count = int(round(density * height * width / 1e6))
+
+    for _ in range(count):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(min_radius, max_radius + 1)), int(rng.integers(min_radius, max_radius + 1)))
+        angle = float(rng.uniform(0, 180))
+        color = OBJECT_COLORS_BGR[rng.integers(0, len(OBJECT_COLORS_BGR))]
+
+        cv2.ellipse(image, center, axes, angle, 0, 360, color, thickness=-1)
+
+    return image
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Writes a synthetic soil-fauna image')
+    parser.add_argument('output', help='Output image path')
+    parser.add_argument('--size', default='2048x2048', help='HEIGHTxWIDTH. Default: 2048x2048')
+    parser.add_argument('--density', type=float, default=100, help='Objects per megapixel. Default: 100')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed. Default: 0')
+    args = parser.parse_args()
+
+    h, w = (int(v) for v in args.size.split('x'))
+    cv2.imwrite(args.output, generate_image(h, w, density=args.density, seed=args.seed))
@@ -0,0 +1,13 @@
+from .tile import TileCache, file_digest
+from .disk import DiskCache
+from .embedding import EmbeddingCache
+
+"""
+Module caching intermediate results
+"""
+__all__ = [
+    "TileCache",
+    "DiskCache",
+    "EmbeddingCache",
+    "file_digest",
+]
\ No newline at end of file
@@ -0,0 +1,131 @@
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from sfai.logging import LOGGER
+
+class DiskCache:
+    """On-disk store of named arrays, with a size cap.
+
+    Each entry is a `.npz` file, compressed or not. When the store grows above `max_bytes`, the
+    least recently used entries are evicted. Writes are atomic, several processes can share a store.
+
+    The size of the store is tracked in memory from the writes of the process, and may drift when
+    other processes write to or evict from the same store. Eviction rescans the directory and
+    resets it.
+
+    Args:
+        directory (Path): Cache directory. Created if it does not exist.
+        max_bytes (int, optional): Size cap of the cache in bytes. Defaults to 10 GiB.
+        compress (bool, optional): Compress the entries. Defaults to True.
+    """
+    suffix = '.npz'
+
+    def __init__(self, directory: Path, max_bytes: int = 10 * 1024**3, compress: bool = True):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.compress = compress
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def load(self, key: str) -> Dict[str, np.ndarray] | None:
+        """Reads an entry. A hit marks the entry as recently used.
+
+        Args:
+            key (str): Key of the entry
+
+        Returns:
+            Dict[str, np.ndarray] | None: Arrays of the entry, None on a miss
+        """
+        path = self._path(key)
+
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            LOGGER.warning(f'Corrupted cache entry {path}: {e}. Entry removed.')
+            path.unlink(missing_ok=True)
+            return None
+
+        return arrays
+
+    def save(self, key: str, **arrays: np.ndarray):
+        """Writes an entry, then evicts old entries if the cache is full
+
+        Args:
+            key (str): Key of the entry
+            **arrays (np.ndarray): Arrays of the entry, by name
+        """
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = 0
+
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if self.compress:
+                    np.savez_compressed(f, **arrays)
+                else:
+                    np.savez(f, **arrays)
+
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+        self._size += path.stat().st_size - replaced
+
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is below 90% of its size cap
+        """
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        size = sum(s for _, s, _ in entries)
+        target = int(self.max_bytes * 0.9)
+
+        for path, entry_size, _ in entries:
+            if size <= target:
+                break
+
+            path.unlink(missing_ok=True)
+            size -= entry_size
+
+        self._size = size
+
+    def _entries(self) -> List[Tuple[Path, int, float]]:
+        """Lists the entries of the cache
+
+        Returns:
+            List[Tuple[Path, int, float]]: Path, size and last use time of each entry
+        """
+        entries = []
+
+        for path in self.directory.glob(f'*/*{self.suffix}'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+
+            entries.append((path, stat.st_size, stat.st_mtime))
+
+        return entries
+
+    def _path(self, key: str) -> Path:
+        """Path of an entry. Entries are spread in subfolders named after the first characters of the key.
+        """
+        return self.directory / key[:2] / f'{key}{self.suffix}'
@@ -0,0 +1,120 @@
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict
+
+import numpy as np
+
+from sfai.cache.disk import DiskCache
+
+class EmbeddingCache:
+    """Cache of the SAM image embeddings of tiles, in memory and optionally on disk.
+
+    Entries are keyed by a hash of the tile pixels, the model and the parameters of the image
+    encoder, not by the prompts: when only the prompts of a tile change (e.g. other watershed or
+    centers parameters), the tile is decoded against its cached embedding and the encoder does
+    not run again.
+
+    Embeddings are kept in memory up to `max_bytes`, least recently used first out. With a
+    `directory`, they are also written to disk (uncompressed, features do not compress well), so
+    that they are reused by the next runs. Disk hits are moved back to memory.
+
+    Args:
+        max_bytes (int, optional): Size cap of the in-memory cache in bytes. 0 keeps nothing in memory. Defaults to 1 GiB.
+        directory (Path | None, optional): Directory of the on-disk cache. Defaults to None (memory only).
+        max_disk_bytes (int, optional): Size cap of the on-disk cache in bytes. Defaults to 20 GiB.
+
+    Attributes:
+        hits (int): Number of embeddings found in the cache
+        misses (int): Number of embeddings not found
+    """
+    def __init__(self, max_bytes: int = 1024**3, directory: Path | None = None, max_disk_bytes: int = 20 * 1024**3):
+        self.max_bytes = max_bytes
+        self.disk = DiskCache(directory, max_bytes=max_disk_bytes, compress=False) if directory is not None else None
+        self.hits = 0
+        self.misses = 0
+
+        self._memory: OrderedDict[str, Dict[str, np.ndarray]] = OrderedDict()
+        self._size = 0
+
+    def key(self, image: np.ndarray, model_digest: str, params: Dict[str, Any]) -> str:
+        """Computes the key of a tile
+
+        Args:
+            image (np.ndarray): Tile
+            model_digest (str): Hash of the model file
+            params (Dict[str, Any]): Operator parameters that change the embedding
+
+        Returns:
+            str: Hex key
+        """
+        h = hashlib.blake2b(digest_size=20)
+
+        h.update(repr((image.shape, image.dtype.str)).encode())
+        h.update(np.ascontiguousarray(image).data)
+        h.update(model_digest.encode())
+        h.update(repr(sorted(params.items())).encode())
+
+        return h.hexdigest()
+
+    def get(self, key: str) -> Dict[str, np.ndarray] | None:
+        """Looks up the embedding of a tile, in memory then on disk
+
+        Args:
+            key (str): Key of the tile
+
+        Returns:
+            Dict[str, np.ndarray] | None: Feature arrays of the tile, by name. None on a miss.
+        """
+        features = self._memory.get(key)
+
+        if features is not None:
+            self._memory.move_to_end(key)
+        elif self.disk is not None:
+            features = self.disk.load(key)
+
+            if features is not None:
+                self._remember(key, features)
+
+        if features is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return features
+
+    def put(self, key: str, features: Dict[str, np.ndarray]):
+        """Stores the embedding of a tile
+
+        Args:
+            key (str): Key of the tile
+            features (Dict[str, np.ndarray]): Feature arrays of the tile, by name
+        """
+        self._remember(key, features)
+
+        if self.disk is not None:
+            self.disk.save(key, **features)
+
+    def clear(self):
+        """Empties the in-memory cache. The on-disk cache is kept.
+        """
+        self._memory.clear()
+        self._size = 0
+
+    def _remember(self, key: str, features: Dict[str, np.ndarray]):
+        """Keeps an embedding in memory, evicting the least recently used ones above the size cap
+        """
+        size = sum(array.nbytes for array in features.values())
+
+        if size > self.max_bytes:
+            return
+
+        if key in self._memory:
+            self._size -= sum(array.nbytes for array in self._memory.pop(key).values())
+
+        self._memory[key] = features
+        self._size += size
+
+        while self._size > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._size -= sum(array.nbytes for array in evicted.values())
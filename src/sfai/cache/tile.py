@@ -0,0 +1,89 @@
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from sfai.cache.disk import DiskCache
+
+
+def file_digest(path: Path, chunk_size: int = 1024**2) -> str:
+    """Hashes the content of a file
+
+    Args:
+        path (Path): Path to the file
+        chunk_size (int, optional): Read size. Defaults to 1 MiB.
+
+    Returns:
+        str: Hex digest of the file
+    """
+    h = hashlib.blake2b(digest_size=20)
+
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+class TileCache(DiskCache):
+    """Content-addressed on-disk cache of per-tile SAM results.
+
+    Entries are keyed by a hash of the tile pixels, the prompt points, the model and the operator
+    parameters, so a tile is only segmented again when one of them changes. The label mask and the
+    label count are stored as a compressed `.npz` file. When the cache grows above `max_bytes`, the
+    least recently used entries are evicted. Writes are atomic, several processes can share a cache.
+
+    Args:
+        directory (Path): Cache directory. Created if it does not exist.
+        max_bytes (int, optional): Size cap of the cache in bytes. Defaults to 10 GiB.
+    """
+    def __init__(self, directory: Path, max_bytes: int = 10 * 1024**3):
+        super().__init__(directory, max_bytes=max_bytes, compress=True)
+
+    def key(self, image: np.ndarray, points: List[List[int]], model_digest: str, params: Dict[str, Any]) -> str:
+        """Computes the key of a tile
+
+        Args:
+            image (np.ndarray): Tile
+            points (List[List[int]]): Prompt points of the tile
+            model_digest (str): Hash of the model file
+            params (Dict[str, Any]): Operator parameters that change the result
+
+        Returns:
+            str: Hex key
+        """
+        h = hashlib.blake2b(digest_size=20)
+
+        h.update(repr((image.shape, image.dtype.str)).encode())
+        h.update(np.ascontiguousarray(image).data)
+        h.update(np.asarray(points, dtype=np.int64).tobytes())
+        h.update(model_digest.encode())
+        h.update(repr(sorted(params.items())).encode())
+
+        return h.hexdigest()
+
+    def get(self, key: str) -> Tuple[np.ndarray, int] | None:
+        """Looks up a tile result. A hit marks the entry as recently used.
+
+        Args:
+            key (str): Key of the tile
+
+        Returns:
+            Tuple[np.ndarray, int] | None: Label mask and label count, None on a miss
+        """
+        arrays = self.load(key)
+
+        if arrays is None:
+            return None
+
+        return arrays['sam_mask'], int(arrays['label_count'])
+
+    def put(self, key: str, sam_mask: np.ndarray, label_count: int):
+        """Stores a tile result, then evicts old entries if the cache is full
+
+        Args:
+            key (str): Key of the tile
+            sam_mask (np.ndarray): Label mask of the tile
+            label_count (int): Number of labels
+        """
+        self.save(key, sam_mask=sam_mask, label_count=label_count)
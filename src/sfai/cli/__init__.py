@@ -1,9 +1,13 @@
 from .segment import add_segment_parser
 from .coco2biigle import add_coco2biigle_parser
 from .cpfiles import add_cpfiles_parser
+from .serve import add_serve_parser
+from .export_onnx import add_export_onnx_parser
 
 __all__ = [
     "add_segment_parser",
     "add_coco2biigle_parser",
-    "add_cpfiles_parser"
+    "add_cpfiles_parser",
+    "add_serve_parser",
+    "add_export_onnx_parser"
 ]
@@ -1,7 +1,6 @@
 from pathlib import Path
 
 from sfai.config import default
-from sfai.scripts import convert
 
 def add_coco2biigle_parser(subparsers):
     """
@@ -53,6 +52,8 @@ def run_coco2biigle(args):
     """
     CLI entrypoint for coco2biigle tool
     """
+    from sfai.scripts import convert
+    
     coco_file_path = Path(args.coco)
     label_tree_path = Path(args.label_tree_path)
     output_dir = Path(args.out_dir)
@@ -1,5 +1,4 @@
 from pathlib import Path
-from sfai.scripts import copy
 
 def add_cpfiles_parser(subparsers):
     """
@@ -45,6 +44,8 @@ def run_cpfiles(args):
     """
     CLI entrypoint for cpfiles tool
     """
+    from sfai.scripts import copy
+    
     source = Path(args.source).absolute()
     destination = Path(args.dest).absolute()
     move = args.move
@@ -0,0 +1,51 @@
+from sfai.config import default
+
+def add_export_onnx_parser(subparsers):
+    """
+    Add export-onnx command parser to subparser
+    """
+    parser = subparsers.add_parser(
+        "export-onnx",
+        help="Exports a SAM model to ONNX, for the onnx SAM backend."
+    )
+    
+    parser.add_argument(
+        "-m",
+        "--model",
+        default=default.DEFAULT_MODEL,
+        help=f"Path to a SAM model. Default: {default.DEFAULT_MODEL}"
+    )
+    
+    parser.add_argument(
+        "-o",
+        "--out_dir",
+        default=None,
+        help="Output folder. Must be the `sam_onnx_dir` of the segmentation runs. Default: folder of the model"
+    )
+    
+    parser.add_argument(
+        "--imgsz",
+        type=int,
+        default=1024,
+        help="SAM input size. Default: 1024"
+    )
+    
+    parser.add_argument(
+        "--opset",
+        type=int,
+        default=17,
+        help="ONNX opset. Default: 17"
+    )
+    
+    parser.set_defaults(func=run_export_onnx)
+    
+def run_export_onnx(args):
+    """
+    CLI entrypoint for the ONNX export
+    """
+    # Imported here, the export needs torch and ultralytics
+    from sfai.operators.sam_export import export_onnx
+    
+    metadata_path = export_onnx(args.model, args.out_dir, imgsz=args.imgsz, opset=args.opset)
+    
+    print(f'SAM model exported to {metadata_path.parent}')
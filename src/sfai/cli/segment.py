@@ -1,7 +1,3 @@
-from sfai.config import SegmentationConfig
-from sfai.segmentation import segment
-
-
 def add_segment_parser(subparsers):
     """
     Add segment command parser to subparser
@@ -24,6 +20,10 @@ def run_segmentation(args):
     """
     CLI entrypoint for segmentation tool
     """
+    # Imported here, the segmentation stack (torch, ultralytics...) is only loaded by this subcommand
+    from sfai.config import SegmentationConfig
+    from sfai.segmentation import segment
+    
     cfg = SegmentationConfig.from_file(args.config)
     cfg.create_run_folder()
     
@@ -0,0 +1,144 @@
+from sfai.config import default
+
+def add_serve_parser(subparsers):
+    """
+    Add serve command parser to subparser
+    """
+    parser = subparsers.add_parser(
+        "serve",
+        help="Keeps a SAM model loaded and serves it to segmentation runs."
+    )
+    
+    parser.add_argument(
+        "-m",
+        "--model",
+        default=default.DEFAULT_MODEL,
+        help=f"Path to a SAM model. Must be the `model` of the segmentation runs. Default: {default.DEFAULT_MODEL}"
+    )
+    
+    parser.add_argument(
+        "-s",
+        "--socket",
+        default=default.DEFAULT_SAM_SOCKET,
+        help=f"Unix domain socket to listen on. Must be the `sam_socket` of the segmentation runs. Default: {default.DEFAULT_SAM_SOCKET}"
+    )
+    
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=default.DEFAULT_SAM_BATCH_SIZE,
+        help=f"Maximum number of tiles encoded together. Default: {default.DEFAULT_SAM_BATCH_SIZE}"
+    )
+    
+    parser.add_argument(
+        "-p",
+        "--precision",
+        choices=['fp32', 'bf16', 'dynamic-int8'],
+        default=default.DEFAULT_SAM_PRECISION,
+        help=f"Precision of the SAM image encoder. Must be the `sam_precision` of the segmentation runs. Default: {default.DEFAULT_SAM_PRECISION}"
+    )
+    
+    parser.add_argument(
+        "--backend",
+        choices=['ultralytics', 'onnx'],
+        default=default.DEFAULT_SAM_BACKEND,
+        help=f"SAM backend. Must be the `sam_backend` of the segmentation runs. Default: {default.DEFAULT_SAM_BACKEND}"
+    )
+    
+    parser.add_argument(
+        "--onnx_dir",
+        default=None,
+        help="Folder of the ONNX export of the model (onnx backend). Default: folder of the model"
+    )
+    
+    parser.add_argument(
+        "--intra_op_threads",
+        type=int,
+        default=default.DEFAULT_SAM_ONNX_INTRA_THREADS,
+        help="Threads running a single ONNX operator (onnx backend). 0 lets onnxruntime decide. Default: 0"
+    )
+    
+    parser.add_argument(
+        "--inter_op_threads",
+        type=int,
+        default=default.DEFAULT_SAM_ONNX_INTER_THREADS,
+        help="Threads running independent ONNX operators in parallel (onnx backend). 0 runs them sequentially. Default: 0"
+    )
+    
+    parser.add_argument(
+        "--cache_dir",
+        default=None,
+        help="Directory of the SAM tile cache. Disabled if not set."
+    )
+    
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=default.DEFAULT_SAM_CACHE_SIZE,
+        help=f"Size cap in bytes of the SAM tile cache. Default: {default.DEFAULT_SAM_CACHE_SIZE}"
+    )
+    
+    parser.add_argument(
+        "--embedding_cache_size",
+        type=int,
+        default=default.DEFAULT_SERVE_EMBEDDING_CACHE_SIZE,
+        help=f"Size cap in bytes of the in-memory cache of tile embeddings, kept between runs. 0 disables it. Default: {default.DEFAULT_SERVE_EMBEDDING_CACHE_SIZE}"
+    )
+    
+    parser.add_argument(
+        "--embedding_cache_dir",
+        default=None,
+        help="Directory of the on-disk cache of tile embeddings. Disabled if not set."
+    )
+    
+    parser.add_argument(
+        "--embedding_cache_disk_size",
+        type=int,
+        default=default.DEFAULT_SAM_EMBEDDING_CACHE_DISK_SIZE,
+        help=f"Size cap in bytes of the on-disk cache of tile embeddings. Default: {default.DEFAULT_SAM_EMBEDDING_CACHE_DISK_SIZE}"
+    )
+    
+    parser.set_defaults(func=run_serve)
+    
+def run_serve(args):
+    """
+    CLI entrypoint for the SAM server
+    """
+    import signal
+    import sys
+    from pathlib import Path
+    
+    from sfai.cache import EmbeddingCache, TileCache
+    from sfai.operators import SAMSegmentation, SAMOnnxSegmentation
+    from sfai.server import SAMServer
+    
+    cache = None
+    
+    if args.cache_dir:
+        cache = TileCache(Path(args.cache_dir), max_bytes=args.cache_size)
+    
+    embeddings = None
+    
+    if args.embedding_cache_size > 0 or args.embedding_cache_dir:
+        embedding_dir = Path(args.embedding_cache_dir) if args.embedding_cache_dir else None
+        embeddings = EmbeddingCache(args.embedding_cache_size, directory=embedding_dir, max_disk_bytes=args.embedding_cache_disk_size)
+    
+    if args.backend == 'onnx':
+        if args.precision != 'fp32':
+            sys.exit(f'The onnx backend only runs in fp32, not {args.precision}')
+        
+        operator = SAMOnnxSegmentation(args.model, batch_size=args.batch_size, cache=cache, onnx_dir=args.onnx_dir, intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads, embeddings=embeddings)
+    else:
+        operator = SAMSegmentation(args.model, batch_size=args.batch_size, cache=cache, precision=args.precision, embeddings=embeddings)
+    server = SAMServer(operator, Path(args.socket))
+    
+    # SIGTERM (e.g. from a job scheduler) stops the server cleanly, as Ctrl+C does
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        sys.exit(str(e))
@@ -40,7 +40,7 @@ class BaseConfig:
         fields_defs = {f.name: f for f in fields(cls)}
         obj = cls.__new__(cls)
         for name, field in fields_defs.items():
-            if name in data and data[name]:
+            if name in data and data[name] is not None:
                 value = cls._coerce(field.type, data[name])
             else:
                 if field.default_factory is not MISSING:
@@ -129,25 +129,64 @@ class SegmentationConfig(BaseConfig):
     CONFIG_NAMESPACE = 'segment'
     
     id: int | None = None
+    resume: bool = False
     save_intermediate_images: bool = False
     save_final_images: bool = False
+    final_image_max_size: int = default.DEFAULT_FINAL_IMAGE_MAX_SIZE
     name: str = default.DEFAULT_RUN_NAME
     output_dir: Path = default.DEFAULT_OUTPUT_DIR
     model: Path = default.DEFAULT_MODEL
     tile_rows: int = default.DEFAULT_TILE_ROWS
     tile_columns: int = default.DEFAULT_TILE_COLUMNS
+    tile_size: int | None = None
+    tile_overlap: int = default.DEFAULT_TILE_OVERLAP
+    match_model_input: bool = False
+    min_foreground: float = default.DEFAULT_MIN_FOREGROUND
+    out_of_core: bool = False
+    scratch_dir: Path | None = None
+    keep_scratch: bool = False
+    workers: int = default.DEFAULT_WORKERS
+    sam_batch_size: int = default.DEFAULT_SAM_BATCH_SIZE
+    sam_dist_thresh: float = default.DEFAULT_SAM_DIST_THRESH
+    sam_cache_dir: Path | None = None
+    sam_cache_size: int = default.DEFAULT_SAM_CACHE_SIZE
+    sam_embedding_cache_size: int = default.DEFAULT_SAM_EMBEDDING_CACHE_SIZE
+    sam_embedding_cache_dir: Path | None = None
+    sam_embedding_cache_disk_size: int = default.DEFAULT_SAM_EMBEDDING_CACHE_DISK_SIZE
+    sam_precision: str = default.DEFAULT_SAM_PRECISION
+    sam_backend: str = default.DEFAULT_SAM_BACKEND
+    sam_onnx_dir: Path | None = None
+    sam_onnx_intra_threads: int = default.DEFAULT_SAM_ONNX_INTRA_THREADS
+    sam_onnx_inter_threads: int = default.DEFAULT_SAM_ONNX_INTER_THREADS
+    sam_server: bool = default.DEFAULT_SAM_SERVER
+    sam_server_timeout: float = default.DEFAULT_SAM_SERVER_TIMEOUT
+    sam_socket: Path = default.DEFAULT_SAM_SOCKET
+    prefetch_depth: int = default.DEFAULT_PREFETCH_DEPTH
+    prefetch_workers: int = default.DEFAULT_PREFETCH_WORKERS
+    prefetch_max_bytes: int = default.DEFAULT_PREFETCH_MAX_BYTES
+    tile_queue_depth: int = default.DEFAULT_TILE_QUEUE_DEPTH
+    tile_threads: int = default.DEFAULT_TILE_THREADS
+    prompt_mode: str = default.DEFAULT_PROMPT_MODE
+    prompt_strip_height: int | None = None
+    prompt_strip_overlap: int = default.DEFAULT_PROMPT_STRIP_OVERLAP
     hsv_lower_bound: Tuple[int, int, int] = field(default_factory=lambda: default.DEFAULT_HSV_LOWER_BOUND)
     hsv_upper_bound: Tuple[int, int, int] = field(default_factory=lambda: default.DEFAULT_HSV_UPPER_BOUND)
+    fused_foreground: bool = default.DEFAULT_FUSED_FOREGROUND
+    coco_indent: int = default.DEFAULT_COCO_INDENT
+    trace_memory: bool = default.DEFAULT_TRACE_MEMORY
     
     datasets: List[Path] = field(default_factory=lambda: [])
     
     def validate(self):
         """
-        Validate a configuration. Generates the run ID
+        Validate a configuration. Generates the run ID, or picks the latest run when resuming without ID
         """
         if self.datasets is None:
             raise ValueError("Dataset is required")
         
+        if self.id is None and self.resume:
+            self.id = self._latest_id()
+        
         if self.id is None:
             self.id = self._generate_id()
             
@@ -162,12 +201,32 @@ class SegmentationConfig(BaseConfig):
         
         return next_id + 1
     
+    def _latest_id(self) -> int | None:
+        """
+        Returns the ID of the latest run, None if there is no run yet
+        """
+        run_dir = self.output_dir / self.name
+        
+        if not run_dir.is_dir():
+            return None
+        
+        ids = [int(p.name) for p in run_dir.iterdir() if p.is_dir() and p.name.isdigit()]
+        
+        return max(ids, default=None)
+    
     def create_run_folder(self):
         """
         Create run folder
         """
         self.base_output_dir.mkdir(parents=True, exist_ok=True)
         
+    @property
+    def scratch_path(self) -> Path:
+        """
+        Directory of the raw image caches and label canvases of out-of-core runs. Shared by the runs of `output_dir`
+        """
+        return self.scratch_dir or self.output_dir / '.scratch'
+    
     @property
     def base_output_dir(self) -> Path:
         return Path(os.path.join(self.output_dir, self.name, str(self.id)))
@@ -1,4 +1,6 @@
+import getpass
 import os
+import tempfile
 from pathlib import Path
 
 PROJECT_ROOT_DIR = Path(Path(__file__).parent.parent.parent.parent.as_posix())
@@ -18,6 +20,55 @@ BIIGLE_MODEL_FILES_DIR = Path(os.path.join(PROJECT_ROOT_DIR, 'data', 'biigle'))
 # Segmentation default values
 DEFAULT_HSV_LOWER_BOUND = [90,  40,  40]
 DEFAULT_HSV_UPPER_BOUND = [145, 255, 255]
+DEFAULT_FUSED_FOREGROUND = True
 
-DEFAULT_TILE_ROWS = 5
-DEFAULT_TILE_COLUMNS = 5
\ No newline at end of file
+DEFAULT_TILE_ROWS = 8
+DEFAULT_TILE_COLUMNS = 8
+DEFAULT_TILE_OVERLAP = 10
+
+DEFAULT_MIN_FOREGROUND = 0.0
+
+DEFAULT_WORKERS = 1
+
+DEFAULT_PREFETCH_DEPTH = 2
+DEFAULT_PREFETCH_WORKERS = 1
+DEFAULT_PREFETCH_MAX_BYTES = 2 * 1024**3
+
+DEFAULT_TILE_QUEUE_DEPTH = 2
+DEFAULT_TILE_THREADS = 1
+
+DEFAULT_PROMPT_MODE = 'tile'
+DEFAULT_PROMPT_STRIP_OVERLAP = 64
+
+DEFAULT_SAM_BATCH_SIZE = 1
+DEFAULT_SAM_DIST_THRESH = 20
+DEFAULT_SAM_CACHE_SIZE = 10 * 1024**3
+DEFAULT_SAM_EMBEDDING_CACHE_SIZE = 0
+DEFAULT_SAM_EMBEDDING_CACHE_DISK_SIZE = 20 * 1024**3
+DEFAULT_SERVE_EMBEDDING_CACHE_SIZE = 2 * 1024**3
+DEFAULT_SAM_PRECISION = 'fp32'
+DEFAULT_SAM_BACKEND = 'ultralytics'
+DEFAULT_SAM_ONNX_INTRA_THREADS = 0
+DEFAULT_SAM_ONNX_INTER_THREADS = 0
+DEFAULT_SAM_SERVER = False
+DEFAULT_SAM_SERVER_TIMEOUT = 600
+
+def _default_sam_socket() -> Path:
+    """Per-user socket of the SAM server: in `$XDG_RUNTIME_DIR` if set, else in the temporary directory with the user ID in its name
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+
+    if runtime_dir:
+        return Path(runtime_dir) / 'sfai-sam.sock'
+
+    uid = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+
+    return Path(os.path.join(tempfile.gettempdir(), f'sfai-sam-{uid}.sock'))
+
+DEFAULT_SAM_SOCKET = _default_sam_socket()
+
+DEFAULT_COCO_INDENT = 2
+
+DEFAULT_TRACE_MEMORY = False
+
+DEFAULT_FINAL_IMAGE_MAX_SIZE = 4096
@@ -1,4 +1,5 @@
-from .dataset import Dataset, ImageFolderDataset, SingleImageDataset, ImageInfo, generate_datasets
+from .dataset import Dataset, ImageFolderDataset, SingleImageDataset, ImageInfo, generate_datasets, read_image
+from .prefetch import PrefetchDataset
 from .tiler import Tile, ImageTiler
 
 __all__ = [
@@ -7,6 +8,8 @@ __all__ = [
     "SingleImageDataset",
     "ImageInfo",
     "generate_datasets",
+    "read_image",
+    "PrefetchDataset",
     "Tile",
     "ImageTiler"
 ]
\ No newline at end of file
@@ -2,7 +2,10 @@ from abc import ABC, abstractmethod
 from pathlib import Path
 import cv2
 from dataclasses import dataclass
-from typing import List
+from typing import Iterable, Iterator, List, Set, Tuple
+import numpy as np
+
+from sfai.data.windowed import WINDOWED_EXTENSIONS, open_windowed, remove_windowed_cache
 
 @dataclass
 class ImageInfo:
@@ -16,14 +19,87 @@ class ImageInfo:
     width: int
     height: int
 
+def read_image(id: int, path: Path, cache_dir: Path | None = None) -> Tuple[ImageInfo, np.ndarray]:
+    """
+    Reads an image from disk and builds its ImageInfo
+
+    Args:
+        id (int): ID given to the image
+        path (Path): Path to the image
+        cache_dir (Path | None, optional): If set, the image is opened as a memory map (see `open_windowed`) with its raw cache in this directory. Defaults to None.
+
+    Returns:
+        (Tuple[ImageInfo, np.ndarray]): Image informations and the image
+    """
+    if cache_dir is not None:
+        img = open_windowed(path, cache_dir)
+    else:
+        img = cv2.imread(str(path))
+    
+    info = ImageInfo(
+        id=id,
+        name=path.stem,
+        file_name=path.name,
+        path=path,
+        height=img.shape[0],
+        width=img.shape[1]
+    )
+    
+    return info, img
+
 class Dataset(ABC):
     """
     Base abstract class for datasets.
+
+    Images are identified by their 1-based position in `paths`.
     """
+    paths: List[Path]
+    skipped: Set[int] = frozenset()
+    cache_dir: Path | None = None
+    
     @abstractmethod
     def __iter__(self):
         pass
     
+    def skip(self, ids: Iterable[int]):
+        """Excludes images from the iteration, e.g. images already segmented by a resumed run.
+
+        Args:
+            ids (Iterable[int]): IDs of the images to skip
+        """
+        self.skipped = set(ids)
+    
+    def read(self, id: int, path: Path) -> Tuple[ImageInfo, np.ndarray]:
+        """Reads an image of the dataset. Images are memory-mapped when the dataset has a `cache_dir`.
+
+        Args:
+            id (int): Image ID
+            path (Path): Image path
+
+        Returns:
+            (Tuple[ImageInfo, np.ndarray]): Image informations and the image
+        """
+        return read_image(id, path, self.cache_dir)
+    
+    def items(self) -> Iterator[Tuple[int, Path]]:
+        """Iterates over the IDs and paths of the images to process, skipped images excluded.
+
+        Yields:
+            (Tuple[int, Path]): Image ID and path
+        """
+        for id, path in enumerate(self.paths, 1):
+            if id not in self.skipped:
+                yield id, path
+    
+    def remove_caches(self):
+        """Removes the raw caches of the images of the dataset, if it has a `cache_dir`
+        """
+        if self.cache_dir is None:
+            return
+
+        for path in self.paths:
+            remove_windowed_cache(path, self.cache_dir)
+    
     @property
     @abstractmethod
     def length(self):
@@ -36,16 +112,22 @@ class ImageFolderDataset(Dataset):
     Args:
         root (Path): Path to the folder
         extensions (List[str], optional): Specific extensions to look for. Default is ['.jpg', '.jpeg', '.png']
+        cache_dir (Path | None, optional): If set, images are memory-mapped and TIFF and `.npy` files are also read. Defaults to None.
     
     Attributes:
         root (Path): Base directory
         extensions (List[str], optional): Specific extensions to look for. Default is ['.jpg', '.jpeg', '.png']
     """
-    def __init__(self, root: Path, extensions=['.jpg', '.jpeg', '.png']):
+    def __init__(self, root: Path, extensions=['.jpg', '.jpeg', '.png'], cache_dir: Path | None = None):
         self.root = root
         self.paths = []
+        self.cache_dir = cache_dir
+        
+        if cache_dir is not None:
+            extensions = extensions + WINDOWED_EXTENSIONS
 
-        for p in root.iterdir():
+        # Sorted, so image IDs are the same from a run to another
+        for p in sorted(root.iterdir()):
             if p.suffix.lower() in extensions:
                 self.paths.append(p)
         
@@ -56,19 +138,8 @@ class ImageFolderDataset(Dataset):
         Yields:
             (Tuple[ImageInfo, np.ndarray]): _description_
         """
-        for id, path in enumerate(self.paths, 1):
-            img = cv2.imread(str(path))
-            
-            info = ImageInfo(
-                id=id,
-                name=path.stem,
-                file_name=path.name,
-                path=path,
-                height=img.shape[0],
-                width=img.shape[1]
-            )
-            
-            yield info, img
+        for id, path in self.items():
+            yield self.read(id, path)
     
     @property
     def length(self):
@@ -80,16 +151,23 @@ class SingleImageDataset(Dataset):
 
     Args:
         path (Path): Path to the image
+        cache_dir (Path | None, optional): If set, the image is memory-mapped and can also be a TIFF or `.npy` file. Defaults to None.
     
     Attributes:
         root (Path): Root directory
         paths (List[Path]): List of images (contains a single image by definition)
     """
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, cache_dir: Path | None = None):
         self.root = path.parent
         self.paths = []
+        self.cache_dir = cache_dir
+        
+        extensions = ['.jpg', '.jpeg', '.png']
+        
+        if cache_dir is not None:
+            extensions = extensions + WINDOWED_EXTENSIONS
         
-        if path.is_file() and path.suffix.lower() in ['.jpg', '.jpeg', '.png']:
+        if path.is_file() and path.suffix.lower() in extensions:
             self.paths.append(path)
             
     def __iter__(self):
@@ -99,19 +177,8 @@ class SingleImageDataset(Dataset):
         Yields:
             (Tuple[ImageInfo, np.ndarray]): _description_
         """
-        for id, path in enumerate(self.paths, 1):
-            img = cv2.imread(str(path))
-            
-            info = ImageInfo(
-                id=id,
-                name=path.stem,
-                file_name=path.name,
-                path=path,
-                height=img.shape[0],
-                width=img.shape[1]
-            )
-            
-            yield info, img
+        for id, path in self.items():
+            yield self.read(id, path)
     
     @property
     def length(self):
@@ -120,12 +187,13 @@ class SingleImageDataset(Dataset):
         """
         return len(self.paths)
             
-def generate_datasets(datasets: List[Path]) -> List[Dataset]:
+def generate_datasets(datasets: List[Path], cache_dir: Path | None = None) -> List[Dataset]:
     """
     Utility method to generate datasets from a list of path
     
     Args:
         datasets (List[Path]): List of path to images or folders
+        cache_dir (Path | None, optional): If set, images are memory-mapped, with their raw caches in this directory. Defaults to None.
     
     Returns:
         (List[Dataset]): List of Dataset objects.
@@ -135,11 +203,11 @@ def generate_datasets(datasets: List[Path]) -> List[Dataset]:
     for path in datasets:
         if path.is_file():
             out.append(
-                SingleImageDataset(path)
+                SingleImageDataset(path, cache_dir=cache_dir)
             )
         else:
             out.append(
-                ImageFolderDataset(path)
+                ImageFolderDataset(path, cache_dir=cache_dir)
             )
             
     return out
@@ -0,0 +1,124 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Deque, Iterable, Iterator, Tuple
+
+from sfai.data.dataset import Dataset
+
+def decoded_size(path: Path) -> int | None:
+    """Returns the size in bytes of an image once decoded by OpenCV, without decoding it.
+
+    Only the image header is read. OpenCV decodes images as 3 channels of 8 bits.
+
+    Args:
+        path (Path): Path to the image
+
+    Returns:
+        int | None: Size in bytes, None if the header cannot be read
+    """
+    try:
+        from PIL import Image
+
+        with Image.open(path) as img:
+            width, height = img.size
+    except Exception:
+        return None
+
+    return width * height * 3
+
+class PrefetchDataset(Dataset):
+    """Dataset wrapper that decodes the next images in background threads while the current one is processed.
+
+    Images are yielded in the order of the wrapped dataset, as the same `(ImageInfo, np.ndarray)` tuples.
+    The decoded images held by the prefetcher (queued or being decoded) and the last image yielded,
+    which the consumer holds until it gets the next one, are kept under `max_bytes`. The cap is soft: image sizes are estimated from their
+    headers, and at least one image is always prefetched, even if it goes over the cap on its own.
+
+    Args:
+        dataset (Dataset): Dataset to prefetch. Must expose `root` and `paths`.
+        depth (int, optional): Maximum number of images decoded ahead. Defaults to 2.
+        workers (int, optional): Number of decoding threads. Defaults to 1.
+        max_bytes (int, optional): Soft memory cap of the prefetched images in bytes, the image being processed included. Defaults to 2 GiB.
+
+    Attributes:
+        root (Path): Root directory of the wrapped dataset
+        paths (List[Path]): Images of the wrapped dataset
+    """
+    def __init__(self, dataset: Dataset, depth: int = 2, workers: int = 1, max_bytes: int = 2 * 1024**3):
+        self.dataset = dataset
+        self.root = dataset.root
+        self.paths = dataset.paths
+        self.cache_dir = dataset.cache_dir
+
+        self.depth = max(depth, 1)
+        self.workers = max(workers, 1)
+        self.max_bytes = max_bytes
+
+    def __iter__(self):
+        """Iterates over the dataset
+
+        Yields:
+            (Tuple[ImageInfo, np.ndarray]): Image informations and decoded image
+        """
+        tasks = self.items()
+        pending: Deque[Tuple[Future, int]] = deque()
+        reserved = 0
+        current = 0
+        largest = 0
+
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sfai-prefetch')
+
+        try:
+            task = next(tasks, None)
+            size = 0
+
+            while True:
+                while task is not None and len(pending) < self.depth:
+                    id, path = task
+
+                    if not size:
+                        # Unreadable headers are budgeted as the largest image seen so far,
+                        # or as the whole budget before any image is decoded
+                        size = decoded_size(path) or largest or self.max_bytes
+
+                    if pending and reserved + size > self.max_bytes:
+                        break
+
+                    pending.append((executor.submit(self.dataset.read, id, path), size))
+                    reserved += size
+
+                    task = next(tasks, None)
+                    size = 0
+
+                if not pending:
+                    return
+
+                future, reservation = pending.popleft()
+                info, img = future.result()
+
+                largest = max(largest, img.nbytes)
+
+                # The consumer holds an image until it gets the next one, e.g. in a `for` loop variable
+                reserved -= current
+                current = reservation
+
+                yield info, img
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def skip(self, ids: Iterable[int]):
+        """Excludes images from the iteration. See `Dataset.skip`.
+        """
+        self.dataset.skip(ids)
+    
+    def items(self) -> Iterator[Tuple[int, Path]]:
+        """Iterates over the IDs and paths of the wrapped dataset. See `Dataset.items`.
+        """
+        return self.dataset.items()
+
+    @property
+    def length(self):
+        """
+        Number of files in the dataset
+        """
+        return self.dataset.length
@@ -1,5 +1,7 @@
+import math
 import numpy as np
 from dataclasses import dataclass
+from typing import Iterator
 
 @dataclass
 class Tile:
@@ -21,15 +23,70 @@ class Tile:
 class ImageTiler:
     """Utility class to split an image into multiple tiles.
 
-    Attributes:
+    The image is split into an even grid: cells differ by at most one pixel, and each tile is its
+    cell extended by `overlap` pixels on every side (clipped to the image). With `tile_size`, the
+    grid adapts to the image so that tiles, overlap included, are at most `tile_size` pixels.
+    Otherwise, the grid is always `rows` x `cols`.
+
+    Args:
         rows (int, optional): Number of rows. Defaults to 5.
         cols (int, optional): Number of columns. Defaults to 5.
         overlap (int, optional): Overlap between tiles in pixels. Defaults to 10.
+        tile_size (int | None, optional): Maximum tile size in pixels. Overrides `rows` and `cols`. Defaults to None.
+
+    Attributes:
+        rows (int): Number of rows, unless `tile_size` is set.
+        cols (int): Number of columns, unless `tile_size` is set.
+        overlap (int): Overlap between tiles in pixels.
+        tile_size (int | None): Maximum tile size in pixels.
     """
-    def __init__(self, rows: int = 5, cols: int = 5, overlap: int = 10):
+    def __init__(self, rows: int = 5, cols: int = 5, overlap: int = 10, tile_size: int | None = None):
+        if tile_size is not None and tile_size <= 2 * overlap:
+            raise ValueError(f"Tile size ({tile_size}) must be larger than twice the overlap ({overlap})")
+        
         self.rows = rows
         self.cols = cols
         self.overlap = overlap
+        self.tile_size = tile_size
+    
+    def grid(self, h: int, w: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the cell edges of the grid of an image
+
+        Args:
+            h (int): Image height
+            w (int): Image width
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Row edges (rows + 1) and column edges (cols + 1)
+        """
+        if self.tile_size is not None:
+            cell = self.tile_size - 2 * self.overlap
+            rows, cols = math.ceil(h / cell), math.ceil(w / cell)
+        else:
+            rows, cols = self.rows, self.cols
+        
+        # No empty cells on images smaller than the grid
+        rows = min(max(rows, 1), h)
+        cols = min(max(cols, 1), w)
+        
+        ys = np.linspace(0, h, rows + 1).round().astype(int)
+        xs = np.linspace(0, w, cols + 1).round().astype(int)
+        
+        return ys, xs
+        
+    def count(self, h: int, w: int) -> int:
+        """Returns the number of tiles of an image
+
+        Args:
+            h (int): Image height
+            w (int): Image width
+
+        Returns:
+            int: Number of tiles
+        """
+        ys, xs = self.grid(h, w)
+        
+        return (len(ys) - 1) * (len(xs) - 1)
         
     def split(self, image: np.ndarray) -> list[Tile]:
         """Returns a list of tiles generated from the input image.
@@ -40,30 +97,33 @@ class ImageTiler:
         Returns:
             list[Tile]:
         """
-        h, w = image.shape[:2]
-        
-        tiles = []
+        return list(self.iter_tiles(image))
+    
+    def iter_tiles(self, image: np.ndarray) -> Iterator[Tile]:
+        """Generates the tiles of the input image, row by row. Tile images are views on the input image.
+
+        Args:
+            image (np.ndarray):
 
-        tile_y = h//self.rows
-        tile_x = w//self.cols
+        Yields:
+            Tile:
+        """
+        h, w = image.shape[:2]
+        ys, xs = self.grid(h, w)
 
-        for y in range(0, h, tile_y):
-            for x in range(0, w, tile_x):
-                x1 = max(x-self.overlap, 0)
-                y1 = max(y-self.overlap, 0)
-                x2 = min(x + tile_x + self.overlap, w)
-                y2 = min(y + tile_y + self.overlap, h)
+        for y, y_end in zip(ys[:-1], ys[1:]):
+            for x, x_end in zip(xs[:-1], xs[1:]):
+                x1 = max(int(x) - self.overlap, 0)
+                y1 = max(int(y) - self.overlap, 0)
+                x2 = min(int(x_end) + self.overlap, w)
+                y2 = min(int(y_end) + self.overlap, h)
                 tile = image[y1:y2, x1:x2]
-                center = ((x2//2), (y2//2))
+                center = ((x1 + x2) // 2, (y1 + y2) // 2)
                 coords = (x1, y1, x2, y2)
-                tiles.append(
-                    Tile(
-                        image=tile,
-                        center=center,
-                        coords=coords,
-                        width=tile.shape[1],
-                        height=tile.shape[0]
-                    )
-                )
-                
-        return tiles
\ No newline at end of file
+                yield Tile(
+                    image=tile,
+                    center=center,
+                    coords=coords,
+                    width=tile.shape[1],
+                    height=tile.shape[0]
+                )
\ No newline at end of file
@@ -0,0 +1,146 @@
+import hashlib
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+WINDOWED_EXTENSIONS = ['.tif', '.tiff', '.npy']
+"""Extensions read in windowed mode only, on top of the regular image extensions
+"""
+
+BLOCK_ROWS = 1024
+"""Number of rows converted at once when building a raw cache
+"""
+
+def open_windowed(path: Path, cache_dir: Path) -> np.ndarray:
+    """Opens an image as a read-only memory map, so that tiles are read from disk on demand.
+
+    `.npy` files (BGR, uint8, H x W x 3) are mapped directly. Other images are decoded once into a
+    raw `.npy` cache in `cache_dir`, reused as long as the source file is unchanged (see
+    `remove_windowed_cache`). TIFF files are decoded straight into the cache with `tifffile`, so they
+    never have to fit in memory. Other formats are decoded in memory once with OpenCV.
+
+    Args:
+        path (Path): Path to the image
+        cache_dir (Path): Directory of the raw caches
+
+    Returns:
+        np.ndarray: Memory-mapped BGR image (H x W x 3, uint8)
+
+    Raises:
+        RuntimeError: If the image is a TIFF file and `tifffile` is not installed
+    """
+    if path.suffix.lower() == '.npy':
+        return np.load(path, mmap_mode='r')
+
+    cache = cache_dir / f'{_cache_key(path)}.npy'
+
+    if not cache.exists():
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = cache.with_suffix(f'.{os.getpid()}.tmp')
+
+        try:
+            if path.suffix.lower() in ['.tif', '.tiff']:
+                _decode_tiff(path, tmp)
+            else:
+                _decode_opencv(path, tmp)
+
+            os.replace(tmp, cache)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    return np.load(cache, mmap_mode='r')
+
+def _cache_key(path: Path) -> str:
+    """Key of the raw cache of an image: its absolute path, size and modification time
+    """
+    stat = path.stat()
+    source = f'{path.absolute()}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    return hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
+def remove_windowed_cache(path: Path, cache_dir: Path):
+    """Removes the raw cache of an image, if any. Memory maps already opened on it stay valid.
+
+    Args:
+        path (Path): Path to the image
+        cache_dir (Path): Directory of the raw caches
+    """
+    if path.suffix.lower() == '.npy':
+        return
+
+    try:
+        (cache_dir / f'{_cache_key(path)}.npy').unlink(missing_ok=True)
+    except FileNotFoundError:
+        # Source image removed during the run, its cache cannot be found anymore
+        pass
+
+def load_tifffile():
+    try:
+        import tifffile
+
+        return tifffile
+    except ImportError as e:
+        # OpenCV would decode the whole image in memory, which out-of-core runs are meant to avoid
+        raise RuntimeError(
+            'tifffile is not installed, TIFF images cannot be read out of core. '
+            'Install it by running pip install ".[tiff]"'
+        ) from e
+
+def _decode_opencv(path: Path, out: Path):
+    """Decodes an image with OpenCV and writes it as a `.npy` file
+    """
+    img = cv2.imread(str(path))
+
+    if img is None:
+        raise ValueError(f'Cannot read image {path}')
+
+    raw = np.lib.format.open_memmap(out, mode='w+', dtype=np.uint8, shape=img.shape)
+    raw[:] = img
+    raw.flush()
+
+def _decode_tiff(path: Path, out: Path):
+    """Decodes the first page of a TIFF file into a `.npy` file, without holding it in memory.
+
+    The page is decoded into a temporary memory map, then converted to BGR by blocks of rows.
+    Gray, gray with alpha, RGB and RGBA pages are supported, with contiguous or planar samples.
+    """
+    tifffile = load_tifffile()
+
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages[0]
+        samples = page.samplesperpixel
+        planar = samples > 1 and page.planarconfig == tifffile.PLANARCONFIG.SEPARATE
+
+        if page.dtype != np.uint8 or samples not in (1, 2, 3, 4) or len(page.shape) != (2 if samples == 1 else 3):
+            raise ValueError(f'Unsupported TIFF {path}: {page.shape} {page.dtype}. 8 bits gray, RGB or RGBA images are supported')
+
+        decoded_path = out.with_suffix('.decoded.tmp')
+
+        try:
+            decoded = np.lib.format.open_memmap(decoded_path, mode='w+', dtype=np.uint8, shape=page.shape)
+            page.asarray(out=decoded)
+
+            # Planar pages are (samples, H, W)
+            h, w = page.shape[1:] if planar else page.shape[:2]
+            raw = np.lib.format.open_memmap(out, mode='w+', dtype=np.uint8, shape=(h, w, 3))
+
+            for start in range(0, h, BLOCK_ROWS):
+                if planar:
+                    block = np.moveaxis(np.asarray(decoded[:, start:start + BLOCK_ROWS]), 0, -1)
+                else:
+                    block = np.asarray(decoded[start:start + BLOCK_ROWS])
+
+                if samples == 1:
+                    raw[start:start + BLOCK_ROWS] = block[..., None]
+                elif samples == 2:
+                    # Gray and alpha
+                    raw[start:start + BLOCK_ROWS] = block[..., :1]
+                else:
+                    raw[start:start + BLOCK_ROWS] = block[..., 2::-1]
+
+            raw.flush()
+            del decoded, raw
+        finally:
+            decoded_path.unlink(missing_ok=True)
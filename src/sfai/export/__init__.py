@@ -1,5 +1,6 @@
-from .writer import JsonlWriter, JsonlBufferedWriter, CocoWriter
+from .writer import JsonlWriter, JsonlBufferedWriter, CocoWriter, StreamingCocoWriter
 from .handler import OutputHandler
+from .artifacts import ArtifactWriter, get_artifact_writer
 
 """
 Module handling export logic
@@ -8,5 +9,8 @@ __all__ = [
     "JsonlWriter",
     "JsonlBufferedWriter",
     "CocoWriter",
+    "StreamingCocoWriter",
     "OutputHandler",
+    "ArtifactWriter",
+    "get_artifact_writer",
 ]
\ No newline at end of file
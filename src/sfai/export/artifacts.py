@@ -0,0 +1,158 @@
+import queue
+import threading
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import cv2
+import numpy as np
+
+from sfai.logging import LOGGER
+
+_NIPY_SPECTRAL = {
+    'red': [0.0, 0.4667, 0.5333, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.7333, 0.9333, 1.0, 1.0, 1.0, 0.8667, 0.8, 0.8],
+    'green': [0.0, 0.0, 0.0, 0.0, 0.0, 0.4667, 0.6, 0.6667, 0.6667, 0.6, 0.7333, 0.8667, 1.0, 1.0, 0.9333, 0.8, 0.6, 0.0, 0.0, 0.0, 0.8],
+    'blue': [0.0, 0.5333, 0.6, 0.6667, 0.8667, 0.8667, 0.8667, 0.6667, 0.5333, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.8],
+}
+"""Matplotlib `nipy_spectral` colormap, sampled every 0.05
+"""
+
+def _build_luts() -> Dict[str, np.ndarray]:
+    """Builds the 256 entries BGR lookup tables of the supported colormaps
+    """
+    x = np.linspace(0, 1, 256)
+    anchors = np.linspace(0, 1, 21)
+
+    nipy_spectral = np.stack([
+        np.interp(x, anchors, _NIPY_SPECTRAL[channel])
+        for channel in ('blue', 'green', 'red')
+    ], axis=1)
+
+    gray = np.repeat(x[:, None], 3, axis=1)
+
+    return {
+        'nipy_spectral': (nipy_spectral * 255).astype(np.uint8),
+        'gray': (gray * 255).astype(np.uint8),
+    }
+
+COLORMAPS = _build_luts()
+"""BGR lookup tables (256 x 3) of the supported colormaps
+"""
+
+def colorize(image: np.ndarray, cmap: str) -> np.ndarray:
+    """Applies a colormap to a single channel image, as `plt.imsave` does: values are scaled from the image minimum to its maximum.
+
+    Args:
+        image (np.ndarray): Single channel image
+        cmap (str): Colormap name. One of `COLORMAPS`.
+
+    Returns:
+        np.ndarray: BGR image
+    """
+    if cmap not in COLORMAPS:
+        raise ValueError(f"Unsupported colormap {cmap}. Supported colormaps: {list(COLORMAPS)}")
+
+    lo, hi = image.min(), image.max()
+
+    if hi > lo:
+        index = (image.astype(np.float32) - lo) * (256 / (hi - lo))
+        index = np.clip(index, 0, 255).astype(np.uint8)
+    else:
+        index = np.zeros(image.shape, dtype=np.uint8)
+
+    return COLORMAPS[cmap][index]
+
+class ArtifactWriter:
+    """Writes debug and result images in background threads.
+
+    Images are encoded with OpenCV. Submitting blocks only when `max_pending` images are already
+    waiting, which bounds the memory held by the queue. Write errors are logged, not raised.
+
+    Args:
+        workers (int, optional): Number of writing threads. Defaults to 2.
+        max_pending (int, optional): Maximum number of queued images. Defaults to 32.
+    """
+    def __init__(self, workers: int = 2, max_pending: int = 32):
+        self.workers = max(workers, 1)
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max(max_pending, 1))
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def submit(self, path: Path | str, image: np.ndarray, cmap: str | None = None, params: Sequence[int] = ()):
+        """Queues an image to write. The image must not be modified afterwards.
+
+        Args:
+            path (Path | str): Output path. The extension sets the format.
+            image (np.ndarray): BGR image, or single channel image
+            cmap (str | None, optional): Colormap applied to a single channel image. Defaults to None.
+            params (Sequence[int], optional): OpenCV `imwrite` parameters. Defaults to ().
+        """
+        self._start()
+        self._queue.put((Path(path), image, cmap, list(params)))
+
+    def flush(self):
+        """Waits until every queued image is written
+        """
+        self._queue.join()
+
+    def close(self):
+        """Writes the queued images and stops the threads
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+
+        for _ in threads:
+            self._queue.put(None)
+
+        for thread in threads:
+            thread.join()
+
+    def _start(self):
+        """Starts the threads on first use
+        """
+        if self._threads:
+            return
+
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name='sfai-artifacts', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+
+            try:
+                if item is None:
+                    return
+
+                path, image, cmap, params = item
+
+                if cmap is not None:
+                    image = colorize(image, cmap)
+
+                if not cv2.imwrite(str(path), image, params):
+                    LOGGER.warning(f'Cannot write artifact {path}')
+            except Exception as e:
+                LOGGER.warning(f'Cannot write artifact: {e}')
+            finally:
+                self._queue.task_done()
+
+_ARTIFACT_WRITER: ArtifactWriter | None = None
+_ARTIFACT_WRITER_LOCK = threading.Lock()
+
+def get_artifact_writer() -> ArtifactWriter:
+    """Returns the artifact writer of the process. Created on first use.
+
+    Returns:
+        ArtifactWriter:
+    """
+    global _ARTIFACT_WRITER
+
+    # Operators of several tiles can save artifacts from different threads
+    with _ARTIFACT_WRITER_LOCK:
+        if _ARTIFACT_WRITER is None:
+            _ARTIFACT_WRITER = ArtifactWriter()
+
+    return _ARTIFACT_WRITER
@@ -61,4 +61,11 @@ class OutputHandler:
     @property
     def categories_jsonl_path(self) -> Path:
         return Path(os.path.join(self.annotation_dir, 'categories.jsonl'))
-        
\ No newline at end of file
+    
+    @property
+    def metrics_jsonl_path(self) -> Path:
+        return Path(os.path.join(self.base_dir, 'metrics.jsonl'))
+    
+    @property
+    def metrics_summary_path(self) -> Path:
+        return Path(os.path.join(self.base_dir, 'metrics.txt'))
@@ -0,0 +1,93 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterator, Set, Tuple
+
+
+def _complete_records(path: Path) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Reads the complete records of a JSONL file. Stops at the first partially written line.
+
+    Args:
+        path (Path): Path to the JSONL file
+
+    Yields:
+        Tuple[int, Dict[str, Any]]: File offset right after the record, and the record
+    """
+    offset = 0
+
+    with path.open('rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                return
+
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    return
+            else:
+                record = None
+
+            offset += len(line)
+
+            if record is not None:
+                yield offset, record
+
+def _truncate(path: Path, size: int):
+    """Truncates a file if it is larger than `size`
+    """
+    if path.stat().st_size > size:
+        with path.open('r+b') as f:
+            f.truncate(size)
+
+def restore_checkpoint(images_jsonl: Path, annotations_jsonl: Path, metrics_jsonl: Path | None = None) -> Tuple[Set[int], int]:
+    """Restores the JSONL files of an interrupted run to their last checkpoint.
+
+    An image is committed once its record is in the images file. Its annotations are written before
+    it, so anything after the annotations of the last committed image belongs to an image that was
+    being written when the run stopped. Partially written lines and uncommitted annotations are
+    truncated. Measurements are written after the image record, the metrics file is truncated to
+    the records of committed images.
+
+    Args:
+        images_jsonl (Path): Path to the images JSONL file
+        annotations_jsonl (Path): Path to the annotations JSONL file
+        metrics_jsonl (Path | None, optional): Path to the metrics JSONL file. Defaults to None.
+
+    Returns:
+        Tuple[Set[int], int]: IDs of the committed images, and the next annotation ID
+    """
+    committed: Set[int] = set()
+    next_annotation_id = 1
+
+    if images_jsonl.exists():
+        end = 0
+
+        for end, record in _complete_records(images_jsonl):
+            committed.add(record['id'])
+
+        _truncate(images_jsonl, end)
+
+    if annotations_jsonl.exists():
+        end = 0
+
+        for offset, record in _complete_records(annotations_jsonl):
+            if record['image_id'] not in committed:
+                break
+
+            end = offset
+            next_annotation_id = max(next_annotation_id, record['id'] + 1)
+
+        _truncate(annotations_jsonl, end)
+
+    if metrics_jsonl is not None and metrics_jsonl.exists():
+        end = 0
+
+        for offset, record in _complete_records(metrics_jsonl):
+            if record.get('image_id') not in committed:
+                break
+
+            end = offset
+
+        _truncate(metrics_jsonl, end)
+
+    return committed, next_annotation_id
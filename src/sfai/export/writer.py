@@ -1,6 +1,6 @@
 import json
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Iterator, List, Dict, Any, TextIO
 from sfai.export.data import CocoAnnotation, CocoCategory, CocoImage, Writable
 
 class JsonlWriter:
@@ -183,4 +183,86 @@ class CocoWriter:
         coco = self.build_coco()
         
         with self.output_path.open('x', encoding='utf-8') as f:
-            json.dump(coco, f, indent=2)
\ No newline at end of file
+            json.dump(coco, f, indent=2)
+
+class StreamingCocoWriter(CocoWriter):
+    """COCO objects writer that streams the JSONL files into the COCO annotations file.
+
+    Lines are copied one at a time into the `images` and `annotations` arrays, so memory use does not
+    depend on the number of annotations. Without indentation, lines are copied as is. With indentation,
+    each line is parsed and indented again, the output is the same as `CocoWriter`.
+
+    Args:
+        images_jsonl (Path): Path to the images JSONL file
+        annotations_jsonl (Path): Path to the annotations JSON file
+        categories (List[CocoCategory]): List of COCO Category to write
+        output_path (Path):
+        indent (int | None, optional): Indentation of the output file. None or 0 writes a compact file. Defaults to 2.
+    """
+    def __init__(
+        self,
+        images_jsonl: Path,
+        annotations_jsonl: Path,
+        categories: List[CocoCategory],
+        output_path: Path,
+        indent: int | None = 2
+    ):
+        super().__init__(images_jsonl, annotations_jsonl, categories, output_path)
+        self.indent = indent or None
+
+    def write(self) -> None:
+        """Writes COCO annotations to the output file
+        """
+        categories = (json.dumps(cat.to_dict()) for cat in self.categories)
+
+        with self.output_path.open('x', encoding='utf-8') as f:
+            f.write('{')
+            self._write_array(f, 'images', self._iter_jsonl(self.images_jsonl), first=True)
+            self._write_array(f, 'annotations', self._iter_jsonl(self.annotations_jsonl))
+            self._write_array(f, 'categories', categories)
+            f.write('\n}' if self.indent else '}')
+
+    def _iter_jsonl(self, path: Path) -> Iterator[str]:
+        """Iterates over the non-empty lines of a JSONL file
+
+        Args:
+            path (Path): Path to the JSONL file
+
+        Yields:
+            str: JSON object, without line ending
+        """
+        with path.open('r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+    def _write_array(self, f: TextIO, key: str, items: Iterator[str], first: bool = False):
+        """Writes a key and its array of JSON objects, laid out as `json.dump` does
+
+        Args:
+            f (TextIO): Output file
+            key (str): Key of the array
+            items (Iterator[str]): Compact JSON objects
+            first (bool, optional): Whether this is the first key of the file. Defaults to False.
+        """
+        if self.indent:
+            outer = '\n' + ' ' * self.indent
+            inner = outer + ' ' * self.indent
+            item_separator = ','
+        else:
+            outer = inner = ''
+            item_separator = ', '
+
+        f.write(('' if first else item_separator) + outer + json.dumps(key) + ': [')
+
+        empty = True
+
+        for item in items:
+            if self.indent:
+                item = json.dumps(json.loads(item), indent=self.indent).replace('\n', inner)
+
+            f.write(('' if empty else item_separator) + inner + item)
+            empty = False
+
+        f.write(']' if empty else outer + ']')
@@ -1,5 +1,7 @@
 from .processor import MaskProcessor
+from .merge import MaskMerger
 
 __all__ = [
-    "MaskProcessor"
+    "MaskProcessor",
+    "MaskMerger"
 ]
\ No newline at end of file
@@ -0,0 +1,164 @@
+import numpy as np
+
+from typing import Any, List, Tuple
+
+
+class MaskMerger:
+    """Merges overlapping object masks predicted on a tile.
+
+    Masks are visited by decreasing area. A mask is merged into the first already merged mask
+    with an IoU above `iou_thresh`, or that covers more than `inclusion_thresh` of it. Otherwise
+    it is kept as a new object.
+
+    Args:
+        iou_thresh (float, optional): IoU threshold. Defaults to 0.5.
+        inclusion_thresh (float, optional): Inclusion threshold. Defaults to 0.9.
+    """
+    def __init__(self, iou_thresh: float = 0.5, inclusion_thresh: float = 0.9):
+        self.iou_thresh = iou_thresh
+        self.inclusion_thresh = inclusion_thresh
+
+    @staticmethod
+    def bounding_boxes(masks: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Computes the areas and bounding-boxes of masks in a single pass
+
+        Args:
+            masks (List[np.ndarray]): Binary masks of the same shape
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Areas (N,) and bounding-boxes (N, 4) as y1, y2, x1, x2 (exclusive). Empty masks get an empty box.
+        """
+        stacked = np.stack(masks).astype(bool, copy=False)
+
+        areas = np.count_nonzero(stacked, axis=(1, 2))
+        rows = stacked.any(axis=2)
+        cols = stacked.any(axis=1)
+
+        boxes = np.stack([
+            rows.argmax(axis=1),
+            rows.shape[1] - rows[:, ::-1].argmax(axis=1),
+            cols.argmax(axis=1),
+            cols.shape[1] - cols[:, ::-1].argmax(axis=1),
+        ], axis=1)
+        boxes[areas == 0] = 0
+
+        return areas, boxes
+
+    def merge(self, masks: List[np.ndarray]) -> Tuple[List[np.ndarray], int]:
+        """Merges binary masks.
+
+        IoU and inclusion are only computed for pairs with overlapping bounding-boxes, on the
+        intersection of both boxes. Areas of the merged masks are kept up to date instead of
+        being recomputed.
+
+        Args:
+            masks (List[np.ndarray]): Binary masks (uint8) of the same shape
+
+        Returns:
+            Tuple[List[np.ndarray], int]: Merged masks and their number
+        """
+        if len(masks) == 0:
+            return [], 0
+
+        areas, boxes = self.bounding_boxes(masks)
+        order = sorted(range(len(masks)), key=lambda i: areas[i], reverse=True)
+
+        merged_masks: List[np.ndarray] = []
+        merged_areas: List[int] = []
+        merged_boxes: List[np.ndarray] = []
+        owned: List[bool] = []
+
+        for i in order:
+            mask = masks[i]
+            mask_area = int(areas[i])
+            y1, y2, x1, x2 = boxes[i]
+            merged = False
+
+            for j, existing in enumerate(merged_masks):
+                ey1, ey2, ex1, ex2 = merged_boxes[j]
+                iy1, iy2, ix1, ix2 = max(y1, ey1), min(y2, ey2), max(x1, ex1), min(x2, ex2)
+
+                if iy1 >= iy2 or ix1 >= ix2:
+                    continue
+
+                intersection = np.count_nonzero(
+                    np.logical_and(existing[iy1:iy2, ix1:ix2], mask[iy1:iy2, ix1:ix2])
+                )
+                union = merged_areas[j] + mask_area - intersection
+                IoU = intersection / union if union > 0 else 0
+                inclusion = intersection / mask_area if mask_area > 0 else 0
+
+                if IoU > self.iou_thresh or inclusion > self.inclusion_thresh:
+                    if not owned[j]:
+                        existing = existing.copy()
+                        merged_masks[j] = existing
+                        owned[j] = True
+
+                    np.logical_or(existing[y1:y2, x1:x2], mask[y1:y2, x1:x2], out=existing[y1:y2, x1:x2], casting='unsafe')
+
+                    merged_areas[j] = union
+                    merged_boxes[j] = np.array([min(y1, ey1), max(y2, ey2), min(x1, ex1), max(x2, ex2)])
+                    merged = True
+                    break
+
+            if not merged:
+                merged_masks.append(mask)
+                merged_areas.append(mask_area)
+                merged_boxes.append(boxes[i])
+                owned.append(False)
+
+        return merged_masks, len(merged_masks)
+
+    def merge_stacked(self, masks: Any) -> Tuple[List[np.ndarray], int]:
+        """Merges a stacked mask tensor on its device.
+
+        Each mask is compared with all the merged masks at once: intersections are a single
+        matrix-vector product over the flattened masks. Meant for torch tensors on GPU, before
+        they are copied to the host.
+
+        Args:
+            masks (torch.Tensor): Binary masks (N, H, W)
+
+        Returns:
+            Tuple[List[np.ndarray], int]: Merged masks (uint8) and their number
+        """
+        n, h, w = masks.shape
+
+        if n == 0:
+            return [], 0
+
+        # float32 holds pixel counts exactly up to 2**24 pixels per tile
+        flat = masks.reshape(n, -1).float()
+        areas = flat.sum(dim=1)
+        order = areas.argsort(descending=True, stable=True).tolist()
+
+        merged = flat.new_zeros(flat.shape)
+        merged_areas = areas.new_zeros(n)
+        count = 0
+
+        for i in order:
+            mask = flat[i]
+            mask_area = areas[i]
+
+            if count > 0:
+                intersection = (merged[:count] @ mask).double()
+                union = merged_areas[:count].double() + float(mask_area) - intersection
+                IoU = (intersection / union).nan_to_num(0)
+                # Empty masks have no intersection, so their inclusion is 0
+                inclusion = intersection / max(float(mask_area), 1.0)
+
+                hits = ((IoU > self.iou_thresh) | (inclusion > self.inclusion_thresh)).nonzero()
+
+                if len(hits) > 0:
+                    j = int(hits[0])
+                    merged[j] = merged[j].maximum(mask)
+                    merged_areas[j] = union[j].float()
+                    continue
+
+            merged[count] = mask
+            merged_areas[count] = mask_area
+            count += 1
+
+        merged_masks = list(merged[:count].reshape(count, h, w).byte().cpu().numpy())
+
+        return merged_masks, count
@@ -2,6 +2,7 @@ import cv2
 import numpy as np
 
 from typing import Iterator, Tuple, List
+from scipy import ndimage
 from shapely import MultiPolygon, Polygon, union_all
 from shapely.geometry.polygon import orient
 from sfai.export.data import CocoAnnotation
@@ -97,12 +98,13 @@ class MaskProcessor:
         epsilon = 0.001 * cv2.arcLength(contour, True)
         return cv2.approxPolyDP(contour, epsilon, True)
             
-    def mask_to_polygons(self, mask: np.ndarray, clean: bool = True) -> List[List[float]]:
+    def mask_to_polygons(self, mask: np.ndarray, clean: bool = True, offset: Tuple[int, int] = (0, 0)) -> List[List[float]]:
         """Converts a mask to a polygon
 
         Args:
             mask (np.ndarray): mask to convert to a polygon
             clean (bool, optional): If mask must be cleaned or not. Defaults to True.
+            offset (Tuple[int, int], optional): (x, y) offset added to the polygons coordinates. Used when the mask is a crop. Defaults to (0, 0).
 
         Returns:
             List[List[float]]: List of polygones
@@ -110,7 +112,7 @@ class MaskProcessor:
         if clean:
             mask = self.clean_mask(mask, 5)
 
-        contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
         polygons: list[Polygon] = []
         
         for i, cnt in enumerate(contours):
@@ -200,9 +202,32 @@ class MaskProcessor:
         """
         return int(np.count_nonzero(mask))
     
+    @staticmethod
+    def label_areas(label_image: np.ndarray, max_label: int, block_rows: int = 1024) -> np.ndarray:
+        """Counts the pixels of every label, by blocks of rows so that memory-mapped images are never loaded at once
+
+        Args:
+            label_image (np.ndarray): Labelled image
+            max_label (int): Highest label
+            block_rows (int, optional): Number of rows counted at once. Defaults to 1024.
+
+        Returns:
+            np.ndarray: Area of each label, indexed by label
+        """
+        areas = np.zeros(max_label + 1, dtype=np.int64)
+        
+        for start in range(0, label_image.shape[0], block_rows):
+            block = np.asarray(label_image[start:start + block_rows]).ravel()
+            areas += np.bincount(block, minlength=max_label + 1)
+        
+        return areas
+    
     def build_annotations(self, label_image: np.ndarray, image_id: int, category_id: int) -> Iterator[CocoAnnotation]:
         """Build COCO annotations from a labelled image
 
+        The bounding-box and area of every label are computed in a single pass over the image. Labels smaller
+        than `min_area` are rejected right away, the others are polygonized on their bounding-box crop only.
+
         Args:
             label_image (np.ndarray): Labelled image
             image_id (int): Image ID. Will be used in the returned COCO annotations
@@ -211,8 +236,23 @@ class MaskProcessor:
         Yields:
             Iterator[CocoAnnotation]: COCO annotation
         """
-        for i, mask in enumerate(self.extract_masks(label_image), 1):
-            polygons = self.mask_to_polygons(mask, clean=False)
+        slices = ndimage.find_objects(label_image)
+        areas = self.label_areas(label_image, len(slices))
+        
+        object_ids = [id for id, sl in enumerate(slices, 1) if sl is not None]
+        
+        for i, id in enumerate(object_ids, 1):
+            area = int(areas[id])
+            
+            if area < self.min_area:
+                continue
+            
+            ys, xs = slices[id - 1]
+            
+            # 1 pixel border so that contours of the crop are the same as on the full image
+            mask = np.pad((label_image[ys, xs] == id).astype(np.uint8) * 255, 1)
+            
+            polygons = self.mask_to_polygons(mask, clean=False, offset=(xs.start - 1, ys.start - 1))
             
             if not polygons:
                 continue
@@ -222,6 +262,11 @@ class MaskProcessor:
                 image_id=image_id,
                 category_id=category_id,
                 segmentation=polygons,
-                area=self.compute_area(mask),
-                bbox=self.compute_bbox(mask)
+                area=area,
+                bbox=[
+                    xs.start,
+                    ys.start,
+                    xs.stop - 1 - xs.start,
+                    ys.stop - 1 - ys.start,
+                ]
             )
\ No newline at end of file
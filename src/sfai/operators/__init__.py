@@ -1,18 +1,59 @@
-from .base import Operator, save_artifacts
-from .background import HSVBackgroundRemoval
-from .binary import BinaryTransform
-from .watershed import WatershedSegmentation
-from .contours import ContourDetection
-from .centers import CentersDetection
-from .sam import SAMSegmentation
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+from .base import Operator, save_artifact, save_artifacts
+
+if TYPE_CHECKING:
+    from .background import HSVBackgroundRemoval
+    from .binary import BinaryTransform
+    from .foreground import ForegroundExtraction
+    from .watershed import WatershedSegmentation
+    from .contours import ContourDetection
+    from .centers import CentersDetection
+    from .sam import SAMSegmentation
+    from .sam_client import SAMClientSegmentation
+    from .sam_onnx import SAMOnnxSegmentation
+    from .prompts import TilePrompts
+
+_LAZY_OPERATORS = {
+    "HSVBackgroundRemoval": ".background",
+    "BinaryTransform": ".binary",
+    "ForegroundExtraction": ".foreground",
+    "WatershedSegmentation": ".watershed",
+    "ContourDetection": ".contours",
+    "CentersDetection": ".centers",
+    "SAMSegmentation": ".sam",
+    "SAMClientSegmentation": ".sam_client",
+    "SAMOnnxSegmentation": ".sam_onnx",
+    "TilePrompts": ".prompts",
+}
+"""Operators imported on first access, so that importing the package does not load their dependencies (skimage, torch, ultralytics...)
+"""
+
+def __getattr__(name: str):
+    if name in _LAZY_OPERATORS:
+        value = getattr(import_module(_LAZY_OPERATORS[name], __name__), name)
+        globals()[name] = value
+        
+        return value
+    
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted({*globals(), *_LAZY_OPERATORS})
 
 __all__ = [
     "Operator",
     "HSVBackgroundRemoval",
     "BinaryTransform",
+    "ForegroundExtraction",
     "WatershedSegmentation",
     "ContourDetection",
     "CentersDetection",
     "SAMSegmentation",
+    "SAMClientSegmentation",
+    "SAMOnnxSegmentation",
+    "TilePrompts",
+    "save_artifact",
     "save_artifacts"
 ]
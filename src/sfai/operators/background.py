@@ -56,5 +56,5 @@ class HSVBackgroundRemoval(Operator):
         
         save_path = crop_subfolder / f'{ctx.index}.jpg'
         
-        return cv2.cvtColor(ctx.clean_image, cv2.COLOR_BGR2RGB), save_path
+        return ctx.clean_image, save_path
         
\ No newline at end of file
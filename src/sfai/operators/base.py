@@ -2,8 +2,8 @@ from abc import ABC, abstractmethod
 from functools import wraps
 from sfai.pipeline import PipelineContext
 import numpy as np
-import matplotlib.pyplot as plt
-from typing import Tuple, Dict, Any
+from sfai.export.artifacts import get_artifact_writer
+from typing import Tuple, Dict, Any, List
 from pathlib import Path
 
 class Operator(ABC):
@@ -32,10 +32,36 @@ class Operator(ABC):
             ctx PipelineContext:
 
         Returns:
-            T (Tuple[np.ndarray, Path, Dict[str, Any]]): Tuple that contains image, output path and optionnal pyplot `imsave` parameters
+            T (Tuple[np.ndarray, Path, Dict[str, Any]]): Tuple that contains image (BGR or single channel), output path and optionnal `ArtifactWriter.submit` parameters (`cmap`, `params`)
         """
         pass
     
+    def run_batch(self, ctxs: List[PipelineContext]) -> List[PipelineContext]:
+        """Applies the operator on a batch of tiles.
+
+        Calls the operator on each context by default. Override in operators that benefit from batching.
+
+        Args:
+            ctxs (List[PipelineContext]): 
+
+        Returns:
+            List[PipelineContext]: 
+        """
+        return [self(ctx) for ctx in ctxs]
+    
+def save_artifact(operator: Operator, ctx: PipelineContext):
+    """Queues the artifact image of an operator on the artifact writer. Does not wait for the image to be written.
+
+    Args:
+        operator (Operator): Operator that was applied on the context
+        ctx (PipelineContext): 
+    """
+    img, save_path, *rest = operator.result_image(ctx)
+    
+    kwargs = rest[0] if rest else {}
+    
+    get_artifact_writer().submit(save_path, img, **kwargs)
+    
 def save_artifacts(method):
     """
     Decorator to save artifact image
@@ -45,11 +71,7 @@ def save_artifacts(method):
         result = method(self, ctx)
         
         if self.save:
-            img, save_path, *rest = self.result_image(ctx)
-            
-            kwargs = rest[0] if rest else {}
-            
-            plt.imsave(save_path, img, dpi=200, **kwargs)
+            save_artifact(self, ctx)
         
         return result
     return wrapper
@@ -45,11 +45,11 @@ class BinaryTransform(Operator):
         
         save_path = crop_subfolder / f'{ctx.index}.jpg'
         
-        plt_kwargs = {
+        artifact_kwargs = {
             'cmap': 'gray'
         }
         
-        return ctx.binary_mask, save_path, plt_kwargs
+        return ctx.binary_mask, save_path, artifact_kwargs
         
 
         
\ No newline at end of file
@@ -42,10 +42,10 @@ class CentersDetection(Operator):
         
         save_path = crop_subfolder / f'{ctx.index}.jpg'
         
-        img = ctx.clean_image.copy()
+        img = (ctx.clean_image if ctx.clean_image is not None else ctx.image).copy()
         
         for center in ctx.points:
             cv2.circle(img, center, 1, (0, 0, 255), 4)
         
-        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB), save_path
+        return img, save_path
         
\ No newline at end of file
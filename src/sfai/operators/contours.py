@@ -46,9 +46,9 @@ class ContourDetection(Operator):
         
         save_path = crop_subfolder / f'{ctx.index}.jpg'
         
-        img = ctx.clean_image.copy()
+        img = (ctx.clean_image if ctx.clean_image is not None else ctx.image).copy()
         
         for conts in ctx.contours:
             cv2.drawContours(img, conts, -1, (0, 0, 255), 3)
         
-        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB), save_path
\ No newline at end of file
+        return img, save_path
\ No newline at end of file
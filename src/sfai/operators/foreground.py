@@ -0,0 +1,97 @@
+from sfai.operators import Operator, save_artifacts
+from sfai.pipeline import PipelineContext
+import cv2
+import numpy as np
+import threading
+from typing import Tuple
+
+class ForegroundExtraction(Operator):
+    """Extracts the foreground binary mask of a tile in a single pass.
+
+    Same result as `HSVBackgroundRemoval` followed by `BinaryTransform`: pixels in the HSV background
+    range (after opening and blurring) and pure white pixels are background, everything else is
+    foreground. The mask is computed directly from the BGR tile into scratch buffers reused across
+    tiles, the clean image is only built when artifacts are saved.
+
+    Args:
+        lower_bound (Tuple[int, int, int], optional): HSV lower bound. Defaults to [90,  40,  40].
+        upper_bound (Tuple[int, int, int], optional): HSV upper bound. Defaults to [145, 255, 255].
+        save (bool, optional): If set to true, a result image is saved on disk. Defaults to False.
+
+    Attributes:
+        lower_bound (Tuple[int, int, int]): HSV lower bound.
+        upper_bound (Tuple[int, int, int]): HSV upper bound.
+        save (bool): If result image should be saved on disk or not.
+    """
+    save_folder = 'binary'
+
+    def __init__(self, lower_bound: Tuple[int, int, int] = [90,  40,  40], upper_bound: Tuple[int, int, int] = [145, 255, 255], save: bool = False):
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+        self.save = save
+
+        self._lower = np.array(lower_bound, dtype=np.uint8)
+        self._upper = np.array(upper_bound, dtype=np.uint8)
+        self._white = np.array([255, 255, 255], dtype=np.uint8)
+        self._open_kernel = np.ones((3, 3), np.uint8)
+        self._close_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+        # Scratch buffers are per thread, tiles can be processed concurrently
+        self._scratch = threading.local()
+
+    def _buffers(self, shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the scratch buffers of the current thread, reallocated when the tile shape changes
+
+        Args:
+            shape (Tuple[int, int]): Tile height and width
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: HSV buffer and two single channel buffers
+        """
+        scratch = self._scratch
+
+        if getattr(scratch, 'shape', None) != shape:
+            scratch.shape = shape
+            scratch.hsv = np.empty((*shape, 3), dtype=np.uint8)
+            scratch.a = np.empty(shape, dtype=np.uint8)
+            scratch.b = np.empty(shape, dtype=np.uint8)
+
+        return scratch.hsv, scratch.a, scratch.b
+
+    @save_artifacts
+    def __call__(self, ctx: PipelineContext) -> PipelineContext:
+        image = ctx.image
+        hsv, a, b = self._buffers(image.shape[:2])
+
+        cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=hsv)
+        cv2.inRange(hsv, self._lower, self._upper, dst=a)
+        cv2.morphologyEx(a, cv2.MORPH_OPEN, self._open_kernel, dst=b, iterations=1)
+        cv2.GaussianBlur(b, (5, 5), 0, dst=a)
+
+        if self.save:
+            cleaned = image.copy()
+            cleaned[a > 0] = [255, 255, 255]
+            ctx.clean_image = cleaned
+
+        # Background: blurred HSV mask or pure white pixels
+        cv2.inRange(image, self._white, self._white, dst=b)
+        cv2.bitwise_or(a, b, dst=a)
+        cv2.threshold(a, 0, 255, cv2.THRESH_BINARY_INV, dst=b)
+
+        ctx.binary_mask = cv2.morphologyEx(b, cv2.MORPH_CLOSE, self._close_kernel)
+
+        return ctx
+
+    def result_image(self, ctx: PipelineContext):
+        crop_subfolder = ctx.output_handler.generate_crop_subfodler(
+            ctx.image_info.name,
+            self.save_folder
+        )
+
+        save_path = crop_subfolder / f'{ctx.index}.jpg'
+
+        artifact_kwargs = {
+            'cmap': 'gray'
+        }
+
+        return ctx.binary_mask, save_path, artifact_kwargs
@@ -0,0 +1,35 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from sfai.operators import Operator
+from sfai.pipeline import PipelineContext
+
+class TilePrompts(Operator):
+    """Gives each tile its part of the image-level classical results: the view of the image binary
+    mask on the tile, and the SAM prompts assigned to the tile (see `ImagePrompts.partition`).
+
+    Replaces the classical operators in the tile pipeline when they run once on the whole image.
+    Built for a single image, tiles are looked up by their index.
+
+    Args:
+        binary_mask (np.ndarray): Binary mask of the whole image
+        regions (List[Tuple[int, int, int, int]]): Coordinates (x1, y1, x2, y2) of each tile in the image
+        points (List[List[List[int]]]): Prompt points of each tile, in tile coordinates
+    """
+    def __init__(self, binary_mask: np.ndarray, regions: List[Tuple[int, int, int, int]], points: List[List[List[int]]]):
+        self.binary_mask = binary_mask
+        self.regions = regions
+        self.points = points
+        self.save = False
+
+    def __call__(self, ctx: PipelineContext) -> PipelineContext:
+        x1, y1, x2, y2 = self.regions[ctx.index]
+
+        ctx.binary_mask = self.binary_mask[y1:y2, x1:x2]
+        ctx.points = self.points[ctx.index]
+
+        return ctx
+
+    def result_image(self, ctx: PipelineContext):
+        return None
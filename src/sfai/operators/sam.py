@@ -1,12 +1,16 @@
-from sfai.operators import Operator, save_artifacts
+from sfai.operators import Operator, save_artifact
 from sfai.pipeline import PipelineContext
 from pathlib import Path
+import warnings
 import numpy as np
+from scipy.spatial import cKDTree
 from sfai.logging import LOGGER
+from sfai.mask import MaskMerger
+from sfai.cache import EmbeddingCache, TileCache, file_digest
 
 import cv2
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
 
 def load_sam():
     try:
@@ -30,27 +34,87 @@ def load_torch():
             'Install it manually'
         )
     
-torch = load_torch()        
-SAM = load_sam()
-        
+torch = None
+SAM = None
+
+def load_backend():
+    """Imports torch and ultralytics on first use, so that importing this module stays cheap
+    """
+    global torch, SAM
+    
+    if SAM is None:
+        torch = load_torch()
+        SAM = load_sam()
+
 if TYPE_CHECKING:
     import torch
     from ultralytics import SAM
 
+SAM_PRECISIONS = ['fp32', 'bf16', 'dynamic-int8']
+"""Supported precisions of the SAM image encoder
+"""
+
+SAM_BACKENDS = ['ultralytics', 'onnx']
+"""Supported SAM backends: Ultralytics on PyTorch (`SAMSegmentation`), or onnxruntime (`SAMOnnxSegmentation`)
+"""
+
 
 class SAMSegmentation(Operator):
     """Transform image into a binary mask
 
+    Tiles can be processed in batches: the image encoder runs once on a batch of tiles, then the
+    prompts of each tile are decoded against its own embedding. The batch size is halved each time
+    the device runs out of memory.
+
+    The image encoder, which dominates the inference time, can run in reduced precision: `bf16`
+    runs it under bfloat16 autocast, `dynamic-int8` quantizes its linear layers to int8 with
+    PyTorch dynamic quantization (CPU only). The prompt decoder always runs in fp32. Use
+    `benchmarks/sam_precision.py` to check the masks against fp32 before switching.
+
+    With an `EmbeddingCache`, the image embedding of each tile is cached, keyed by the tile pixels
+    and the model. Tiles seen before with other prompts only run the prompt decoder.
+
+    `SAMOnnxSegmentation` runs the same model exported to ONNX, with onnxruntime instead of PyTorch.
+
     Args:
         model (Path | String): Path to the SAM model
         save (bool, optional): Save artifact or not. Defaults to False.
+        batch_size (int, optional): Number of tiles encoded together. Defaults to 1.
+        imgsz (int, optional): SAM input size. Defaults to 1024.
+        dist_thresh (float, optional): Prompt points closer than this distance are merged. Defaults to 20.
+        cache (TileCache | None, optional): Cache of tile results, looked up before running the model. Defaults to None.
+        precision (str, optional): Precision of the image encoder. One of `SAM_PRECISIONS`. Defaults to 'fp32'.
+        embeddings (EmbeddingCache | None, optional): Cache of tile embeddings, looked up before running the image encoder. Defaults to None.
     """
     save_folder = 'sam'
+    backend = 'ultralytics'
     
-    def __init__(self, model: Path | str, save: bool = False):
-        self.model = SAM(model.absolute())
-        self.device = self._get_device()
+    def __init__(self, model: Path | str, save: bool = False, batch_size: int = 1, imgsz: int = 1024, dist_thresh: float = 20, cache: TileCache | None = None, precision: str = 'fp32', embeddings: EmbeddingCache | None = None):
+        if precision not in SAM_PRECISIONS:
+            raise ValueError(f"Unsupported SAM precision {precision}. Supported precisions: {SAM_PRECISIONS}")
+        
+        self.model_path = Path(model).absolute()
         self.save = save
+        self.batch_size = max(batch_size, 1)
+        self.imgsz = imgsz
+        self.dist_thresh = dist_thresh
+        self.conf = 0.25
+        self.merger = MaskMerger()
+        self.cache = cache
+        self.precision = precision
+        self.embeddings = embeddings
+        
+        self._predictor = None
+        self._model_digest = None
+        
+        self._load_model()
+    
+    def _load_model(self):
+        """Loads the model. Called once by `__init__`.
+        """
+        load_backend()
+        self.model = SAM(self.model_path)
+        self.device = self._get_device()
 
     def clean_mask(self, mask: np.ndarray, kernel_size: int = 3) -> np.ndarray:
         """Cleans a maks by applying an OPENNING and a CLOSING right after.
@@ -68,30 +132,387 @@ class SAMSegmentation(Operator):
 
         return mask
     
-    @save_artifacts
     def __call__(self, ctx: PipelineContext) -> PipelineContext:
-        tile_mask = np.zeros(ctx.image.shape[:2], dtype=np.uint16)
-        points = self.merge_centers(ctx.points)
+        return self.run_batch([ctx])[0]
+    
+    def run_batch(self, ctxs: List[PipelineContext]) -> List[PipelineContext]:
+        """Segments a batch of tiles. Tiles can come from different images.
 
-        label_count = 0
+        Args:
+            ctxs (List[PipelineContext]): 
 
-        if len(points) > 0:
-            try:
-                results = self.model.predict(ctx.image, points=points)
-                object_masks = [mask.cpu().numpy().astype(np.uint8) for result in results for mask in result.masks.data]
-                merged_object_masks, label_count = self.merge_masks(object_masks)
+        Returns:
+            List[PipelineContext]: 
+        """
+        points = [self.merge_centers(ctx.points, self.dist_thresh) for ctx in ctxs]
+        prompted = [i for i, p in enumerate(points) if len(p) > 0]
+        
+        keys = {}
+        cached = {}
+        
+        if self.cache is not None:
+            for i in prompted:
+                keys[i] = self.cache_key(ctxs[i].image, points[i])
+                hit = self.cache.get(keys[i])
                 
-                for i, mask in enumerate(merged_object_masks):
-                    cleaned = self.clean_mask(mask, 5)
-                    labeled_mask = cleaned.astype(np.uint16) * (i+1)
-                    tile_mask = np.maximum(tile_mask, labeled_mask)
-            except torch.OutOfMemoryError:
+                if hit is not None:
+                    cached[i] = hit
+            
+            prompted = [i for i in prompted if i not in cached]
+        
+        object_masks = self.predict_batch(
+            [ctxs[i].image for i in prompted],
+            [points[i] for i in prompted]
+        )
+        
+        results = dict(zip(prompted, object_masks))
+        
+        for i, ctx in enumerate(ctxs):
+            tile_mask = np.zeros(ctx.image.shape[:2], dtype=np.uint16)
+            label_count = 0
+            
+            masks = results.get(i)
+            
+            if i in cached:
+                tile_mask, label_count = cached[i]
+            elif masks is None and i in results:
                 LOGGER.warning(f'Memory error on {ctx.image_info.path}. Tile Ignored.')
+            elif masks is not None:
+                tile_mask, label_count = self.paint_masks(masks, tile_mask)
+                
+                if i in keys:
+                    self.cache.put(keys[i], tile_mask, label_count)
+            
+            ctx.sam_mask = tile_mask
+            ctx.metadata['label_count'] = label_count
+            
+            if self.save:
+                save_artifact(self, ctx)
+        
+        return ctxs
+    
+    def cache_key(self, image: np.ndarray, points: List[List[int]]) -> str:
+        """Computes the cache key of a tile from its pixels, its prompts, the model and the parameters
+        that change the label mask.
+
+        Args:
+            image (np.ndarray): Tile (BGR)
+            points (List[List[int]]): Merged prompt points of the tile
+
+        Returns:
+            str: Cache key
+        """
+        params = {
+            'imgsz': self.imgsz,
+            'conf': self.conf,
+            'precision': self.precision,
+            'backend': self.backend,
+            'iou_thresh': self.merger.iou_thresh,
+            'inclusion_thresh': self.merger.inclusion_thresh,
+        }
+        
+        return self.cache.key(image, points, self.model_digest(), params)
+    
+    def embedding_key(self, image: np.ndarray) -> str:
+        """Computes the embedding cache key of a tile from its pixels, the model and the parameters
+        that change the image embedding.
+
+        Args:
+            image (np.ndarray): Tile (BGR)
+
+        Returns:
+            str: Embedding cache key
+        """
+        params = {
+            'imgsz': self.imgsz,
+            'precision': self.precision,
+            'backend': self.backend,
+        }
+        
+        return self.embeddings.key(image, self.model_digest(), params)
+    
+    def model_digest(self) -> str:
+        """Returns the hash of the model file. Computed on first use.
+        """
+        if self._model_digest is None:
+            self._model_digest = file_digest(self.model_path) if self.model_path.is_file() else str(self.model_path)
+        
+        return self._model_digest
+    
+    def paint_masks(self, object_masks: "List[np.ndarray] | torch.Tensor", tile_mask: np.ndarray) -> Tuple[np.ndarray, int]:
+        """Merges the object masks of a tile and paints them with their label.
 
+        Args:
+            object_masks (List[np.ndarray] | torch.Tensor): Binary masks predicted for the tile
+            tile_mask (np.ndarray): Empty label mask of the tile
 
-        ctx.sam_mask = tile_mask
-        ctx.metadata['label_count'] = label_count
-        return ctx
+        Returns:
+            Tuple[np.ndarray, int]: Label mask and number of labels
+        """
+        merged_object_masks, label_count = self.merge_masks(object_masks)
+        
+        for i, mask in enumerate(merged_object_masks):
+            cleaned = self.clean_mask(mask, 5)
+            labeled_mask = cleaned.astype(np.uint16) * (i+1)
+            tile_mask = np.maximum(tile_mask, labeled_mask)
+        
+        return tile_mask, label_count
+    
+    def predict_batch(self, images: List[np.ndarray], points: List[List[List[int]]]) -> List["List[np.ndarray] | torch.Tensor | None"]:
+        """Predicts the object masks of several tiles, `batch_size` tiles at a time.
+
+        On out of memory errors, the batch size is halved and the batch is retried. A tile that
+        does not fit alone on the device gets `None`.
+
+        Args:
+            images (List[np.ndarray]): Tiles (BGR)
+            points (List[List[List[int]]]): Prompt points of each tile
+
+        Returns:
+            List[List[np.ndarray] | torch.Tensor | None]: Masks of each tile, as returned by `_predict`
+        """
+        results = []
+        start = 0
+        
+        while start < len(images):
+            size = self.batch_size
+            
+            try:
+                results.extend(self._predict(images[start:start + size], points[start:start + size]))
+                start += size
+            except torch.OutOfMemoryError:
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                
+                if size == 1:
+                    results.append(None)
+                    start += 1
+                else:
+                    self.batch_size = size // 2
+                    LOGGER.warning(f'Memory error with a batch of {size} tiles. Batch size reduced to {self.batch_size}.')
+        
+        return results
+    
+    def _predict(self, images: List[np.ndarray], points: List[List[List[int]]]) -> List["List[np.ndarray] | torch.Tensor"]:
+        """Encodes a batch of tiles and decodes the prompts of each tile.
+
+        On GPU, masks are kept stacked on the device so that they are merged there, and only the
+        merged masks are copied to the host.
+
+        Args:
+            images (List[np.ndarray]): Tiles (BGR)
+            points (List[List[List[int]]]): Prompt points of each tile
+
+        Returns:
+            List[List[np.ndarray] | torch.Tensor]: Binary masks (uint8) of each tile, or a stacked boolean tensor on GPU
+        """
+        predictor = self._get_predictor()
+        results = []
+        
+        with torch.inference_mode():
+            features = self.embed(images)
+            
+            for i, (image, pts) in enumerate(zip(images, points)):
+                masks, boxes = predictor.inference_features(
+                    features[i],
+                    src_shape=image.shape[:2],
+                    dst_shape=predictor.imgsz,
+                    points=pts
+                )
+                
+                if masks is None:
+                    results.append([])
+                    continue
+                
+                masks = masks[boxes[:, 4] > self.conf]
+                
+                if masks.is_cuda:
+                    results.append(masks)
+                else:
+                    results.append([mask.cpu().numpy().astype(np.uint8) for mask in masks])
+        
+        return results
+    
+    def embed(self, images: List[np.ndarray]) -> List[Any]:
+        """Returns the image features of each tile, from the embedding cache or from the image encoder.
+
+        Tiles missing from the cache are encoded together, and added to the cache.
+
+        Args:
+            images (List[np.ndarray]): Tiles (BGR)
+
+        Returns:
+            List[Any]: Image features of each tile, as taken by the prompt decoder
+        """
+        features = [None] * len(images)
+        keys = {}
+        
+        if self.embeddings is not None:
+            for i, image in enumerate(images):
+                keys[i] = self.embedding_key(image)
+                arrays = self.embeddings.get(keys[i])
+                
+                if arrays is not None:
+                    features[i] = self._from_arrays(arrays)
+        
+        missing = [i for i, f in enumerate(features) if f is None]
+        
+        if missing:
+            encoded = self._encode_tiles([images[i] for i in missing])
+            
+            for i, tile_features in zip(missing, encoded):
+                features[i] = tile_features
+                
+                if i in keys:
+                    self.embeddings.put(keys[i], self._to_arrays(tile_features))
+        
+        return features
+    
+    def _encode_tiles(self, images: List[np.ndarray]) -> List[Any]:
+        """Preprocesses and encodes a batch of tiles
+
+        Returns:
+            List[Any]: Image features of each tile
+        """
+        predictor = self._get_predictor()
+        
+        batch = torch.cat([predictor.preprocess([image]) for image in images])
+        features = self.encode(batch)
+        
+        return [self._select_features(features, i) for i in range(len(images))]
+    
+    @staticmethod
+    def _to_arrays(features: Any) -> Dict[str, np.ndarray]:
+        """Converts the features of a tile to named host arrays, as stored in the embedding cache
+        """
+        if not isinstance(features, dict):
+            return {'image_embed': features.cpu().numpy().copy()}
+        
+        arrays = {'image_embed': features['image_embed'].cpu().numpy().copy()}
+        
+        for i, feat in enumerate(features['high_res_feats']):
+            arrays[f'high_res_feat_{i}'] = feat.cpu().numpy().copy()
+        
+        return arrays
+    
+    def _from_arrays(self, arrays: Dict[str, np.ndarray]) -> Any:
+        """Converts named host arrays from the embedding cache back to features of a tile on the device
+        """
+        embed = torch.from_numpy(arrays['image_embed']).to(self.device)
+        high_res_feats = [
+            torch.from_numpy(arrays[f'high_res_feat_{i}']).to(self.device)
+            for i in range(len(arrays) - 1)
+        ]
+        
+        if not high_res_feats:
+            return embed
+        
+        return {"image_embed": embed, "high_res_feats": high_res_feats}
+    
+    def encode(self, batch: "torch.Tensor") -> Any:
+        """Runs the image encoder on a batch of preprocessed tiles.
+
+        Args:
+            batch (torch.Tensor): Preprocessed tiles (B, C, H, W)
+
+        Returns:
+            Any: Image features. A tensor for SAM, a dict of tensors for SAM2.
+        """
+        model = self._get_predictor().model
+        
+        if self.precision == 'bf16':
+            # The decoder runs in fp32, it gets the features back in fp32
+            with torch.autocast(device_type=self.device.type, dtype=torch.bfloat16):
+                features = self._encode(model, batch)
+            
+            return _to_float(features)
+        
+        return self._encode(model, batch)
+    
+    @staticmethod
+    def _encode(model: Any, batch: "torch.Tensor") -> Any:
+        if not hasattr(model, 'forward_image'):
+            return model.image_encoder(batch)
+        
+        # Same as SAM2Predictor.get_im_features, which only handles a single image
+        backbone_out = model.forward_image(batch)
+        _, vision_feats, _, feat_sizes = model._prepare_backbone_features(backbone_out)
+        
+        if model.directly_add_no_mem_embed:
+            vision_feats[-1] = vision_feats[-1] + model.no_mem_embed
+        
+        feats = [
+            feat.permute(1, 2, 0).reshape(batch.shape[0], -1, *feat_size)
+            for feat, feat_size in zip(vision_feats, feat_sizes)
+        ]
+        
+        return {"image_embed": feats[-1], "high_res_feats": feats[:-1]}
+    
+    @staticmethod
+    def _select_features(features: Any, index: int) -> Any:
+        """Returns the features of a single tile of a batch
+        """
+        if isinstance(features, dict):
+            return {
+                "image_embed": features["image_embed"][index:index + 1],
+                "high_res_feats": [feat[index:index + 1] for feat in features["high_res_feats"]]
+            }
+        return features[index:index + 1]
+    
+    def _get_predictor(self):
+        """Returns the Ultralytics predictor of the model. Built on first use.
+        """
+        if self._predictor is None:
+            predictor_cls = self.model.task_map['segment']['predictor']
+            
+            predictor = predictor_cls(overrides={
+                'conf': self.conf,
+                'task': 'segment',
+                'mode': 'predict',
+                'imgsz': self.imgsz,
+                'model': str(self.model_path),
+                'retina_masks': True,
+                'verbose': False
+            })
+            predictor.setup_model(model=self.model.model, verbose=False)
+            predictor.imgsz = [self.imgsz, self.imgsz]
+            
+            if hasattr(predictor.model, 'set_imgsz'):
+                predictor.model.set_imgsz(predictor.imgsz)
+            
+            if self.precision == 'dynamic-int8':
+                self._quantize_encoder(predictor.model)
+            
+            self._predictor = predictor
+        
+        return self._predictor
+    
+    def _quantize_encoder(self, model: Any):
+        """Quantizes the linear layers of the image encoder to int8 (dynamic quantization).
+
+        Weights are quantized once, activations are quantized on the fly. Dynamic quantization
+        only runs on CPU, the encoder is left in fp32 on other devices.
+
+        Args:
+            model (Any): SAM or SAM2 model of the predictor
+        """
+        encoder_device = next(model.image_encoder.parameters()).device
+        
+        if encoder_device.type != 'cpu':
+            LOGGER.warning(f'dynamic-int8 precision is only supported on CPU, the SAM encoder runs in fp32 on {encoder_device}')
+            return
+        
+        LOGGER.warning('dynamic-int8 precision uses torch.ao.quantization.quantize_dynamic, which is deprecated and will be removed from PyTorch')
+        
+        with warnings.catch_warnings():
+            # Deprecation notice of the quantized tensor API, raised on every layer. Only this one is silenced.
+            warnings.filterwarnings('ignore', message=r'torch\.quantize_per_tensor, torch\.quantize_per_channel', category=UserWarning)
+            
+            model.image_encoder = torch.ao.quantization.quantize_dynamic(
+                model.image_encoder,
+                {torch.nn.Linear},
+                dtype=torch.qint8
+            )
     
     def _get_device(self):
         """Returns torch device depending on availability.
@@ -113,6 +534,46 @@ class SAMSegmentation(Operator):
     def merge_centers(self, centers, dist_thresh=20):
         """Merge close points together
 
+        Points are visited in order. Each point that is not merged yet is replaced by the mean of
+        all the points closer than `dist_thresh`, which are then marked as merged. Neighbours are
+        found with a KD-tree, results are the same as `merge_centers_greedy`.
+
+        Args:
+            centers (List): points
+            dist_thresh (int, optional): Distance threshold. Defaults to 20.
+
+        Returns:
+            List: merged points
+        """
+        centers = np.asarray(centers)
+        
+        if len(centers) == 0:
+            return []
+        
+        tree = cKDTree(centers)
+        # Strict `< dist_thresh`, query_ball_point keeps points at exactly the radius
+        radius = np.nextafter(dist_thresh, 0)
+        
+        used = np.zeros(len(centers), dtype=bool)
+        merged = []
+
+        for i in range(len(centers)):
+            if used[i]:
+                continue
+
+            close = tree.query_ball_point(centers[i], radius)
+            used[close] = True
+
+            merged_center = centers[np.sort(close)].mean(axis=0).astype(int)
+            merged.append(merged_center.tolist())
+
+        return merged
+    
+    def merge_centers_greedy(self, centers, dist_thresh=20):
+        """Merge close points together, comparing each point with all the others.
+
+        Quadratic in the number of points. Kept as the reference of `merge_centers`.
+
         Args:
             centers (List): points
             dist_thresh (int, optional): Distance threshold. Defaults to 20.
@@ -137,32 +598,26 @@ class SAMSegmentation(Operator):
         return merged
     
     def merge_masks(self, masks, IoU_thresh=0.5, inclusion_thresh=0.9):
+        """Merges masks together. See `MaskMerger`.
+
+        Args:
+            masks (List[np.ndarray] | torch.Tensor): Binary masks, or a stacked mask tensor
+            IoU_thresh (float, optional): IoU threshold. Defaults to 0.5.
+            inclusion_thresh (float, optional): Inclusion threshold. Defaults to 0.9.
+
+        Returns:
+            Tuple[List[np.ndarray], int]: Merged masks and their number
         """
-        Merges masks together
-        """
-        size_sorted_masks = sorted(masks, key=lambda m: m.sum(), reverse=True)
+        merger = self.merger
         
-        merged_masks = []
+        if (IoU_thresh, inclusion_thresh) != (merger.iou_thresh, merger.inclusion_thresh):
+            merger = MaskMerger(IoU_thresh, inclusion_thresh)
         
-        for mask in size_sorted_masks:
-            merged = False
-            mask_area = mask.sum()
-            
-            for i, existing in enumerate(merged_masks):
-                intersection = np.logical_and(existing, mask).sum()
-                union = np.logical_or(existing, mask).sum()
-                IoU = intersection / union
-                inclusion = intersection / mask_area if mask_area > 0 else 0
-                
-                if IoU > IoU_thresh or inclusion > inclusion_thresh:
-                    merged_masks[i] = np.logical_or(existing, mask).astype(np.uint8)
-                    merged = True
-                    break
-            
-            if not merged:
-                merged_masks.append(mask)
+        # torch is not loaded by the onnx backend
+        if torch is not None and isinstance(masks, torch.Tensor):
+            return merger.merge_stacked(masks)
         
-        return merged_masks, len(merged_masks)
+        return merger.merge(masks)
     
     def result_image(self, ctx: PipelineContext):
         crop_subfolder = ctx.output_handler.generate_crop_subfodler(
@@ -172,8 +627,19 @@ class SAMSegmentation(Operator):
         
         save_path = crop_subfolder / f'{ctx.index}.jpg'
         
-        plt_kwargs = {
+        artifact_kwargs = {
             'cmap': 'nipy_spectral'
         }
         
-        return ctx.sam_mask, save_path, plt_kwargs
\ No newline at end of file
+        return ctx.sam_mask, save_path, artifact_kwargs
+
+def _to_float(features: Any) -> Any:
+    """Casts image features (a tensor, or a dict of tensors and lists of tensors) to fp32
+    """
+    if isinstance(features, dict):
+        return {key: _to_float(value) for key, value in features.items()}
+    
+    if isinstance(features, list):
+        return [_to_float(value) for value in features]
+    
+    return features.float()
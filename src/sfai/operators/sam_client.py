@@ -0,0 +1,262 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Callable, Dict, List
+
+import socket
+from multiprocessing import shared_memory, util
+from pathlib import Path
+
+import numpy as np
+
+from sfai.logging import LOGGER
+from sfai.operators import Operator, save_artifact
+from sfai.pipeline import PipelineContext
+from sfai.server.protocol import ProtocolError, recv_message, send_message
+from sfai.server.sam import PROTOCOL_VERSION
+
+if TYPE_CHECKING:
+    from sfai.operators import SAMSegmentation
+
+class SAMServerError(RuntimeError):
+    """Raised when the SAM server replies with an error
+    """
+
+class SAMClientSegmentation(Operator):
+    """Runs SAM on a `SAMServer` (`sfai serve`), so that the model is not loaded again by each run.
+
+    Tiles are passed to the server through a shared memory segment, only their layout and prompts
+    go through the socket. Results are the same as `SAMSegmentation` with the same model.
+
+    The operator falls back to in-process inference with the operator built by `fallback` when no
+    server listens on the socket, when the server runs another model, precision or backend, or
+    when the connection is lost, times out or the server fails a request during the run. The batch
+    being segmented is then segmented again in-process.
+
+    The tile cache, embedding cache and batch size are the ones of the server, the settings of the
+    run only apply to the fallback.
+
+    Args:
+        socket_path (Path | str): Unix domain socket of the server
+        model (Path | str): Path to the SAM model. The server must run the same model.
+        precision (str, optional): Precision of the SAM image encoder. The server must run the same precision. Defaults to 'fp32'.
+        fallback (Callable[[], SAMSegmentation]): Builds the in-process operator. Only called on fallback.
+        save (bool, optional): Save artifact or not. Defaults to False.
+        dist_thresh (float, optional): Prompt points closer than this distance are merged. Defaults to 20.
+        timeout (float | None, optional): Timeout in seconds of a server request. A server taking longer is considered lost. None waits forever. Defaults to 600.
+        backend (str, optional): SAM backend, `ultralytics` or `onnx`. The server must run the same backend. Defaults to 'ultralytics'.
+
+    Attributes:
+        local (SAMSegmentation | None): In-process operator, once fallen back
+        imgsz (int): SAM input size
+    """
+    save_folder = 'sam'
+
+    def __init__(
+        self,
+        socket_path: Path | str,
+        model: Path | str,
+        fallback: Callable[[], SAMSegmentation],
+        save: bool = False,
+        dist_thresh: float = 20,
+        timeout: float | None = 600,
+        precision: str = 'fp32',
+        backend: str = 'ultralytics'
+    ):
+        self.socket_path = Path(socket_path)
+        self.model_path = Path(model).absolute()
+        self.save = save
+        self.dist_thresh = dist_thresh
+        self.timeout = timeout
+        self.precision = precision
+        self.backend = backend
+        self.local: SAMSegmentation | None = None
+        self.imgsz: int | None = None
+
+        self._fallback = fallback
+        
+        # Socket and shared memory segment, released when the operator is collected or the process exits
+        # (worker processes included, which do not run `atexit` handlers)
+        self._resources: Dict[str, Any] = {}
+        util.Finalize(self, _release, args=(self._resources,), exitpriority=10)
+
+        if not self._connect():
+            self._use_local()
+
+    def __call__(self, ctx: PipelineContext) -> PipelineContext:
+        return self.run_batch([ctx])[0]
+
+    def run_batch(self, ctxs: List[PipelineContext]) -> List[PipelineContext]:
+        """Segments a batch of tiles on the server, or in-process after a fallback
+
+        Args:
+            ctxs (List[PipelineContext]):
+
+        Returns:
+            List[PipelineContext]:
+        """
+        if self.local is None:
+            try:
+                return self._run_remote(ctxs)
+            except OSError as e:
+                LOGGER.warning(f'SAM server on {self.socket_path} lost ({e}). Falling back to in-process inference')
+                self.close()
+                self._use_local()
+            except SAMServerError as e:
+                LOGGER.warning(f'SAM server on {self.socket_path} failed ({e}). Falling back to in-process inference')
+                self.close()
+                self._use_local()
+
+        return self.local.run_batch(ctxs)
+
+    def _run_remote(self, ctxs: List[PipelineContext]) -> List[PipelineContext]:
+        images = [np.ascontiguousarray(ctx.image, dtype=np.uint8) for ctx in ctxs]
+
+        tiles = []
+        offset = 0
+
+        for ctx, image in zip(ctxs, images):
+            h, w = image.shape[:2]
+            mask_offset = _align(offset + image.nbytes)
+
+            tiles.append({
+                'shape': list(image.shape),
+                'offset': offset,
+                'mask_offset': mask_offset,
+                'points': np.asarray(ctx.points if ctx.points is not None else []).tolist(),
+                'path': str(ctx.image_info.path),
+            })
+
+            offset = _align(mask_offset + h * w * 2)
+
+        shm = self._buffer(offset)
+
+        for image, tile in zip(images, tiles):
+            shm.buf[tile['offset']:tile['offset'] + image.nbytes] = image.reshape(-1).data
+
+        send_message(self._resources['sock'], {
+            'op': 'segment',
+            'shm': shm.name,
+            'dist_thresh': self.dist_thresh,
+            'tiles': tiles,
+        })
+
+        response = recv_message(self._resources['sock'])
+
+        if response is None:
+            raise ProtocolError('Connection closed by the server')
+
+        if 'error' in response:
+            raise SAMServerError(response['error'])
+
+        for ctx, image, tile, label_count in zip(ctxs, images, tiles, response['label_counts']):
+            mask = np.ndarray(image.shape[:2], dtype=np.uint16, buffer=shm.buf, offset=tile['mask_offset'])
+
+            ctx.sam_mask = mask.copy()
+            ctx.metadata['label_count'] = label_count
+
+            del mask
+
+            if self.save:
+                save_artifact(self, ctx)
+
+        return ctxs
+
+    def _connect(self) -> bool:
+        """Connects to the server and checks that it runs the configured model
+
+        Returns:
+            bool: True if the server can be used
+        """
+        if not hasattr(socket, 'AF_UNIX') or not self.socket_path.exists():
+            LOGGER.info('No SAM server running, SAM runs in-process')
+            return False
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+
+        try:
+            sock.connect(str(self.socket_path))
+            send_message(sock, {'op': 'info'})
+            info = recv_message(sock)
+        except OSError as e:
+            sock.close()
+            LOGGER.info(f'SAM server on {self.socket_path} unreachable ({e}), SAM runs in-process')
+            return False
+
+        if info is None or info.get('version') != PROTOCOL_VERSION:
+            sock.close()
+            LOGGER.warning(f'SAM server on {self.socket_path} speaks another protocol version, SAM runs in-process')
+            return False
+
+        if Path(info['model']) != self.model_path:
+            sock.close()
+            LOGGER.warning(f'SAM server on {self.socket_path} runs {info["model"]}, not {self.model_path}. SAM runs in-process')
+            return False
+
+        if info.get('precision') != self.precision:
+            sock.close()
+            LOGGER.warning(f'SAM server on {self.socket_path} runs in {info.get("precision")}, not {self.precision}. SAM runs in-process')
+            return False
+
+        if info.get('backend', 'ultralytics') != self.backend:
+            sock.close()
+            LOGGER.warning(f'SAM server on {self.socket_path} runs the {info.get("backend")} backend, not {self.backend}. SAM runs in-process')
+            return False
+        
+        self._resources['sock'] = sock
+        self.imgsz = info['imgsz']
+
+        LOGGER.info(f'Using the SAM server on {self.socket_path} (pid {info["pid"]})')
+
+        return True
+
+    def _use_local(self):
+        """Builds the in-process operator
+        """
+        self.local = self._fallback()
+        self.imgsz = self.local.imgsz
+
+    def _buffer(self, size: int) -> shared_memory.SharedMemory:
+        """Returns the shared memory segment of the tiles, grown when a batch does not fit
+        """
+        shm = self._resources.get('shm')
+
+        if shm is None or shm.size < size:
+            _release(self._resources, sock=False)
+            shm = self._resources['shm'] = shared_memory.SharedMemory(create=True, size=max(size, 1))
+
+        return shm
+
+    def close(self):
+        """Closes the connection to the server and releases the shared memory
+        """
+        _release(self._resources)
+
+    def result_image(self, ctx: PipelineContext):
+        crop_subfolder = ctx.output_handler.generate_crop_subfodler(
+            ctx.image_info.name,
+            self.save_folder
+        )
+
+        save_path = crop_subfolder / f'{ctx.index}.jpg'
+
+        artifact_kwargs = {
+            'cmap': 'nipy_spectral'
+        }
+
+        return ctx.sam_mask, save_path, artifact_kwargs
+
+def _release(resources: Dict[str, Any], sock: bool = True):
+    """Closes the socket and unlinks the shared memory segment of a client
+    """
+    if sock and resources.get('sock') is not None:
+        resources.pop('sock').close()
+
+    if resources.get('shm') is not None:
+        shm = resources.pop('shm')
+        shm.close()
+        shm.unlink()
+
+def _align(offset: int, alignment: int = 64) -> int:
+    """Rounds an offset up to a multiple of `alignment`
+    """
+    return -(-offset // alignment) * alignment
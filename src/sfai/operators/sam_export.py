@@ -0,0 +1,271 @@
+import json
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+import ultralytics
+from ultralytics.models.sam.modules.encoders import PromptEncoder
+from ultralytics.nn.modules.transformer import LayerNorm2d
+
+from sfai.cache import file_digest
+from sfai.logging import LOGGER
+from sfai.operators.sam import SAMSegmentation
+from sfai.operators.sam_onnx import PIXEL_MEAN, PIXEL_STD, load_onnxruntime, onnx_paths
+
+ULTRALYTICS_VERSION = (8, 4)
+"""Ultralytics release the export patches are copied from (major, minor)
+"""
+
+MIN_MASK_IOU = 0.99
+"""Minimum IoU between the masks of the exported graphs and of the torch model on the check tile
+"""
+
+class _Encoder(torch.nn.Module):
+    """Image encoder graph: preprocessed tiles (B, 3, imgsz, imgsz) to image features
+    """
+    def __init__(self, model: Any):
+        super().__init__()
+        self.model = model
+
+    def forward(self, image: torch.Tensor):
+        features = SAMSegmentation._encode(self.model, image)
+
+        if isinstance(features, dict):
+            return (features['image_embed'], *features['high_res_feats'])
+
+        return features
+
+class _Decoder(torch.nn.Module):
+    """Prompt decoder graph: features of one tile and N single point prompts to N low resolution masks and scores
+    """
+    def __init__(self, model: Any):
+        super().__init__()
+        self.model = model
+        self.is_sam2 = hasattr(model, 'sam_mask_decoder')
+
+    def forward(self, image_embed: torch.Tensor, point_coords: torch.Tensor, point_labels: torch.Tensor, *high_res_feats: torch.Tensor):
+        if self.is_sam2:
+            prompt_encoder, mask_decoder = self.model.sam_prompt_encoder, self.model.sam_mask_decoder
+        else:
+            prompt_encoder, mask_decoder = self.model.prompt_encoder, self.model.mask_decoder
+
+        sparse, dense = prompt_encoder(points=(point_coords, point_labels), boxes=None, masks=None)
+
+        kwargs = {
+            'image_embeddings': image_embed,
+            'image_pe': prompt_encoder.get_dense_pe(),
+            'sparse_prompt_embeddings': sparse,
+            'dense_prompt_embeddings': dense,
+            'multimask_output': False,
+        }
+
+        if self.is_sam2:
+            masks, scores, _, _ = mask_decoder(**kwargs, repeat_image=True, high_res_features=list(high_res_feats))
+        else:
+            masks, scores = mask_decoder(**kwargs)
+
+        return masks, scores
+
+def _embed_points(self, points: torch.Tensor, labels: torch.Tensor, pad: bool) -> torch.Tensor:
+    """`PromptEncoder._embed_points` without in-place boolean indexing, which does not export with a dynamic number of prompts
+    """
+    points = points + 0.5
+
+    if pad:
+        points = torch.cat([points, torch.zeros_like(points[:, :1])], dim=1)
+        labels = torch.cat([labels, -torch.ones_like(labels[:, :1])], dim=1)
+
+    embedding = self.pe_layer.forward_with_coords(points, self.input_image_size)
+    labels = labels.unsqueeze(-1)
+
+    embedding = torch.where(labels == -1, self.not_a_point_embed.weight, embedding)
+
+    for i, point_embedding in enumerate(self.point_embeddings):
+        embedding = embedding + (labels == i).to(embedding.dtype) * point_embedding.weight
+
+    return embedding
+
+def _layer_norm_2d(self, x: torch.Tensor) -> torch.Tensor:
+    """`LayerNorm2d.forward` with a static normalized shape
+    """
+    return F.layer_norm(x.permute(0, 2, 3, 1), self.weight.shape, self.weight, self.bias, self.eps).permute(0, 3, 1, 2)
+
+@contextmanager
+def _exportable():
+    """Replaces the Ultralytics methods that do not export to ONNX with equivalent ones, during the export only
+
+    Raises:
+        RuntimeError: If Ultralytics is not the release the replacements are copied from
+    """
+    version = tuple(int(part) for part in ultralytics.__version__.split('.')[:2])
+
+    if version != ULTRALYTICS_VERSION:
+        raise RuntimeError(
+            f'The ONNX export supports Ultralytics {".".join(map(str, ULTRALYTICS_VERSION))}.x, '
+            f'not {ultralytics.__version__}. Install it by running pip install "ultralytics>=8.4,<8.5"'
+        )
+
+    originals = (PromptEncoder._embed_points, LayerNorm2d.forward)
+    PromptEncoder._embed_points, LayerNorm2d.forward = _embed_points, _layer_norm_2d
+
+    try:
+        yield
+    finally:
+        PromptEncoder._embed_points, LayerNorm2d.forward = originals
+
+def export_onnx(model: Path | str, output_dir: Path | str | None = None, imgsz: int = 1024, opset: int = 17) -> Path:
+    """Exports a SAM model to an encoder and a decoder ONNX graph, run by `SAMOnnxSegmentation`.
+
+    Writes `<model>.encoder.onnx`, `<model>.decoder.onnx` and the metadata `<model>.onnx.json`
+    (input size, mask threshold, checksum of the model file) in `output_dir`. The encoder takes
+    a dynamic number of tiles, the decoder a dynamic number of prompts.
+
+    The graphs are checked against the torch model on a synthetic tile (see `check_export`)
+    before the metadata is written, so that a failed export is not used by the onnx backend.
+
+    Args:
+        model (Path | str): Path to the SAM model
+        output_dir (Path | str | None, optional): Output folder. Defaults to the folder of the model.
+        imgsz (int, optional): SAM input size. Defaults to 1024.
+        opset (int, optional): ONNX opset. Defaults to 17.
+
+    Returns:
+        Path: Path to the metadata file
+    """
+    paths = onnx_paths(model, output_dir)
+    paths['metadata'].parent.mkdir(parents=True, exist_ok=True)
+
+    operator = SAMSegmentation(model, imgsz=imgsz)
+    sam = operator._get_predictor().model.float().cpu().eval()
+
+    # In eval mode, the export restores the mode of the modules afterwards
+    encoder = _Encoder(sam).eval()
+    decoder = _Decoder(sam).eval()
+
+    image = torch.zeros(1, 3, imgsz, imgsz)
+
+    with torch.inference_mode():
+        features = encoder(image)
+
+    if isinstance(features, torch.Tensor):
+        features = (features,)
+
+    embed, *high_res_feats = features
+    high_res_names = [f'high_res_feat_{i}' for i in range(len(high_res_feats))]
+
+    point_coords = torch.full((2, 1, 2), imgsz / 2)
+    point_labels = torch.ones((2, 1), dtype=torch.int32)
+
+    with _exportable(), torch.no_grad():
+        LOGGER.info(f'Exporting the SAM encoder to {paths["encoder"]}')
+
+        torch.onnx.export(
+            encoder,
+            (image,),
+            str(paths['encoder']),
+            input_names=['image'],
+            output_names=['image_embed', *high_res_names],
+            dynamic_axes={name: {0: 'batch'} for name in ['image', 'image_embed', *high_res_names]},
+            opset_version=opset,
+            dynamo=False
+        )
+
+        LOGGER.info(f'Exporting the SAM decoder to {paths["decoder"]}')
+
+        torch.onnx.export(
+            decoder,
+            (embed, point_coords, point_labels, *high_res_feats),
+            str(paths['decoder']),
+            input_names=['image_embed', 'point_coords', 'point_labels', *high_res_names],
+            output_names=['masks', 'scores'],
+            dynamic_axes={name: {0: 'prompts'} for name in ['point_coords', 'point_labels', 'masks', 'scores']},
+            opset_version=opset,
+            dynamo=False
+        )
+
+    metadata = {
+        'model': str(operator.model_path),
+        'model_digest': file_digest(operator.model_path),
+        'imgsz': imgsz,
+        'mask_threshold': float(getattr(sam, 'mask_threshold', 0.0)),
+        'high_res_feats': len(high_res_feats),
+        'opset': opset,
+    }
+
+    LOGGER.info('Checking the exported graphs against the torch model')
+
+    iou = check_export(paths, encoder, decoder, imgsz, metadata['mask_threshold'])
+
+    LOGGER.info(f'Mask IoU of the exported graphs: {iou:.4f}')
+
+    paths['metadata'].write_text(json.dumps(metadata, indent=2))
+
+    return paths['metadata']
+
+def check_export(paths: dict, encoder: _Encoder, decoder: _Decoder, imgsz: int, mask_threshold: float) -> float:
+    """Runs the exported graphs with onnxruntime and the torch model on a synthetic tile, and compares their masks
+
+    The torch model runs the original Ultralytics code, without the export replacements.
+
+    Args:
+        paths (dict): Paths of the exported graphs (see `onnx_paths`)
+        encoder (_Encoder): Encoder module that was exported
+        decoder (_Decoder): Decoder module that was exported
+        imgsz (int): SAM input size
+        mask_threshold (float): Threshold of the mask logits
+
+    Raises:
+        RuntimeError: If the masks differ (IoU below `MIN_MASK_IOU`)
+
+    Returns:
+        float: IoU of the masks of all the prompts
+    """
+    ort = load_onnxruntime()
+
+    # Disks of a few colors on a dark background, one prompt on each
+    rng = np.random.default_rng(0)
+    tile = np.full((imgsz, imgsz, 3), 30, dtype=np.uint8)
+    centers = rng.integers(imgsz // 8, imgsz - imgsz // 8, size=(6, 2))
+
+    for (x, y), color in zip(centers, rng.integers(80, 255, size=(6, 3))):
+        cv2.circle(tile, (int(x), int(y)), imgsz // 16, tuple(int(c) for c in color), -1)
+
+    image = ((tile.astype(np.float32) - PIXEL_MEAN) / PIXEL_STD).transpose(2, 0, 1)[None]
+    point_coords = centers.astype(np.float32).reshape(-1, 1, 2)
+    point_labels = np.ones(point_coords.shape[:2], dtype=np.int32)
+
+    encoder_session = ort.InferenceSession(str(paths['encoder']), providers=['CPUExecutionProvider'])
+    decoder_session = ort.InferenceSession(str(paths['decoder']), providers=['CPUExecutionProvider'])
+
+    features = encoder_session.run(None, {'image': image})
+    names = [output.name for output in encoder_session.get_outputs()]
+
+    onnx_masks, _ = decoder_session.run(None, {
+        **dict(zip(names, features)),
+        'point_coords': point_coords,
+        'point_labels': point_labels,
+    })
+
+    with torch.inference_mode():
+        torch_features = encoder(torch.from_numpy(image))
+
+        if isinstance(torch_features, torch.Tensor):
+            torch_features = (torch_features,)
+
+        embed, *high_res_feats = torch_features
+        torch_masks, _ = decoder(embed, torch.from_numpy(point_coords), torch.from_numpy(point_labels), *high_res_feats)
+
+    onnx_masks = onnx_masks > mask_threshold
+    torch_masks = torch_masks.numpy() > mask_threshold
+
+    union = np.count_nonzero(onnx_masks | torch_masks)
+    iou = np.count_nonzero(onnx_masks & torch_masks) / union if union else 1.0
+
+    if iou < MIN_MASK_IOU:
+        raise RuntimeError(f'The exported graphs do not match the torch model (mask IoU {iou:.4f}). Check the Ultralytics version.')
+
+    return iou
@@ -0,0 +1,293 @@
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+from sfai.cache import EmbeddingCache, TileCache, file_digest
+from sfai.operators.sam import SAMSegmentation
+
+PIXEL_MEAN = np.array([123.675, 116.28, 103.53], dtype=np.float32)
+"""Mean of the RGB channels, subtracted by the SAM preprocessing
+"""
+
+PIXEL_STD = np.array([58.395, 57.12, 57.375], dtype=np.float32)
+"""Standard deviation of the RGB channels, divided by the SAM preprocessing
+"""
+
+PAD_VALUE = 114
+"""Value of the padding added below and right of the resized tile, as done by Ultralytics
+"""
+
+def load_onnxruntime():
+    try:
+        import onnxruntime
+
+        return onnxruntime
+    except ImportError as e:
+        raise RuntimeError(
+            'ONNX Runtime is not installed. '
+            'Install it by running pip install ".[onnx]"'
+        ) from e
+
+def onnx_paths(model: Path | str, onnx_dir: Path | str | None = None) -> Dict[str, Path]:
+    """Paths of the ONNX graphs and metadata exported from a SAM model
+
+    Args:
+        model (Path | str): Path to the SAM model
+        onnx_dir (Path | str | None, optional): Folder of the exported files. Defaults to the folder of the model.
+
+    Returns:
+        Dict[str, Path]: Paths of the `encoder`, the `decoder` and the `metadata`
+    """
+    model = Path(model).absolute()
+    folder = Path(onnx_dir).absolute() if onnx_dir is not None else model.parent
+
+    return {
+        'encoder': folder / f'{model.stem}.encoder.onnx',
+        'decoder': folder / f'{model.stem}.decoder.onnx',
+        'metadata': folder / f'{model.stem}.onnx.json',
+    }
+
+@lru_cache(maxsize=None)
+def load_session(path: str, intra_op_threads: int = 0, inter_op_threads: int = 0) -> Any:
+    """Creates an onnxruntime CPU session. Sessions are created once per process and shared.
+
+    Args:
+        path (str): Path to the ONNX graph
+        intra_op_threads (int, optional): Threads running a single operator. 0 lets onnxruntime decide. Defaults to 0.
+        inter_op_threads (int, optional): Threads running independent operators in parallel. 0 runs them sequentially. Defaults to 0.
+
+    Returns:
+        onnxruntime.InferenceSession:
+    """
+    ort = load_onnxruntime()
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = intra_op_threads
+
+    if inter_op_threads > 0:
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        options.inter_op_num_threads = inter_op_threads
+
+    return ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+class SAMOnnxSegmentation(SAMSegmentation):
+    """Runs SAM exported to ONNX (`sfai export-onnx`) with onnxruntime on CPU.
+
+    Same operator as `SAMSegmentation`, without PyTorch nor Ultralytics at runtime: tiles are
+    letterboxed and normalized with OpenCV, the encoder graph runs on a batch of tiles, then the
+    decoder graph runs on all the prompts of each tile at once. The low resolution masks are
+    scaled back to the tile as Ultralytics does, and thresholded into binary masks (uint8), which
+    are merged and painted as with `SAMSegmentation`.
+
+    The onnxruntime sessions are created on first use and shared by all the operators of the
+    process. The input size is the one of the export.
+
+    Args:
+        model (Path | str): Path to the SAM model the graphs were exported from
+        save (bool, optional): Save artifact or not. Defaults to False.
+        batch_size (int, optional): Number of tiles encoded together. Defaults to 1.
+        dist_thresh (float, optional): Prompt points closer than this distance are merged. Defaults to 20.
+        cache (TileCache | None, optional): Cache of tile results, looked up before running the model. Defaults to None.
+        onnx_dir (Path | str | None, optional): Folder of the exported graphs. Defaults to the folder of the model.
+        intra_op_threads (int, optional): Threads running a single operator. 0 lets onnxruntime decide. Defaults to 0.
+        inter_op_threads (int, optional): Threads running independent operators in parallel. 0 runs them sequentially. Defaults to 0.
+        embeddings (EmbeddingCache | None, optional): Cache of tile embeddings, looked up before running the encoder graph. Defaults to None.
+    """
+    backend = 'onnx'
+
+    def __init__(
+        self,
+        model: Path | str,
+        save: bool = False,
+        batch_size: int = 1,
+        dist_thresh: float = 20,
+        cache: TileCache | None = None,
+        onnx_dir: Path | str | None = None,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+        embeddings: EmbeddingCache | None = None
+    ):
+        self.paths = onnx_paths(model, onnx_dir)
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+        super().__init__(model, save=save, batch_size=batch_size, dist_thresh=dist_thresh, cache=cache, embeddings=embeddings)
+
+    def _load_model(self):
+        """Reads the export metadata and creates the onnxruntime sessions
+
+        Raises:
+            FileNotFoundError: If the model was not exported
+            ValueError: If the graphs were exported from another version of the model file
+        """
+        if not self.paths['metadata'].is_file():
+            raise FileNotFoundError(f'No ONNX export of {self.model_path} in {self.paths["metadata"].parent}. Export it with: sfai export-onnx -m {self.model_path}')
+
+        self.metadata = json.loads(self.paths['metadata'].read_text())
+
+        if self.model_path.is_file():
+            self._model_digest = file_digest(self.model_path)
+
+            if self._model_digest != self.metadata['model_digest']:
+                raise ValueError(f'The ONNX export in {self.paths["metadata"].parent} does not match {self.model_path}. Export it again with: sfai export-onnx -m {self.model_path}')
+        else:
+            self._model_digest = self.metadata['model_digest']
+
+        self.imgsz = self.metadata['imgsz']
+        self.mask_threshold = self.metadata['mask_threshold']
+        self.model = None
+        self.device = 'cpu'
+
+        self.encoder = load_session(str(self.paths['encoder']), self.intra_op_threads, self.inter_op_threads)
+        self.decoder = load_session(str(self.paths['decoder']), self.intra_op_threads, self.inter_op_threads)
+
+    def predict_batch(self, images: List[np.ndarray], points: List[List[List[int]]]) -> List[List[np.ndarray]]:
+        """Predicts the object masks of several tiles, `batch_size` tiles at a time.
+
+        Args:
+            images (List[np.ndarray]): Tiles (BGR)
+            points (List[List[List[int]]]): Prompt points of each tile
+
+        Returns:
+            List[List[np.ndarray]]: Binary masks (uint8) of each tile
+        """
+        results = []
+
+        for start in range(0, len(images), self.batch_size):
+            results.extend(self._predict(images[start:start + self.batch_size], points[start:start + self.batch_size]))
+
+        return results
+
+    def _predict(self, images: List[np.ndarray], points: List[List[List[int]]]) -> List[List[np.ndarray]]:
+        """Encodes a batch of tiles and decodes the prompts of each tile.
+
+        Args:
+            images (List[np.ndarray]): Tiles (BGR)
+            points (List[List[List[int]]]): Prompt points of each tile
+
+        Returns:
+            List[List[np.ndarray]]: Binary masks (uint8) of each tile
+        """
+        features = self.embed(images)
+        results = []
+
+        for i, (image, pts) in enumerate(zip(images, points)):
+            h, w = image.shape[:2]
+            ratio = min(self.imgsz / h, self.imgsz / w)
+
+            # One prompt of a single positive point per object
+            coords = np.asarray(pts, dtype=np.float32).reshape(-1, 1, 2) * ratio
+
+            feeds = {
+                **features[i],
+                'point_coords': coords,
+                'point_labels': np.ones(coords.shape[:2], dtype=np.int32),
+            }
+
+            low_res_masks, scores = self.decoder.run(None, feeds)
+
+            results.append([
+                self.postprocess(mask[0], (h, w))
+                for mask in low_res_masks[scores[:, 0] > self.conf]
+            ])
+
+        return results
+
+    def _encode_tiles(self, images: List[np.ndarray]) -> List[Dict[str, np.ndarray]]:
+        """Preprocesses and encodes a batch of tiles
+
+        Returns:
+            List[Dict[str, np.ndarray]]: Decoder inputs of each tile (`image_embed` and `high_res_feat_<i>`)
+        """
+        batch = np.stack([self.preprocess(image) for image in images])
+        outputs = self.encoder.run(None, {'image': batch})
+        names = [output.name for output in self.encoder.get_outputs()]
+
+        return [
+            {name: output[i:i + 1] for name, output in zip(names, outputs)}
+            for i in range(len(images))
+        ]
+
+    @staticmethod
+    def _to_arrays(features: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        # Copied, the features of a tile are views of the whole batch
+        return {name: array.copy() for name, array in features.items()}
+
+    def _from_arrays(self, arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        return arrays
+
+    def preprocess(self, image: np.ndarray) -> np.ndarray:
+        """Resizes a tile to the model input size, keeping its aspect ratio, pads it below and right,
+        and normalizes it. Same as the Ultralytics SAM preprocessing.
+
+        Args:
+            image (np.ndarray): Tile (BGR)
+
+        Returns:
+            np.ndarray: Model input (3, imgsz, imgsz), float32, RGB
+        """
+        h, w = image.shape[:2]
+        ratio = min(self.imgsz / h, self.imgsz / w)
+        new_w, new_h = round(w * ratio), round(h * ratio)
+
+        if (new_w, new_h) != (w, h):
+            image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+        padded = np.full((self.imgsz, self.imgsz, 3), PAD_VALUE, dtype=np.uint8)
+        padded[:new_h, :new_w] = image
+
+        rgb = padded[..., ::-1].astype(np.float32)
+
+        return ((rgb - PIXEL_MEAN) / PIXEL_STD).transpose(2, 0, 1)
+
+    def postprocess(self, low_res_mask: np.ndarray, shape: tuple) -> np.ndarray:
+        """Scales a low resolution mask back to the tile and thresholds it.
+
+        The region of the mask covering the tile (the rest is padding) is resized bilinearly to the
+        tile shape. The region can end in the middle of a mask pixel, so it is sampled with an affine
+        warp rather than cropped. Same as `ultralytics.utils.ops.scale_masks`.
+
+        Args:
+            low_res_mask (np.ndarray): Mask logits (h, w)
+            shape (tuple): Tile shape (height, width)
+
+        Returns:
+            np.ndarray: Binary mask (uint8) of the tile
+        """
+        h, w = shape
+        mask_h, mask_w = low_res_mask.shape
+        gain = min(self.imgsz / h, self.imgsz / w)
+
+        # Size of the tile region in mask pixels
+        region_h = round(h * gain) * mask_h / self.imgsz
+        region_w = round(w * gain) * mask_w / self.imgsz
+
+        # Maps the tile pixel centers to the mask (half-pixel convention of bilinear resizing)
+        scale_x, scale_y = region_w / w, region_h / h
+        matrix = np.array([
+            [scale_x, 0, 0.5 * scale_x - 0.5],
+            [0, scale_y, 0.5 * scale_y - 0.5],
+        ], dtype=np.float64)
+
+        mask = cv2.warpAffine(
+            low_res_mask,
+            matrix,
+            (w, h),
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_REPLICATE
+        )
+
+        return (mask > self.mask_threshold).astype(np.uint8)
+
+    def model_info(self):
+        """Get model info
+
+        Returns:
+            Dict[str, Any]: Export metadata
+        """
+        return self.metadata
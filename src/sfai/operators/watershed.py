@@ -48,9 +48,9 @@ class WatershedSegmentation(Operator):
         
         save_path = crop_subfolder / f'{ctx.index}.jpg'
         
-        plt_kwargs = {
+        artifact_kwargs = {
             'cmap': 'nipy_spectral'
         }
         
-        return ctx.metadata['labels'], save_path, plt_kwargs
+        return ctx.metadata['labels'], save_path, artifact_kwargs
         
\ No newline at end of file
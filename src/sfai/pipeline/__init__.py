@@ -1,7 +1,15 @@
 from .context import PipelineContext
+from .metrics import Metrics, StageMetrics, ImageMetrics, read_metrics
 from .pipeline import Pipeline
+from .scheduler import TileScheduler, split_operators
 
 __all__ = [
     "PipelineContext",
-    "Pipeline"
+    "Pipeline",
+    "TileScheduler",
+    "split_operators",
+    "Metrics",
+    "StageMetrics",
+    "ImageMetrics",
+    "read_metrics"
 ]
\ No newline at end of file
@@ -0,0 +1,205 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator
+
+@dataclass
+class StageMetrics:
+    """Measurements of a pipeline stage, accumulated over its calls.
+
+    Attributes:
+        wall (float): Wall time in seconds
+        cpu (float): CPU time of the thread running the stage in seconds. Stages running concurrently in other threads are not counted, nor are the threads started by OpenCV or torch.
+        peak_bytes (int): Highest memory allocated by a single call, above the memory allocated before the call. Only measured when memory is traced.
+        calls (int): Number of calls. A batch of tiles is a single call.
+        tiles (int): Number of tiles processed
+    """
+    wall: float = 0.0
+    cpu: float = 0.0
+    peak_bytes: int = 0
+    calls: int = 0
+    tiles: int = 0
+
+    def merge(self, other: 'StageMetrics'):
+        """Adds the measurements of another stage to this one. Peaks are maxed, the rest is summed.
+        """
+        self.wall += other.wall
+        self.cpu += other.cpu
+        self.peak_bytes = max(self.peak_bytes, other.peak_bytes)
+        self.calls += other.calls
+        self.tiles += other.tiles
+
+@dataclass
+class Metrics:
+    """Per-stage measurements of an image, or of a whole run.
+
+    Stages are measured with `measure`. Operators are named after their class, so a run shows
+    at a glance whether e.g. the watershed or SAM is the bottleneck.
+
+    Memory is traced with `tracemalloc`, which slows the pipeline down. It sees the arrays
+    allocated by NumPy and OpenCV, but not the memory allocated by torch (GPU memory included).
+
+    Args:
+        trace_memory (bool, optional): If true, the peak allocated memory of each stage is measured. Defaults to False.
+
+    Attributes:
+        stages (Dict[str, StageMetrics]): Measurements of each stage, in first call order
+        counters (Dict[str, int]): Additional counts (tiles, skipped tiles...)
+        trace_memory (bool): If the peak allocated memory is measured.
+    """
+    trace_memory: bool = False
+    stages: Dict[str, StageMetrics] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=dict)
+
+    @contextmanager
+    def measure(self, stage: str, tiles: int = 0) -> Iterator[None]:
+        """Measures the enclosed block as a call of a stage. Blocks must not be nested when memory is traced.
+
+        Args:
+            stage (str): Stage name
+            tiles (int, optional): Number of tiles processed by the call. Defaults to 0.
+        """
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+
+        wall = time.perf_counter()
+        # Per thread: the classical operators of the next tiles run in background threads meanwhile
+        cpu = time.thread_time()
+
+        try:
+            yield
+        finally:
+            measured = StageMetrics(
+                wall=time.perf_counter() - wall,
+                cpu=time.thread_time() - cpu,
+                calls=1,
+                tiles=tiles
+            )
+
+            if self.trace_memory:
+                measured.peak_bytes = max(tracemalloc.get_traced_memory()[1] - base, 0)
+
+            self.stages.setdefault(stage, StageMetrics()).merge(measured)
+
+    def count(self, name: str, value: int = 1):
+        """Increments a counter
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, other: 'Metrics'):
+        """Adds the measurements of another image to these ones
+        """
+        for stage, measured in other.stages.items():
+            self.stages.setdefault(stage, StageMetrics()).merge(measured)
+
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+    @property
+    def total(self) -> float:
+        """Wall time of all the stages in seconds
+        """
+        return sum(s.wall for s in self.stages.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'total': self.total,
+            'counters': dict(self.counters),
+            'stages': {name: asdict(s) for name, s in self.stages.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Metrics':
+        return cls(
+            stages={name: StageMetrics(**s) for name, s in data.get('stages', {}).items()},
+            counters=dict(data.get('counters', {}))
+        )
+
+    @classmethod
+    def aggregate(cls, metrics: Iterable['Metrics']) -> 'Metrics':
+        """Merges the measurements of several images
+
+        Args:
+            metrics (Iterable[Metrics]):
+
+        Returns:
+            Metrics: Run measurements
+        """
+        total = cls()
+
+        for m in metrics:
+            total.merge(m)
+
+        return total
+
+    def summary(self) -> str:
+        """Formats the measurements as a table, slowest stages first
+
+        Returns:
+            str: Summary table
+        """
+        total = self.total or 1.0
+
+        lines = [
+            f'{"stage":<28} {"calls":>7} {"tiles":>7} {"wall (s)":>10} {"share":>7} {"cpu (s)":>10} {"ms/tile":>9} {"peak (MiB)":>11}'
+        ]
+
+        for name, s in sorted(self.stages.items(), key=lambda item: item[1].wall, reverse=True):
+            per_tile = f'{1000 * s.wall / s.tiles:>9.2f}' if s.tiles else f'{"-":>9}'
+
+            lines.append(
+                f'{name:<28} {s.calls:>7} {s.tiles:>7} {s.wall:>10.3f} {s.wall / total:>7.1%} {s.cpu:>10.3f} {per_tile} {s.peak_bytes / 2**20:>11.1f}'
+            )
+
+        lines.append(f'{"total":<28} {"":>7} {"":>7} {self.total:>10.3f}')
+
+        for name, value in self.counters.items():
+            lines.append(f'{name}: {value}')
+
+        return '\n'.join(lines)
+
+@dataclass
+class ImageMetrics:
+    """Measurements of an image, written as a line of the metrics JSONL file
+    """
+    image_id: int
+    file_name: str
+    metrics: Metrics
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'image_id': self.image_id,
+            'file_name': self.file_name,
+            **self.metrics.to_dict()
+        }
+
+def read_metrics(path: Path) -> Metrics:
+    """Aggregates the measurements of the images of a metrics JSONL file
+
+    Args:
+        path (Path): Metrics JSONL file
+
+    Returns:
+        Metrics: Run measurements. Empty if the file does not exist.
+    """
+    run_metrics = Metrics()
+
+    if not path.exists():
+        return run_metrics
+
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                run_metrics.merge(Metrics.from_dict(json.loads(line)))
+            except json.JSONDecodeError:
+                # Partial line of an interrupted run
+                continue
+
+    return run_metrics
@@ -1,26 +1,40 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, List, Tuple
 
-if TYPE_CHECKING:
-    import numpy as np
+import numpy as np
 
+if TYPE_CHECKING:
     from sfai.operators import Operator    
     from sfai.export import OutputHandler
     from sfai.data import ImageInfo
 
 from sfai.pipeline import PipelineContext
+from sfai.pipeline.metrics import Metrics
 
 class Pipeline:
     """Pipeline class used to execute the operators on an image.
 
+    Once the binary mask of a tile is computed, tiles with a foreground coverage of at most
+    `min_foreground` skip the remaining operators. They get an empty `sam_mask` and a `label_count`
+    of 0, and are flagged with `metadata['skipped']`.
+
+    When `metrics` is set, each operator call is measured under the operator class name.
+
     Args:
         operators (list[Operator]): List of operator to be executed on the image
+        min_foreground (float, optional): Foreground fraction of a tile at or below which it is skipped. Defaults to 0 (only blank tiles are skipped).
+        metrics (Metrics | None, optional): Collects the wall time, CPU time and peak memory of each operator. Defaults to None.
 
     Attributes:
         operators (list[Operator]): List of operator to be executed on the image
+        min_foreground (float): Foreground fraction of a tile at or below which it is skipped.
+        metrics (Metrics | None): Operator measurements
     """
-    def __init__(self, operators: list[Operator]):
+    def __init__(self, operators: list[Operator], min_foreground: float = 0.0, metrics: Metrics | None = None):
         self.operators = operators
+        self.min_foreground = min_foreground
+        self.metrics = metrics
         
     def run(self, image: np.ndarray, image_info: ImageInfo, index: int, output_handler: OutputHandler) -> PipelineContext:
         """
@@ -43,5 +57,112 @@ class Pipeline:
         )
         
         for op in self.operators:
-            ctx = op(ctx)
-        return ctx
\ No newline at end of file
+            with self._measure(op, 1, self.metrics):
+                ctx = op(ctx)
+            
+            if self._skipped(ctx):
+                break
+        return ctx
+    
+    def run_batch(self, tiles: List[Tuple[int, np.ndarray]], image_info: ImageInfo, output_handler: OutputHandler) -> List[PipelineContext]:
+        """Runs the pipeline on several tiles. Each operator is applied on the whole batch before the next one.
+
+        Args:
+            tiles (List[Tuple[int, np.ndarray]]): Index and image of each tile
+            image_info (ImageInfo): Image the tiles come from
+            output_handler (OutputHandler):
+
+        Returns:
+            List[PipelineContext]: Contexts of the tiles, in input order. Skipped tiles included.
+        """
+        return self.run_operators(self.contexts(tiles, image_info, output_handler), self.operators)
+    
+    def contexts(self, tiles: List[Tuple[int, np.ndarray]], image_info: ImageInfo, output_handler: OutputHandler) -> List[PipelineContext]:
+        """Creates the contexts of a batch of tiles
+
+        Args:
+            tiles (List[Tuple[int, np.ndarray]]): Index and image of each tile
+            image_info (ImageInfo): Image the tiles come from
+            output_handler (OutputHandler):
+
+        Returns:
+            List[PipelineContext]:
+        """
+        return [
+            PipelineContext(
+                index=index,
+                image=image,
+                image_info=image_info,
+                output_handler=output_handler,
+                metadata={}
+            )
+            for index, image in tiles
+        ]
+    
+    def run_operators(self, ctxs: List[PipelineContext], operators: List[Operator], metrics: Metrics | None = None) -> List[PipelineContext]:
+        """Runs some of the operators on a batch of tile contexts. Tiles already skipped are left as they are.
+
+        Used to run the pipeline in stages (see `TileScheduler`).
+
+        Args:
+            ctxs (List[PipelineContext]): Contexts of the tiles
+            operators (List[Operator]): Operators to run, in order
+            metrics (Metrics | None, optional): Collects the measurements instead of `self.metrics`. Defaults to None.
+
+        Returns:
+            List[PipelineContext]: Contexts of the tiles, in input order. Skipped tiles included.
+        """
+        metrics = metrics if metrics is not None else self.metrics
+        active = [i for i in range(len(ctxs)) if not self._skipped(ctxs[i])]
+        
+        for op in operators:
+            if not active:
+                break
+            
+            with self._measure(op, len(active), metrics):
+                results = op.run_batch([ctxs[i] for i in active])
+            
+            for i, ctx in zip(active, results):
+                ctxs[i] = ctx
+            
+            active = [i for i in active if not self._skipped(ctxs[i])]
+        return ctxs
+    
+    def _measure(self, op: Operator, tiles: int, metrics: Metrics | None):
+        """Measures an operator call if metrics are collected
+
+        Args:
+            op (Operator):
+            tiles (int): Number of tiles processed by the call
+            metrics (Metrics | None): Collects the measurement
+        """
+        if metrics is None:
+            return nullcontext()
+        
+        return metrics.measure(type(op).__name__, tiles=tiles)
+    
+    def _skipped(self, ctx: PipelineContext) -> bool:
+        """Checks whether a tile skips the remaining operators.
+
+        The foreground coverage is computed once, as soon as the binary mask exists. Skipped tiles
+        get their empty results.
+
+        Args:
+            ctx (PipelineContext):
+
+        Returns:
+            bool: True if the tile is skipped
+        """
+        if ctx.binary_mask is None:
+            return False
+        
+        if 'foreground' not in ctx.metadata:
+            coverage = np.count_nonzero(ctx.binary_mask) / ctx.binary_mask.size
+            ctx.metadata['foreground'] = coverage
+            
+            if coverage <= self.min_foreground:
+                ctx.sam_mask = np.zeros(ctx.binary_mask.shape[:2], dtype=np.uint16)
+                ctx.metadata['label_count'] = 0
+                ctx.metadata['skipped'] = True
+        
+        return ctx.metadata.get('skipped', False)
\ No newline at end of file
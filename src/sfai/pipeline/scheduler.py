@@ -0,0 +1,113 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import TYPE_CHECKING, Deque, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sfai.operators import Operator
+    from sfai.export import OutputHandler
+    from sfai.data import ImageInfo
+
+from sfai.pipeline import PipelineContext
+from sfai.pipeline.metrics import Metrics
+from sfai.pipeline.pipeline import Pipeline
+
+def split_operators(operators: List[Operator]) -> Tuple[List[Operator], List[Operator]]:
+    """Splits operators into a CPU stage and a model stage.
+
+    The model stage starts at the first operator running a model, i.e. exposing its input size as
+    `imgsz` (SAM). The operators before it (background removal, watershed, centers...) form the
+    CPU stage.
+
+    Args:
+        operators (List[Operator]): Operators, in execution order
+
+    Returns:
+        Tuple[List[Operator], List[Operator]]: Operators of the CPU stage, and of the model stage
+    """
+    for i, op in enumerate(operators):
+        if getattr(op, 'imgsz', None):
+            return operators[:i], operators[i:]
+
+    return operators, []
+
+class TileScheduler:
+    """Runs the CPU stage of a pipeline a few batches of tiles ahead of its model stage.
+
+    The operators of the CPU stage (see `split_operators`) run on a thread pool, while the model
+    stage runs on the batch before in the calling thread. OpenCV, scikit-image and torch release
+    the GIL, so the classical operators of the next tiles run while SAM runs on the current ones.
+    Prepared batches wait in a queue of `depth` batches. Batches come out in input order.
+
+    With a depth of 0, or a pipeline without two stages, batches go through the whole pipeline in
+    the calling thread, one after the other.
+
+    The operators of the CPU stage must support being called from several threads when `workers`
+    is above 1. Their measurements are collected per batch and merged into the pipeline metrics in
+    the calling thread.
+
+    Args:
+        pipeline (Pipeline): Pipeline whose operators are scheduled
+        depth (int, optional): Maximum number of batches prepared ahead of the model stage. Defaults to 2.
+        workers (int, optional): Number of threads running the CPU stage. Defaults to 1.
+    """
+    def __init__(self, pipeline: Pipeline, depth: int = 2, workers: int = 1):
+        self.pipeline = pipeline
+        self.depth = max(depth, 0)
+        self.workers = max(workers, 1)
+        self.cpu_operators, self.model_operators = split_operators(pipeline.operators)
+
+    def run(self, batches: Iterable[List[Tuple[int, np.ndarray]]], image_info: ImageInfo, output_handler: OutputHandler) -> Iterator[List[PipelineContext]]:
+        """Runs the pipeline on batches of tiles
+
+        Args:
+            batches (Iterable[List[Tuple[int, np.ndarray]]]): Index and image of the tiles of each batch. Consumed in the calling thread.
+            image_info (ImageInfo): Image the tiles come from
+            output_handler (OutputHandler):
+
+        Yields:
+            List[PipelineContext]: Contexts of the tiles of each batch, in input order
+        """
+        if self.depth == 0 or not self.cpu_operators or not self.model_operators:
+            for batch in batches:
+                yield self.pipeline.run_batch(batch, image_info, output_handler)
+            return
+
+        batches = iter(batches)
+        pending: Deque[Future] = deque()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sfai-tiles') as executor:
+            try:
+                for batch in islice(batches, self.depth):
+                    pending.append(executor.submit(self._prepare, batch, image_info, output_handler))
+
+                while pending:
+                    ctxs, metrics = pending.popleft().result()
+
+                    # Keeps the queue full while the model stage runs
+                    for batch in islice(batches, 1):
+                        pending.append(executor.submit(self._prepare, batch, image_info, output_handler))
+
+                    if metrics is not None:
+                        self.pipeline.metrics.merge(metrics)
+
+                    yield self.pipeline.run_operators(ctxs, self.model_operators)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _prepare(self, batch: List[Tuple[int, np.ndarray]], image_info: ImageInfo, output_handler: OutputHandler) -> Tuple[List[PipelineContext], Metrics | None]:
+        """Runs the CPU stage on a batch, in a pool thread
+
+        Returns:
+            Tuple[List[PipelineContext], Metrics | None]: Contexts of the tiles, and measurements of the CPU stage
+        """
+        ctxs = self.pipeline.contexts(batch, image_info, output_handler)
+
+        # Measured apart, `Metrics` is not shared between threads
+        metrics = Metrics() if self.pipeline.metrics is not None else None
+
+        return self.pipeline.run_operators(ctxs, self.cpu_operators, metrics), metrics
@@ -1,8 +1,9 @@
-from .dataset import DatasetRunner
+from .dataset import DatasetRunner, create_executor
 from .image import ImagePipelineRunner, TileResult
 
 __all__ = [
     "DatasetRunner",
+    "create_executor",
     "ImagePipelineRunner",
     "TileResult"
 ]
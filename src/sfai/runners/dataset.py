@@ -1,32 +1,110 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, List
+from typing import TYPE_CHECKING, Callable, Iterator, List, Tuple
 
-from sfai.data import Dataset
-from sfai.export import JsonlBufferedWriter, CocoWriter
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+import cv2
+
+from sfai.data import Dataset, read_image
+from sfai.export import JsonlBufferedWriter, StreamingCocoWriter, get_artifact_writer
 from sfai.export.data import CocoImage, DEFAULT_CATEGORY
+from sfai.export.resume import restore_checkpoint
 from sfai.logging import LOGGER
+from sfai.pipeline import ImageMetrics, read_metrics
 from sfai.runners.image import ImagePipelineRunner
 
 if TYPE_CHECKING:
+    from pathlib import Path
+    from sfai.data import ImageInfo
     from sfai.export import OutputHandler
     from sfai.config import SegmentationConfig
-    from sfai.operators import Operator 
-    from sfai.export.data import CocoCategory
+    from sfai.operators import Operator
+    from sfai.pipeline import Metrics
+    from sfai.export.data import CocoCategory, CocoAnnotation
+
+_WORKER_RUNNER: ImagePipelineRunner | None = None
+"""Image runner of a worker process. Set by `init_worker`.
+"""
+
+def create_executor(config: SegmentationConfig, operator_factory: Callable[[SegmentationConfig], List[Operator]]) -> ProcessPoolExecutor:
+    """Creates a process pool used to segment images in parallel.
+
+    Args:
+        config (SegmentationConfig): Run configuration. `config.workers` sets the number of processes.
+        operator_factory (Callable[[SegmentationConfig], List[Operator]]): Builds the operators. Called once in each worker.
+
+    Returns:
+        ProcessPoolExecutor: The process pool
+    """
+    # 'spawn' avoids forking a process that already initialized CUDA or OpenCV threads
+    return ProcessPoolExecutor(
+        max_workers=config.workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+        initargs=(operator_factory, config)
+    )
+
+def init_worker(operator_factory: Callable[[SegmentationConfig], List[Operator]], config: SegmentationConfig):
+    """Process pool initializer. Builds the operators of the worker, including the SAM model.
+
+    Args:
+        operator_factory (Callable[[SegmentationConfig], List[Operator]]): Builds the operators
+        config (SegmentationConfig): Run configuration
+    """
+    global _WORKER_RUNNER
+
+    # Parallelism comes from the pool, one OpenCV thread per worker avoids oversubscription
+    cv2.setNumThreads(1)
+
+    _WORKER_RUNNER = ImagePipelineRunner(
+        operators=operator_factory(config),
+        config=config
+    )
+
+def run_worker(task: Tuple[int, Path, Path | None, OutputHandler]) -> Tuple[ImageInfo, List[CocoAnnotation], Metrics]:
+    """Segments a single image in a worker process.
+
+    The image is read by the worker so that only its path goes through the pool.
+
+    Args:
+        task (Tuple[int, Path, Path | None, OutputHandler]): Image ID, image path, raw cache directory of windowed images (see `read_image`) and output handler
+
+    Returns:
+        Tuple[ImageInfo, List[CocoAnnotation], Metrics]: Image informations, annotations and measurements
+    """
+    image_id, path, cache_dir, output_handler = task
+    image_info, image = read_image(image_id, path, cache_dir)
+
+    annotations, metrics = _WORKER_RUNNER.run(image_info, image, output_handler)
+    
+    # Artifacts of the image are written before it is reported as done
+    get_artifact_writer().flush()
+
+    return image_info, annotations, metrics
 
 class DatasetRunner:
     """Runner for a whole dataset
 
     Args:
         dataset (Dataset):
-        operators (List[Operator]):
+        operators (List[Operator] | None): Operators used in-process. Unused when an executor is given.
         output_handler (OutputHandler):
         config (SegmentationConfig):
+        executor (Executor | None, optional): Process pool created with `create_executor`. If set, images are segmented in parallel. Defaults to None.
     """
-    def __init__(self, dataset: Dataset, operators: List[Operator], output_handler: OutputHandler, config: SegmentationConfig):
+    def __init__(
+        self,
+        dataset: Dataset,
+        operators: List[Operator] | None,
+        output_handler: OutputHandler,
+        config: SegmentationConfig,
+        executor: Executor | None = None
+    ):
         self.operators = operators
         self.config = config
         self.dataset = dataset
         self.output_handler = output_handler
+        self.executor = executor
 
         self.image_runner = ImagePipelineRunner(
             operators=operators,
@@ -35,38 +113,123 @@ class DatasetRunner:
 
     def run(self):
         """Runs the pipeline on a dataset.
+
+        Results are written in the dataset order, whatever the execution mode. Annotation IDs are
+        assigned here, so they are unique over the dataset and do not depend on the execution order.
+
+        Each image is a checkpoint: its annotations are flushed, then its image record. When the
+        run is resumed, images already committed are skipped and the result is the same as an
+        uninterrupted run.
+
+        The measurements of each image are appended to `metrics.jsonl` once it is committed. At the
+        end, they are aggregated over the whole run (resumed images included) into a summary table,
+        logged and written to `metrics.txt`.
         """
-        stats = {}
         categories: List[CocoCategory] = [DEFAULT_CATEGORY]
-        
+
         annotation_out = self.output_handler.annotation_dir / 'result.json'
         
-        coco_writer = CocoWriter(
+        done = 0
+        next_annotation_id = 1
+        
+        if self.config.resume:
+            committed, next_annotation_id = restore_checkpoint(
+                self.output_handler.images_jsonl_path,
+                self.output_handler.annotations_jsonl_path,
+                self.output_handler.metrics_jsonl_path
+            )
+            
+            self.dataset.skip(committed)
+            done = len(committed)
+            
+            LOGGER.info(f"Resuming: {done}/{self.dataset.length} images already segmented")
+            
+            annotation_out.unlink(missing_ok=True)
+
+        coco_writer = StreamingCocoWriter(
             self.output_handler.images_jsonl_path,
             self.output_handler.annotations_jsonl_path,
             categories,
-            annotation_out
+            annotation_out,
+            indent=self.config.coco_indent
         )
-        
+
         images_writer = JsonlBufferedWriter(self.output_handler.images_jsonl_path)
         annotations_writer = JsonlBufferedWriter(self.output_handler.annotations_jsonl_path)
-        
-        for i, (image_info, image) in enumerate(self.dataset, 1):
-            LOGGER.info(f"Image: {i}/{self.dataset.length}")
+        metrics_writer = JsonlBufferedWriter(self.output_handler.metrics_jsonl_path)
+
+        for image_info, annotations, metrics in self._results(done):
             coco_img = CocoImage(
                 id=image_info.id,
                 width=image_info.width,
                 height=image_info.height,
                 file_name=image_info.file_name
             )
+
+            for annotation in annotations:
+                annotation.id = next_annotation_id
+                next_annotation_id += 1
+
+            annotations_writer.write_list(annotations)
+            annotations_writer.flush()
             
             images_writer.write(coco_img)
+            images_writer.flush()
             
-            annotations, timing = self.image_runner.run(image_info, image, self.output_handler)
-            annotations_writer.write_list(annotations)
-            stats[image_info.file_name] = timing
-            
+            metrics_writer.write(ImageMetrics(image_id=image_info.id, file_name=image_info.file_name, metrics=metrics))
+            metrics_writer.flush()
+
         images_writer.close()
         annotations_writer.close()
+        metrics_writer.close()
+        
+        get_artifact_writer().flush()
+
+        coco_writer.write()
         
-        coco_writer.write()
\ No newline at end of file
+        self._summarize()
+
+    def _summarize(self):
+        """Aggregates the measurements of the run, logs them and writes them to the summary file
+        """
+        run_metrics = read_metrics(self.output_handler.metrics_jsonl_path)
+        
+        tiles = run_metrics.counters.get('tiles', 0)
+        skipped = run_metrics.counters.get('skipped_tiles', 0)
+        
+        if tiles:
+            LOGGER.info(f"Skipped tiles (foreground at or below {self.config.min_foreground:.1%}): {skipped}/{tiles}")
+        
+        if run_metrics.stages:
+            summary = run_metrics.summary()
+            
+            self.output_handler.metrics_summary_path.write_text(summary + '\n', encoding='utf-8')
+            LOGGER.info(f"Stage metrics:\n{summary}")
+
+    def _results(self, done: int = 0) -> Iterator[Tuple[ImageInfo, List[CocoAnnotation], Metrics]]:
+        """Segments the images of the dataset, in-process or on the executor. Skipped images are left out.
+
+        Args:
+            done (int, optional): Number of images already segmented, for progress logs. Defaults to 0.
+
+        Yields:
+            Tuple[ImageInfo, List[CocoAnnotation], Metrics]: Image informations, annotations and measurements, in dataset order
+        """
+        if self.executor is None:
+            for i, (image_info, image) in enumerate(self.dataset, done + 1):
+                LOGGER.info(f"Image: {i}/{self.dataset.length}")
+                annotations, metrics = self.image_runner.run(image_info, image, self.output_handler)
+
+                yield image_info, annotations, metrics
+            return
+
+        tasks = [
+            (image_id, path, self.dataset.cache_dir, self.output_handler)
+            for image_id, path in self.dataset.items()
+        ]
+
+        # `map` yields in submission order, whatever the order in which the workers finish
+        for i, result in enumerate(self.executor.map(run_worker, tasks), done + 1):
+            LOGGER.info(f"Image: {i}/{self.dataset.length}")
+
+            yield result
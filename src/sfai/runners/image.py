@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, List, Optional
+from typing import TYPE_CHECKING, Iterator, List, Optional
 
 if TYPE_CHECKING:
     from sfai.operators import Operator
@@ -7,19 +7,26 @@ if TYPE_CHECKING:
 
 import numpy as np
 from dataclasses import dataclass
-import matplotlib.pyplot as plt
 import cv2
 import random
-import time
+import math
+from itertools import islice
+from collections import deque
 
-from sfai.pipeline import Pipeline, PipelineContext
+from sfai.pipeline import Pipeline, PipelineContext, Metrics, TileScheduler, split_operators
 from sfai.data import ImageTiler, Tile
 from sfai.stitch import MaskStitcher
 from sfai.mask import MaskProcessor
 from sfai.data import ImageInfo
 from sfai.export.data import CocoAnnotation
-from sfai.export import OutputHandler
+from sfai.export import OutputHandler, get_artifact_writer
 from sfai.logging import PipelineProgess
+from sfai.operators import TilePrompts
+from sfai.runners.prompts import ImagePrompter
+
+PROMPT_MODES = ['tile', 'image']
+"""Where the classical operators run: on each tile, or once on the whole image
+"""
 
 def random_rgb_bright(seed: Optional[int] = None, min_val=64, max_val=255):
     """Generate a random RGB color from a seed
@@ -47,97 +54,258 @@ class TileResult:
     tile: Tile
     ctx: PipelineContext
 
+def downscale(image: np.ndarray, step: int, block_rows: int = 256) -> np.ndarray:
+    """Shrinks an image by an integer factor, averaging each `step` x `step` block of pixels.
+
+    The image is read `block_rows` output rows at a time, so that a memory-mapped image is never
+    loaded in memory at once.
+
+    Args:
+        image (np.ndarray): Image, possibly memory-mapped
+        step (int): Shrink factor
+        block_rows (int, optional): Number of output rows computed at once. Defaults to 256.
+
+    Returns:
+        np.ndarray: Image of size (ceil(h / step), ceil(w / step))
+    """
+    if step <= 1:
+        return image
+    
+    h, w = image.shape[:2]
+    out_w = math.ceil(w / step)
+    out = np.empty((math.ceil(h / step), out_w, *image.shape[2:]), dtype=image.dtype)
+    
+    for y in range(0, out.shape[0], block_rows):
+        rows = min(block_rows, out.shape[0] - y)
+        block = np.asarray(image[y * step:(y + rows) * step])
+        out[y:y + rows] = cv2.resize(block, (out_w, rows), interpolation=cv2.INTER_AREA).reshape(out[y:y + rows].shape)
+    
+    return out
+
+def model_input_size(operators: List[Operator] | None) -> int | None:
+    """Returns the input size of the model run by the operators, if any.
+
+    Operators running a model with a fixed input size expose it as `imgsz`.
+
+    Args:
+        operators (List[Operator] | None):
+
+    Returns:
+        int | None: Smallest model input size, None if no operator has one
+    """
+    sizes = [op.imgsz for op in operators or [] if getattr(op, 'imgsz', None)]
+    
+    return min(sizes, default=None)
+
+def build_tiler(config: SegmentationConfig, operators: List[Operator] | None) -> ImageTiler:
+    """Builds the image tiler described by a configuration
+
+    Args:
+        config (SegmentationConfig):
+        operators (List[Operator] | None): Operators, used to match the tile size to the model input
+
+    Returns:
+        ImageTiler:
+    """
+    tile_size = config.tile_size
+    
+    if config.match_model_input:
+        tile_size = model_input_size(operators) or tile_size
+    
+    return ImageTiler(
+        rows=config.tile_rows,
+        cols=config.tile_columns,
+        overlap=config.tile_overlap,
+        tile_size=tile_size
+    )
+
 class ImagePipelineRunner:
     """
     Pipeline runner for a single image.
     
-    Handles image operations.
+    Handles image operations. With the 'image' prompt mode, the classical operators run once on the
+    whole image (see `ImagePrompter`) and only SAM runs on the tiles.
     """
     def __init__(self, operators: List[Operator], config: SegmentationConfig):
+        if config.prompt_mode not in PROMPT_MODES:
+            raise ValueError(f"Unsupported prompt mode {config.prompt_mode}. Supported modes: {PROMPT_MODES}")
+        
         self.config = config
         self.operators = operators
+        self.tiler = build_tiler(config, operators)
         
-    def run(self, image_info: ImageInfo, image: np.ndarray, output_handler: OutputHandler) -> tuple[List[CocoAnnotation], dict]:
+    def run(self, image_info: ImageInfo, image: np.ndarray, output_handler: OutputHandler) -> tuple[List[CocoAnnotation], Metrics]:
         """Run the pipeline on an image
+
+        Returns:
+            tuple[List[CocoAnnotation], Metrics]: Annotations of the image, and measurements of each operator and post-processing stage
         """
         annotations: List[CocoAnnotation] = []
+        metrics = Metrics(trace_memory=self.config.trace_memory)
         
-        stitcher = MaskStitcher()
+        stitcher = MaskStitcher(canvas_dir=self.config.scratch_path if self.config.out_of_core else None)
         mask_processor = MaskProcessor()
-
-        start_pipeline = time.time()
-
-        tile_results = TilePipelinRunner(
-            self.operators
-        ).run(image_info, image, output_handler)
         
-        end_pipeline = time.time()
-
-        start_postprocess = time.time()
+        operators = self.operators
+        
+        if self.config.prompt_mode == 'image':
+            operators = self._image_operators(image_info, image, output_handler, metrics)
 
-        label_image = stitcher.stitch(tiles=tile_results, image_shape=image.shape[:2])
+        tile_runner = TilePipelinRunner(
+            operators,
+            batch_size=self.config.sam_batch_size,
+            tiler=self.tiler,
+            min_foreground=self.config.min_foreground,
+            metrics=metrics,
+            # Memory peaks are process-wide, the stages cannot be traced while they overlap
+            queue_depth=0 if self.config.trace_memory else self.config.tile_queue_depth,
+            threads=self.config.tile_threads
+        )
         
-        for annotation in mask_processor.build_annotations(label_image, image_id=image_info.id, category_id=1):
-            annotations.append(annotation)
+        # Tiles are stitched as they complete, their contexts are released right after
+        stitcher.begin(image.shape[:2])
         
-        end_postprocess = time.time()
-
-        stats = {
-            "pipeline": end_pipeline - start_pipeline,
-            "postprocess": end_postprocess - start_postprocess,
-            "total": (end_pipeline - start_pipeline) + (end_postprocess - start_postprocess)
-        }
-            
-        if self.config.save_final_images:
-            path = output_handler.image_dir / image_info.name
-            
-            plt.imsave(f'{path}_labels.png', label_image, cmap='nipy_spectral', format='png', dpi=400)
+        for result in tile_runner.iter_run(image_info, image, output_handler):
+            with metrics.measure('stitching', tiles=1):
+                stitcher.add(result.tile, result.ctx.sam_mask, result.ctx.metadata.get('label_count', 0))
             
-            img = image.copy()
+            metrics.count('tiles')
+            metrics.count('prompts', len(result.ctx.points or []))
+            metrics.count('skipped_tiles', int(result.ctx.metadata.get('skipped', False)))
+        
+        with metrics.measure('stitching'):
+            label_image = stitcher.finish()
+        
+        with metrics.measure('polygonization'):
+            for annotation in mask_processor.build_annotations(label_image, image_id=image_info.id, category_id=1):
+                annotations.append(annotation)
+        
+        metrics.count('annotations', len(annotations))
             
-            for ann in annotations:
-                seg = ann.segmentation
-                
-                polygons = [
-                    np.array(shape, dtype=np.int32).reshape(-1, 1, 2)
-                    for shape in seg
-                ]
-                
-                cv2.polylines(img, polygons, isClosed=True, color=(0, 255, 0), thickness=4)
-            img_small = cv2.resize(img, None, fx=0.7, fy=0.7)
-            plt.imsave(f'{path}_contours.jpg', cv2.cvtColor(img_small, cv2.COLOR_BGR2RGB), format='jpg', pil_kwargs={"quality": 80})
+        if self.config.save_final_images:
+            with metrics.measure('final_images'):
+                self._save_final_images(image_info, image, label_image, annotations, output_handler)
                 
-        return annotations, stats
+        return annotations, metrics
+    
+    def _image_operators(self, image_info: ImageInfo, image: np.ndarray, output_handler: OutputHandler, metrics: Metrics) -> List[Operator]:
+        """Runs the classical operators on the whole image, and partitions the objects found into the tiles
+
+        Returns:
+            List[Operator]: Operators of the tiles: the prompts of each tile, then the model operators
+        """
+        classical, model = split_operators(self.operators)
+        
+        prompter = ImagePrompter(
+            classical,
+            strip_height=self.config.prompt_strip_height,
+            strip_overlap=self.config.prompt_strip_overlap,
+            metrics=metrics,
+            canvas_dir=self.config.scratch_path if self.config.out_of_core else None
+        )
+        prompts = prompter.run(image_info, image, output_handler)
+        
+        regions = [tile.coords for tile in self.tiler.iter_tiles(image)]
+        
+        with metrics.measure('prompt_partition'):
+            points = prompts.partition(regions)
+        
+        return [TilePrompts(prompts.binary_mask, regions, points), *model]
+    
+    def _save_final_images(self, image_info: ImageInfo, image: np.ndarray, label_image: np.ndarray, annotations: List[CocoAnnotation], output_handler: OutputHandler):
+        """Queues the label image and the contours image of an image for writing
+
+        Out-of-core images are not loaded in memory: the final images are downscaled from the
+        memory-mapped image and labels, block by block, to at most `final_image_max_size` pixels
+        on their longest side.
+        """
+        path = output_handler.image_dir / image_info.name
         
+        writer = get_artifact_writer()
+        
+        step = 1
+        
+        if self.config.out_of_core:
+            step = max(math.ceil(max(image.shape[:2]) / self.config.final_image_max_size), 1)
+            image = downscale(image, step)
+            label_image = label_image[::step, ::step].copy()
+        
+        writer.submit(f'{path}_labels.png', label_image, cmap='nipy_spectral')
+        
+        img = image.copy()
+        
+        for ann in annotations:
+            seg = ann.segmentation
+            
+            polygons = [
+                (np.array(shape, dtype=np.float64).reshape(-1, 1, 2) / step).astype(np.int32)
+                for shape in seg
+            ]
+            
+            cv2.polylines(img, polygons, isClosed=True, color=(0, 255, 0), thickness=4)
+        img_small = cv2.resize(img, None, fx=0.7, fy=0.7)
+        writer.submit(f'{path}_contours.jpg', img_small, params=[cv2.IMWRITE_JPEG_QUALITY, 80])
+
 class TilePipelinRunner:
     """
     Pipeline runner for tiles.
     
-    Splits an image into tiles and runs operations on each tile.
+    Splits an image into tiles and runs operations on batches of tiles. The classical operators
+    run up to `queue_depth` batches ahead of SAM, on `threads` threads (see `TileScheduler`).
+
+    Args:
+        operators (List[Operator]):
+        batch_size (int, optional): Number of tiles going through the pipeline together. Defaults to 1.
+        tiler (ImageTiler | None, optional): Splits images into tiles. Defaults to an 8 x 8 grid.
+        min_foreground (float, optional): Foreground fraction at or below which a tile is skipped. See `Pipeline`. Defaults to 0.
+        metrics (Metrics | None, optional): Collects the measurements of each operator. See `Pipeline`. Defaults to None.
+        queue_depth (int, optional): Number of batches prepared ahead of SAM. 0 runs the tiles one batch after the other. Defaults to 0.
+        threads (int, optional): Number of threads running the classical operators ahead. Defaults to 1.
     """
-    def __init__(self, operators: List[Operator]):
+    def __init__(self, operators: List[Operator], batch_size: int = 1, tiler: ImageTiler | None = None, min_foreground: float = 0.0, metrics: Metrics | None = None, queue_depth: int = 0, threads: int = 1):
         self.operators = operators
+        self.batch_size = max(batch_size, 1)
 
-        self.pipeline = Pipeline(operators=self.operators)
-        self.tiler = ImageTiler(rows=8, cols=8)
+        self.pipeline = Pipeline(operators=self.operators, min_foreground=min_foreground, metrics=metrics)
+        self.scheduler = TileScheduler(self.pipeline, depth=queue_depth, workers=threads)
+        self.tiler = tiler or ImageTiler(rows=8, cols=8)
         
     def run(self, image_info: ImageInfo, image: np.ndarray, output_handler: OutputHandler) -> List[TileResult]:
-        tiles = self.tiler.split(image)
-        results = []
+        return list(self.iter_run(image_info, image, output_handler))
+    
+    def iter_run(self, image_info: ImageInfo, image: np.ndarray, output_handler: OutputHandler) -> Iterator[TileResult]:
+        """Runs the pipeline on the tiles of an image, yielding each batch of results as soon as it completes.
+
+        Tiles are generated lazily, so only the current batch and the batches prepared ahead are held in memory.
+
+        Yields:
+            TileResult: Tile and its context, in tile order
+        """
+        tiles = self.tiler.iter_tiles(image)
 
         progress = PipelineProgess()
-        progress.start(image_info.file_name, nb_tiles=len(tiles))
+        progress.start(image_info.file_name, nb_tiles=self.tiler.count(*image.shape[:2]))
         
-        for index, tile in enumerate(tiles):
-            ctx = self.pipeline.run(tile.image, image_info, index, output_handler)
-
-            results.append(TileResult(
-                tile=tile,
-                ctx=ctx
-            ))
-            
-            progress.update()
+        # Tiles of the batches handed to the scheduler, which yields their results in the same order
+        pending = deque()
         
-        progress.close()
+        def batches():
+            start = 0
             
-        return results
\ No newline at end of file
+            while batch := list(islice(tiles, self.batch_size)):
+                pending.append(batch)
+                yield [(start + i, tile.image) for i, tile in enumerate(batch)]
+                start += len(batch)
+        
+        try:
+            for ctxs in self.scheduler.run(batches(), image_info, output_handler):
+                batch = pending.popleft()
+                progress.update(len(batch))
+
+                for tile, ctx in zip(batch, ctxs):
+                    yield TileResult(
+                        tile=tile,
+                        ctx=ctx
+                    )
+        finally:
+            progress.close()
@@ -0,0 +1,294 @@
+from __future__ import annotations
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Tuple
+
+import numpy as np
+from scipy import ndimage
+
+if TYPE_CHECKING:
+    from sfai.operators import Operator
+    from sfai.export import OutputHandler
+    from sfai.data import ImageInfo
+
+from sfai.pipeline import Pipeline, Metrics
+from sfai.stitch.mask import DSU
+
+@dataclass
+class ImagePrompts:
+    """Results of the classical operators on a whole image
+
+    Attributes:
+        binary_mask (np.ndarray): Binary mask of the image
+        labels (np.ndarray): Objects of the image, labelled 1 to `count` (int32)
+        count (int): Number of objects
+    """
+    binary_mask: np.ndarray
+    labels: np.ndarray
+    count: int
+
+    block_rows = 1024
+    """Rows of the labels read at once, the labels can be memory-mapped
+    """
+
+    def partition(self, regions: List[Tuple[int, int, int, int]]) -> List[List[Tuple[int, int]]]:
+        """Assigns the objects of the image to the tiles as SAM prompts.
+
+        An object lying inside at least one tile gets a single prompt, its center, in the tile
+        where it is the furthest from the tile borders. Overlapping tiles do not prompt it again.
+        An object larger than the tiles gets a prompt in each tile it crosses, at the center of its
+        part in the tile, and its parts are merged back by the stitcher.
+
+        Args:
+            regions (List[Tuple[int, int, int, int]]): Coordinates (x1, y1, x2, y2) of each tile
+
+        Returns:
+            List[List[Tuple[int, int]]]: Prompt points (x, y) of each tile, in tile coordinates, ordered by object
+        """
+        points: List[List[Tuple[int, int, int]]] = [[] for _ in regions]
+
+        if self.count == 0 or not regions:
+            return [[] for _ in regions]
+
+        ids = np.arange(1, self.count + 1)
+        boxes = np.array([
+            (s[1].start, s[0].start, s[1].stop, s[0].stop) if s is not None else (0, 0, -1, -1)
+            for s in ndimage.find_objects(self.labels, max_label=self.count)
+        ])
+        present = boxes[:, 2] > boxes[:, 0]
+
+        # Centers of mass in a single pass over the object pixels, by blocks of rows
+        sizes = np.zeros(self.count + 1)
+        sum_y = np.zeros(self.count + 1)
+        sum_x = np.zeros(self.count + 1)
+
+        for start in range(0, self.labels.shape[0], self.block_rows):
+            block = np.asarray(self.labels[start:start + self.block_rows])
+            pixels = np.flatnonzero(block)
+            owners = block.ravel()[pixels]
+            rows, cols = np.divmod(pixels, block.shape[1])
+
+            sizes += np.bincount(owners, minlength=self.count + 1)
+            sum_y += np.bincount(owners, weights=rows + start, minlength=self.count + 1)
+            sum_x += np.bincount(owners, weights=cols, minlength=self.count + 1)
+
+        sizes = np.maximum(sizes[1:], 1)
+        cy = sum_y[1:] / sizes
+        cx = sum_x[1:] / sizes
+
+        # Margin of each object to the borders of the tile containing it best, -1 if none contains it
+        margin = np.full(self.count, -1)
+        home = np.full(self.count, -1)
+
+        for t, (x1, y1, x2, y2) in enumerate(regions):
+            m = np.minimum.reduce([boxes[:, 0] - x1, boxes[:, 1] - y1, x2 - boxes[:, 2], y2 - boxes[:, 3]])
+            better = present & (m > margin)
+            margin[better] = m[better]
+            home[better] = t
+
+        for i in np.flatnonzero(home >= 0):
+            x1, y1, _, _ = regions[home[i]]
+            points[home[i]].append((int(ids[i]), int(cx[i]) - x1, int(cy[i]) - y1))
+
+        crossing = np.flatnonzero(present & (home < 0))
+        b = boxes[crossing]
+
+        for t, (x1, y1, x2, y2) in enumerate(regions):
+            hit = crossing[(b[:, 0] < x2) & (b[:, 2] > x1) & (b[:, 1] < y2) & (b[:, 3] > y1)]
+
+            for i in hit:
+                # Part of the object in the tile, searched in the overlap of its box and the tile
+                ya, yb = max(boxes[i, 1], y1), min(boxes[i, 3], y2)
+                xa, xb = max(boxes[i, 0], x1), min(boxes[i, 2], x2)
+                ys, xs = np.nonzero(self.labels[ya:yb, xa:xb] == ids[i])
+
+                # Boxes of non-convex objects can cross a tile the object itself does not reach
+                if len(ys):
+                    points[t].append((int(ids[i]), int(xa - x1 + xs.mean()), int(ya - y1 + ys.mean())))
+
+        return [[(x, y) for _, x, y in sorted(tile)] for tile in points]
+
+class ImagePrompter:
+    """Runs the classical operators once on a whole image instead of on each tile.
+
+    The image is processed at once, or in horizontal strips of `strip_height` rows to bound the
+    memory used by the operators. Strips overlap by `strip_overlap` rows on each side and keep the
+    labels of their own rows only. Objects crossing the border between two strips are merged
+    with a union-find, as tiles are by `MaskStitcher`: a label of a strip is merged with the label
+    of the strip above covering most of it in the overlap rows.
+
+    The objects found are partitioned into the SAM tiles with `ImagePrompts.partition`. The
+    operators after the labelling (e.g. `CentersDetection`) do not run.
+
+    With a `canvas_dir`, the binary mask and the labels of the image assembled from the strips are
+    memory maps backed by temporary files in this directory, as the label image of `MaskStitcher`.
+    Only the strips are then held in memory.
+
+    Args:
+        operators (List[Operator]): Classical operators, producing a binary mask and labels (e.g. `WatershedSegmentation`)
+        strip_height (int | None, optional): Height of the strips in pixels. None or 0 processes the whole image at once. Defaults to None.
+        strip_overlap (int, optional): Rows added above and below each strip. Must be positive with strips. Defaults to 64.
+        metrics (Metrics | None, optional): Collects the measurements of each operator. Defaults to None.
+        canvas_dir (Path | None, optional): If set, the image-wide arrays of the strips are memory-mapped from this directory. Defaults to None.
+
+    Raises:
+        ValueError: If `strip_height` is set and `strip_overlap` is not positive
+    """
+    block_rows = 1024
+
+    def __init__(self, operators: List[Operator], strip_height: int | None = None, strip_overlap: int = 64, metrics: Metrics | None = None, canvas_dir: Path | None = None):
+        self.strip_height = strip_height or None
+        self.strip_overlap = strip_overlap
+        self.canvas_dir = canvas_dir
+
+        # Without overlap rows, objects crossing a strip border cannot be merged back
+        if self.strip_height is not None and self.strip_overlap <= 0:
+            raise ValueError(f"Strips need a positive overlap to merge the objects crossing their borders, got {strip_overlap}")
+
+        # The whole image is never skipped, blank images simply have no objects
+        self.pipeline = Pipeline(operators=operators, min_foreground=0.0, metrics=metrics)
+
+    def run(self, image_info: ImageInfo, image: np.ndarray, output_handler: OutputHandler) -> ImagePrompts:
+        """Runs the classical operators on an image
+
+        Args:
+            image_info (ImageInfo):
+            image (np.ndarray):
+            output_handler (OutputHandler):
+
+        Returns:
+            ImagePrompts: Binary mask and objects of the image
+        """
+        h = image.shape[0]
+
+        if self.strip_height is None or self.strip_height >= h:
+            binary_mask, labels = self._run(0, image, image_info, output_handler)
+            labels = labels.astype(np.int32, copy=False)
+
+            return ImagePrompts(binary_mask=binary_mask, labels=labels, count=int(labels.max(initial=0)))
+
+        binary_mask = None
+        labels = self._canvas(image.shape[:2], np.int32)
+        dsu = DSU(0)
+        count = 0
+
+        # Labels kept in the own rows of each strip
+        used = []
+
+        # Labels of the previous strip below its own rows
+        tail = None
+
+        for k, start in enumerate(range(0, h, self.strip_height)):
+            end = min(start + self.strip_height, h)
+            y1 = max(start - self.strip_overlap, 0)
+            y2 = min(end + self.strip_overlap, h)
+
+            strip_mask, strip_labels = self._run(k, image[y1:y2], image_info, output_handler)
+
+            if binary_mask is None:
+                binary_mask = self._canvas(image.shape[:2], strip_mask.dtype)
+
+            strip_labels = strip_labels.astype(np.int32)
+            n = int(strip_labels.max(initial=0))
+            strip_labels[strip_labels > 0] += count
+            dsu.extend(count + n)
+
+            if start > 0:
+                # Rows seen by both strips: the previous strip's own rows above, its overlap below
+                old = np.concatenate([labels[y1:start].ravel(), tail.ravel()])
+                new = strip_labels[:start - y1 + len(tail)].ravel()
+
+                for a, b in self._matches(old, new):
+                    dsu.union(a, b)
+
+            labels[start:end] = strip_labels[start - y1:end - y1]
+            used.append(np.flatnonzero(np.bincount(labels[start:end].ravel())))
+            binary_mask[start:end] = strip_mask[start - y1:end - y1]
+            tail = strip_labels[end - y1:]
+            count += n
+
+        # Consecutive labels after the merges. Labels seen in the overlap rows only are dropped.
+        roots = dsu.roots()
+        used = np.concatenate(used)
+        kept = np.unique(roots[used[used > 0]])
+        relabel = np.zeros(len(roots), dtype=np.int32)
+        relabel[kept] = np.arange(1, len(kept) + 1, dtype=np.int32)
+        label_map = relabel[roots]
+
+        # Relabelled in place, by blocks of rows
+        for start in range(0, h, self.block_rows):
+            block = labels[start:start + self.block_rows]
+            block[...] = label_map[block]
+
+        return ImagePrompts(binary_mask=binary_mask, labels=labels, count=len(kept))
+
+    def _canvas(self, shape: Tuple[int, int], dtype: np.dtype) -> np.ndarray:
+        """Allocates an image-wide array, memory-mapped if the prompter has a `canvas_dir`
+        """
+        if self.canvas_dir is None:
+            return np.zeros(shape, dtype=dtype)
+
+        self.canvas_dir.mkdir(parents=True, exist_ok=True)
+
+        # Anonymous file, removed by the system once the memory map is released
+        with tempfile.TemporaryFile(dir=self.canvas_dir) as f:
+            return np.memmap(f, dtype=dtype, mode='w+', shape=shape)
+
+    def _run(self, index: int, image: np.ndarray, image_info: ImageInfo, output_handler: OutputHandler) -> Tuple[np.ndarray, np.ndarray]:
+        """Runs the operators on the whole image or a strip
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Binary mask and labels
+        """
+        ctxs = self.pipeline.contexts([(index, image)], image_info, output_handler)
+
+        # The prompts come from the partition of the labels, the operators after them are not needed
+        for op in self.pipeline.operators:
+            ctxs = self.pipeline.run_operators(ctxs, [op])
+
+            if 'labels' in ctxs[0].metadata:
+                break
+
+        ctx, = ctxs
+
+        if ctx.metadata.get('skipped', False):
+            return ctx.binary_mask, np.zeros(image.shape[:2], dtype=np.int32)
+
+        if ctx.binary_mask is None or 'labels' not in ctx.metadata:
+            raise ValueError("Prompts computed on the whole image need operators producing a binary mask and labels (e.g. WatershedSegmentation)")
+
+        return ctx.binary_mask, ctx.metadata['labels']
+
+    @staticmethod
+    def _matches(old: np.ndarray, new: np.ndarray) -> np.ndarray:
+        """Matches the labels of a strip with the labels of the strip above, on the rows both cover.
+
+        Each label of the strip is matched with the label above covering most of its pixels on
+        these rows, if it covers at least half of them. Watershed boundaries can move by a pixel or
+        two between strips, a label touching its neighbour's basin is not merged with it.
+
+        Args:
+            old (np.ndarray): Labels of the strip above
+            new (np.ndarray): Labels of the strip, on the same pixels
+
+        Returns:
+            np.ndarray: (N, 2) array of matched (old, new) labels
+        """
+        keep = (old > 0) & (new > 0)
+
+        if not keep.any():
+            return np.empty((0, 2), dtype=np.int64)
+
+        base = int(new.max()) + 1
+
+        keys, overlap = np.unique(old[keep].astype(np.int64) * base + new[keep], return_counts=True)
+        pairs = np.stack([keys // base, keys % base], axis=1)
+        sizes = np.bincount(new[new > 0], minlength=base)
+
+        # Best match of each label of the strip first
+        order = np.lexsort((-overlap, pairs[:, 1]))
+        pairs, overlap = pairs[order], overlap[order]
+        best = np.r_[True, pairs[1:, 1] != pairs[:-1, 1]]
+
+        return pairs[best & (2 * overlap >= sizes[pairs[:, 1]])]
@@ -1,2 +1,27 @@
-from .coco2biigle import convert
-from .cpfiles import copy
\ No newline at end of file
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .coco2biigle import convert
+    from .cpfiles import copy
+
+_LAZY_SCRIPTS = {
+    "convert": ".coco2biigle",
+    "copy": ".cpfiles",
+}
+"""Scripts imported on first access. `convert` loads pandas, `copy` does not.
+"""
+
+def __getattr__(name: str):
+    if name in _LAZY_SCRIPTS:
+        value = getattr(import_module(_LAZY_SCRIPTS[name], __name__), name)
+        globals()[name] = value
+        
+        return value
+    
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+__all__ = [
+    "convert",
+    "copy"
+]
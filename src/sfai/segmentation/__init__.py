@@ -1 +1 @@
-from .segment import segment
\ No newline at end of file
+from .segment import segment, build_operators
\ No newline at end of file
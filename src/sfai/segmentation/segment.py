@@ -1,55 +1,139 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from functools import partial
+from typing import TYPE_CHECKING, List
 
 if TYPE_CHECKING:
     from sfai.config import SegmentationConfig
+    from sfai.operators import Operator
 
 from sfai.operators import (
     HSVBackgroundRemoval,
     BinaryTransform,
+    ForegroundExtraction,
     WatershedSegmentation,
     CentersDetection,
-    SAMSegmentation
+    SAMSegmentation,
+    SAMOnnxSegmentation,
+    SAMClientSegmentation
 )
 
-from sfai.data import generate_datasets
-from sfai.runners import DatasetRunner
+from sfai.data import generate_datasets, PrefetchDataset
+from sfai.cache import EmbeddingCache, TileCache
+from sfai.runners import DatasetRunner, create_executor
 from sfai.export import OutputHandler
 
+from sfai.config import default
 from sfai.logging import LOGGER
 
-def segment(config: SegmentationConfig):
-    """Runs segmentation pipeline
+def build_operators(config: SegmentationConfig) -> List[Operator]:
+    """Builds the segmentation operators from a configuration
 
     Args:
         config (SegmentationConfig):
+
+    Returns:
+        List[Operator]: Operators, in execution order
     """
-    datasets = generate_datasets(config.datasets)
-    LOGGER.debug('START SEGMENTATION')
-    
-    operators = [
+    if config.fused_foreground:
+        foreground = [
+            ForegroundExtraction(lower_bound=config.hsv_lower_bound, upper_bound=config.hsv_upper_bound, save=config.save_intermediate_images),
+        ]
+    else:
+        foreground = [
             HSVBackgroundRemoval(lower_bound=config.hsv_lower_bound, upper_bound=config.hsv_upper_bound, save=config.save_intermediate_images),
             BinaryTransform(save=config.save_intermediate_images),
-            WatershedSegmentation(save=config.save_intermediate_images),
-            CentersDetection(save=config.save_intermediate_images),
-            SAMSegmentation(config.model, save=config.save_intermediate_images),
         ]
     
-    for i, dataset in enumerate(datasets, 1):
-        LOGGER.info(f"Dataset: {i}/{len(datasets)}")
-        if dataset.length > 0:
-            out = OutputHandler(
-                base_dir=config.base_output_dir,
-                subname=dataset.root.stem
-            )
-            
-            out.generate_output_folders()
-            
-            dataset_runner = DatasetRunner(
-                dataset=dataset,
-                operators=operators,
-                output_handler=out,
-                config=config
-            )
+    cache = None
+    
+    if config.sam_cache_dir is not None:
+        cache = TileCache(config.sam_cache_dir, max_bytes=config.sam_cache_size)
     
-            dataset_runner.run()
\ No newline at end of file
+    embeddings = None
+    
+    if config.sam_embedding_cache_size > 0 or config.sam_embedding_cache_dir is not None:
+        embeddings = EmbeddingCache(config.sam_embedding_cache_size, directory=config.sam_embedding_cache_dir, max_disk_bytes=config.sam_embedding_cache_disk_size)
+    
+    if config.sam_backend == 'onnx':
+        if config.sam_precision != 'fp32':
+            raise ValueError(f"The onnx SAM backend only runs in fp32, not {config.sam_precision}")
+        
+        build_sam = partial(SAMOnnxSegmentation, config.model, save=config.save_intermediate_images, batch_size=config.sam_batch_size, dist_thresh=config.sam_dist_thresh, cache=cache, onnx_dir=config.sam_onnx_dir, intra_op_threads=config.sam_onnx_intra_threads, inter_op_threads=config.sam_onnx_inter_threads, embeddings=embeddings)
+    elif config.sam_backend == 'ultralytics':
+        build_sam = partial(SAMSegmentation, config.model, save=config.save_intermediate_images, batch_size=config.sam_batch_size, dist_thresh=config.sam_dist_thresh, cache=cache, precision=config.sam_precision, embeddings=embeddings)
+    else:
+        raise ValueError(f"Unsupported SAM backend {config.sam_backend}. Supported backends: ultralytics, onnx")
+    
+    if config.sam_server:
+        if config.sam_cache_dir is not None or embeddings is not None or config.sam_batch_size != default.DEFAULT_SAM_BATCH_SIZE:
+            LOGGER.warning('The SAM server uses its own tile cache, embedding cache and batch size. The ones of the run only apply if SAM falls back to in-process inference')
+
+        # Uses a running `sfai serve` if any, falls back to `build_sam` otherwise
+        sam = SAMClientSegmentation(config.sam_socket, config.model, fallback=build_sam, save=config.save_intermediate_images, dist_thresh=config.sam_dist_thresh, precision=config.sam_precision, backend=config.sam_backend, timeout=config.sam_server_timeout)
+    else:
+        sam = build_sam()
+    
+    return [
+        *foreground,
+        WatershedSegmentation(save=config.save_intermediate_images),
+        CentersDetection(save=config.save_intermediate_images),
+        sam,
+    ]
+
+def segment(config: SegmentationConfig):
+    """Runs segmentation pipeline
+
+    Args:
+        config (SegmentationConfig):
+    """
+    datasets = generate_datasets(
+        config.datasets,
+        cache_dir=config.scratch_path if config.out_of_core else None
+    )
+    LOGGER.debug('START SEGMENTATION')
+
+    executor = None
+    operators = None
+
+    if config.workers > 1:
+        # Operators (and the SAM model) are built once in each worker process
+        executor = create_executor(config, build_operators)
+    else:
+        operators = build_operators(config)
+
+    try:
+        for i, dataset in enumerate(datasets, 1):
+            LOGGER.info(f"Dataset: {i}/{len(datasets)}")
+            if dataset.length > 0:
+                if executor is None and config.prefetch_depth > 0:
+                    dataset = PrefetchDataset(
+                        dataset,
+                        depth=config.prefetch_depth,
+                        workers=config.prefetch_workers,
+                        max_bytes=config.prefetch_max_bytes
+                    )
+
+                out = OutputHandler(
+                    base_dir=config.base_output_dir,
+                    subname=dataset.root.stem
+                )
+
+                out.generate_output_folders()
+
+                dataset_runner = DatasetRunner(
+                    dataset=dataset,
+                    operators=operators,
+                    output_handler=out,
+                    config=config,
+                    executor=executor
+                )
+
+                dataset_runner.run()
+
+        if config.out_of_core and not config.keep_scratch:
+            # Only once the run succeeded, a resumed run reuses the caches
+            for dataset in datasets:
+                dataset.remove_caches()
+    finally:
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,14 @@
+from .protocol import ProtocolError, send_message, recv_message, attach_shared_memory
+from .sam import SAMServer, PROTOCOL_VERSION
+
+"""
+Module serving models to other processes
+"""
+__all__ = [
+    "SAMServer",
+    "PROTOCOL_VERSION",
+    "ProtocolError",
+    "send_message",
+    "recv_message",
+    "attach_shared_memory",
+]
@@ -0,0 +1,81 @@
+import json
+import socket
+import struct
+import sys
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict
+
+_HEADER = struct.Struct('!I')
+"""Length prefix of a message: unsigned 32 bits, network order
+"""
+
+class ProtocolError(ConnectionError):
+    """Raised when the peer closes the connection in the middle of a message, or sends an invalid message
+    """
+
+def send_message(sock: socket.socket, message: Dict[str, Any]):
+    """Sends a JSON message, prefixed with its length
+
+    Args:
+        sock (socket.socket): Connected socket
+        message (Dict[str, Any]): JSON serializable message
+    """
+    payload = json.dumps(message).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+def recv_message(sock: socket.socket) -> Dict[str, Any] | None:
+    """Receives a message sent with `send_message`
+
+    Args:
+        sock (socket.socket): Connected socket
+
+    Returns:
+        Dict[str, Any] | None: The message, None if the peer closed the connection between two messages
+    """
+    header = _recv_exactly(sock, _HEADER.size, allow_eof=True)
+
+    if header is None:
+        return None
+
+    (size,) = _HEADER.unpack(header)
+
+    try:
+        return json.loads(_recv_exactly(sock, size))
+    except ValueError as e:
+        raise ProtocolError(f'Invalid message: {e}') from e
+
+def _recv_exactly(sock: socket.socket, size: int, allow_eof: bool = False) -> bytes | None:
+    buffer = bytearray()
+
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+
+        if not chunk:
+            if allow_eof and not buffer:
+                return None
+
+            raise ProtocolError('Connection closed in the middle of a message')
+
+        buffer += chunk
+
+    return bytes(buffer)
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attaches to a shared memory segment owned by another process.
+
+    The segment is not registered to the resource tracker of this process, which would otherwise
+    unlink it when this process exits.
+
+    Args:
+        name (str): Segment name
+
+    Returns:
+        shared_memory.SharedMemory:
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+
+    return shm
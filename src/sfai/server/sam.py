@@ -0,0 +1,209 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Dict
+
+import os
+import socket
+import socketserver
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from sfai.data import ImageInfo
+from sfai.logging import LOGGER
+from sfai.pipeline import PipelineContext
+from sfai.server.protocol import ProtocolError, attach_shared_memory, recv_message, send_message
+
+if TYPE_CHECKING:
+    from sfai.operators import SAMSegmentation
+
+PROTOCOL_VERSION = 1
+"""Version of the requests and responses. Clients of another version fall back to in-process inference.
+"""
+
+class SAMServer:
+    """Serves a SAM model loaded once to `SAMClientSegmentation` operators over a Unix domain socket.
+
+    Each connection sends JSON requests prefixed with their length (see `sfai.server.protocol`):
+
+    - `{"op": "info"}`: returns the model path, its precision and backend, the model input size and the protocol version.
+    - `{"op": "segment", "shm": ..., "dist_thresh": ..., "tiles": [...]}`: segments a batch of tiles.
+      Each tile gives its shape, its prompt points, the offset of its pixels (BGR, uint8) and the
+      offset of its label mask (uint16) in the shared memory segment `shm` created by the client.
+      The label masks are written in the segment, the response holds the label count of each tile.
+
+    Connections are handled in threads, inference is serialized on the model.
+
+    Args:
+        operator (SAMSegmentation): SAM operator running the model
+        socket_path (Path): Path of the Unix domain socket
+    """
+    def __init__(self, operator: SAMSegmentation, socket_path: Path):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise RuntimeError('The SAM server needs Unix domain sockets, which are not supported on this platform')
+
+        self.operator = operator
+        self.socket_path = Path(socket_path)
+
+        self._lock = threading.Lock()
+        self._server: socketserver.ThreadingUnixStreamServer | None = None
+
+    def serve_forever(self):
+        """Binds the socket and serves requests until `shutdown` is called
+
+        Raises:
+            RuntimeError: If another server already listens on the socket, or the socket belongs to another user
+        """
+        self._remove_stale_socket()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._server = _UnixServer(str(self.socket_path), _RequestHandler)
+        self._server.sam_server = self
+
+        # Tiles are sent by the user running the server only
+        os.chmod(self.socket_path, 0o600)
+
+        LOGGER.info(f'SAM server ready on {self.socket_path} (model: {self.operator.model_path})')
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        """Stops `serve_forever`. Must be called from another thread.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+
+    def close(self):
+        """Closes the socket and removes its file
+        """
+        if self._server is not None:
+            self._server.server_close()
+            self._server = None
+            self.socket_path.unlink(missing_ok=True)
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Handles a request
+
+        Args:
+            request (Dict[str, Any]):
+
+        Returns:
+            Dict[str, Any]: Response. Holds an `error` message if the request failed.
+        """
+        op = request.get('op')
+
+        if op == 'info':
+            return {
+                'version': PROTOCOL_VERSION,
+                'model': str(self.operator.model_path),
+                'precision': self.operator.precision,
+                'backend': self.operator.backend,
+                'imgsz': self.operator.imgsz,
+                'pid': os.getpid(),
+            }
+
+        if op == 'segment':
+            return self._segment(request)
+
+        return {'error': f'Unknown request {op!r}'}
+
+    def _segment(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        shm = attach_shared_memory(request['shm'])
+
+        try:
+            ctxs = []
+
+            for i, tile in enumerate(request['tiles']):
+                shape = tuple(tile['shape'])
+                view = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=tile['offset'])
+
+                image_info = ImageInfo(
+                    id=0,
+                    name=Path(tile.get('path', '')).stem,
+                    file_name=Path(tile.get('path', '')).name,
+                    path=Path(tile.get('path', '')),
+                    width=shape[1],
+                    height=shape[0]
+                )
+
+                # Copied, the segment is reused by the client once the response is sent
+                ctxs.append(PipelineContext(
+                    index=i,
+                    image=view.copy(),
+                    image_info=image_info,
+                    points=tile['points'],
+                    metadata={}
+                ))
+
+                del view
+
+            with self._lock:
+                self.operator.dist_thresh = request.get('dist_thresh', self.operator.dist_thresh)
+                ctxs = self.operator.run_batch(ctxs)
+
+            for ctx, tile in zip(ctxs, request['tiles']):
+                out = np.ndarray(ctx.sam_mask.shape, dtype=np.uint16, buffer=shm.buf, offset=tile['mask_offset'])
+                out[:] = ctx.sam_mask
+
+                del out
+
+            return {'label_counts': [int(ctx.metadata['label_count']) for ctx in ctxs]}
+        finally:
+            shm.close()
+
+    def _remove_stale_socket(self):
+        """Removes the socket file left by a server that did not exit cleanly
+        """
+        if not self.socket_path.exists():
+            return
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            probe.connect(str(self.socket_path))
+        except PermissionError:
+            raise RuntimeError(f'{self.socket_path} belongs to another user, choose another socket with --socket') from None
+        except OSError:
+            try:
+                self.socket_path.unlink(missing_ok=True)
+            except PermissionError:
+                raise RuntimeError(f'Cannot remove the stale socket {self.socket_path} of another user, choose another socket with --socket') from None
+            return
+        finally:
+            probe.close()
+
+        raise RuntimeError(f'A server is already listening on {self.socket_path}')
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    sam_server: SAMServer
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """Handles the requests of a connection until the client disconnects
+    """
+    def handle(self):
+        sam_server: SAMServer = self.server.sam_server
+
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (ProtocolError, OSError) as e:
+                LOGGER.warning(f'SAM server: connection dropped: {e}')
+                return
+
+            if request is None:
+                return
+
+            try:
+                response = sam_server.handle(request)
+            except Exception as e:
+                LOGGER.exception('SAM server: request failed')
+                response = {'error': f'{type(e).__name__}: {e}'}
+
+            try:
+                send_message(self.request, response)
+            except OSError:
+                return
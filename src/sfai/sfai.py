@@ -1,6 +1,6 @@
 import argparse
 
-from sfai.cli import add_segment_parser, add_coco2biigle_parser, add_cpfiles_parser
+from sfai.cli import add_segment_parser, add_coco2biigle_parser, add_cpfiles_parser, add_serve_parser, add_export_onnx_parser
 
 parser = argparse.ArgumentParser(
     prog='sfai',
@@ -22,6 +22,8 @@ subparsers = parser.add_subparsers(
 add_segment_parser(subparsers)
 add_coco2biigle_parser(subparsers)
 add_cpfiles_parser(subparsers)
+add_serve_parser(subparsers)
+add_export_onnx_parser(subparsers)
 
 
 def main():
@@ -1,114 +1,214 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
+import tempfile
+from pathlib import Path
+
 import numpy as np
-from collections import defaultdict
 
 if TYPE_CHECKING:
+    from sfai.data import Tile
     from sfai.runners import TileResult
-    
+
 class DSU:
-    """_summary_
+    """Array-backed union-find over labels. Label 0 is the background.
+
+    Args:
+        n (int): Highest label
     """
-    def __init__(self, n):
-        """_summary_
+    def __init__(self, n: int):
+        self.parent = np.arange(n + 1, dtype=np.int64)
+        self.n = n
+
+    def extend(self, n: int):
+        """Adds labels up to `n`. The parent array grows geometrically.
 
         Args:
-            n (_type_): _description_
+            n (int): New highest label
         """
-        self.parent = list(range(n + 1))
+        if n + 1 > len(self.parent):
+            size = max(n + 1, 2 * len(self.parent))
+            self.parent = np.concatenate([
+                self.parent[:self.n + 1],
+                np.arange(self.n + 1, size, dtype=np.int64)
+            ])
+        self.n = max(self.n, n)
 
-    def find(self, x):
-        while self.parent[x] != x:
-            self.parent[x] = self.parent[self.parent[x]]
-            x = self.parent[x]
-        return x
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return int(x)
 
-    def union(self, a, b):
+    def union(self, a: int, b: int):
         pa, pb = self.find(a), self.find(b)
         if pa != pb:
             self.parent[pb] = pa
-    
+
+    def roots(self) -> np.ndarray:
+        """Resolves the root of every label at once by pointer jumping.
+
+        Returns:
+            np.ndarray: Array mapping each label to the root of its set
+        """
+        roots = self.parent[:self.n + 1]
+        while True:
+            parents = roots[roots]
+            if np.array_equal(parents, roots):
+                return roots
+            roots = parents
+
 
 class MaskStitcher:
-    """_summary_
+    """Stitches the label masks of overlapping tiles into a single label image.
+
+    Labels of each tile are shifted so they are unique over the image. Labels touching each other
+    on a tile border are merged into a single label. Tile masks are uint16, the label image is
+    uint32 so that images with more than 65535 objects over all their tiles can be stitched.
+
+    Tiles can be stitched all at once with `stitch`, or incrementally with `begin`, `add` and
+    `finish`, so that each tile can be released as soon as it is added.
+
+    Args:
+        canvas_dir (Path | None, optional): If set, the label image is a memory map backed by a temporary file in this directory, so it does not have to fit in memory. Defaults to None.
     """
-    def __init__(self):
-        """_summary_
-        """
-        self.border_equiv = defaultdict(set)
+    block_rows = 1024
     
-    def stitch(self, tiles: list[TileResult], image_shape):
-        """_summary_
+    def __init__(self, canvas_dir: Path | None = None):
+        self.canvas_dir = canvas_dir
+    
+    def stitch(self, tiles: list[TileResult], image_shape) -> np.ndarray:
+        """Stitches tiles into a label image
 
         Args:
-            tiles (list[TileResult]): _description_
-            image_shape (_type_): _description_
+            tiles (list[TileResult]): Tiles with their `sam_mask` and `label_count`
+            image_shape (Tuple[int, int]): Shape of the source image
 
         Returns:
-            _type_: _description_
+            np.ndarray: Label image (uint32)
         """
-        H, W = image_shape[:2]
-        final_mask = np.zeros((H, W), dtype=np.uint16)
-        
-        offsets = []
-        total_label_count = 0
+        self.begin(image_shape)
 
         for t in tiles:
-            offsets.append(total_label_count)
-            total_label_count += t.ctx.metadata.get('label_count', 0)
-        
-        dsu = DSU(total_label_count)
-
-        for t, offset in zip(tiles, offsets):
-            tile = t.tile
-            tile_mask = t.ctx.sam_mask
-            x1, y1, x2, y2 = tile.coords
-            h,w = tile_mask.shape
-            
-            tile_mask = np.where(tile_mask > 0, tile_mask + offset, 0)
+            self.add(t.tile, t.ctx.sam_mask, t.ctx.metadata.get('label_count', 0))
+
+        return self.finish()
+
+    def begin(self, image_shape):
+        """Starts stitching a new image
+
+        Args:
+            image_shape (Tuple[int, int]): Shape of the source image
+        """
+        H, W = image_shape[:2]
+
+        if self.canvas_dir is None:
+            self._final_mask = np.zeros((H, W), dtype=np.uint32)
+        else:
+            self.canvas_dir.mkdir(parents=True, exist_ok=True)
             
-            if x1 > 0:
-                old = final_mask[y1:y2, x1]
-                new = tile_mask[:, 0]
-                for a, b in zip(old, new):
-                    if a > 0 and b > 0:
-                        dsu.union(a, b)
-                    
-            if x2 < W:
-                old = final_mask[y1:y2, x2 - 1]
-                new = tile_mask[:, w - 1]
-                for a, b in zip(old, new):
-                    if a > 0 and b > 0:
-                        dsu.union(a, b)
-                        
-            if y1 > 0:
-                old = final_mask[y1, x1:x2]
-                new = tile_mask[0, :]
-                for a, b in zip(old, new):
-                    if a > 0 and b > 0:
-                        dsu.union(a, b)
+            # Anonymous file, removed by the system once the memory map is released
+            with tempfile.TemporaryFile(dir=self.canvas_dir) as f:
+                self._final_mask = np.memmap(f, dtype=np.uint32, mode='w+', shape=(H, W))
+
+        self._dsu = DSU(0)
+        self._label_count = 0
+
+    def add(self, tile: Tile, tile_mask: np.ndarray, label_count: int):
+        """Adds the label mask of a tile. Tiles must be added in the same order for the same result.
+
+        Args:
+            tile (Tile): Tile, for its coordinates
+            tile_mask (np.ndarray): Label mask of the tile
+            label_count (int): Number of labels of the tile
+        """
+        final_mask = self._final_mask
+        dsu = self._dsu
+        H, W = final_mask.shape
+
+        offset = self._label_count
+        self._label_count += label_count
+        dsu.extend(self._label_count)
+
+        x1, y1, x2, y2 = tile.coords
+        h,w = tile_mask.shape
+
+        # Labels of the image go past the uint16 range of the tile masks on large images
+        tile_mask = tile_mask.astype(np.uint32)
+        tile_mask[tile_mask > 0] += np.uint32(offset)
+
+        old = []
+        new = []
+
+        if x1 > 0:
+            old.append(final_mask[y1:y2, x1])
+            new.append(tile_mask[:, 0])
+
+        if x2 < W:
+            old.append(final_mask[y1:y2, x2 - 1])
+            new.append(tile_mask[:, w - 1])
+
+        if y1 > 0:
+            old.append(final_mask[y1, x1:x2])
+            new.append(tile_mask[0, :])
+
+        if y2 < H:
+            old.append(final_mask[y2 - 1, x1:x2])
+            new.append(tile_mask[h - 1, :])
+
+        if old:
+            for a, b in self.border_pairs(np.concatenate(old), np.concatenate(new)):
+                dsu.union(a, b)
+
+        final_mask[y1:y2, x1:x2] = np.maximum(
+            final_mask[y1:y2, x1:x2],
+            tile_mask
+        )
+
+    def finish(self) -> np.ndarray:
+        """Resolves the merged labels of the added tiles
+
+        Returns:
+            np.ndarray: Label image (uint32). A memory map when the stitcher has a `canvas_dir`.
+        """
+        label_map = self._dsu.roots().astype(np.uint32)
+
+        if isinstance(self._final_mask, np.memmap):
+            # Relabelled in place, by blocks of rows
+            final_image = self._final_mask
             
-            if y2 < H:
-                old = final_mask[y2 - 1, x1:x2]
-                new = tile_mask[h - 1, :]
-                for a, b in zip(old, new):
-                    if a > 0 and b > 0:
-                        dsu.union(a, b)
+            for start in range(0, final_image.shape[0], self.block_rows):
+                block = final_image[start:start + self.block_rows]
+                block[...] = label_map[block]
+        else:
+            final_image = label_map[self._final_mask]
 
-            final_mask[y1:y2, x1:x2] = np.maximum(
-                final_mask[y1:y2, x1:x2],
-                tile_mask
-            )
+        self._final_mask = None
+        self._dsu = None
 
-        unique = np.unique(final_mask)
-        unique = unique[unique > 0]
+        return final_image
 
-        label_map = np.arange(total_label_count + 1, dtype=np.uint16)
+    @staticmethod
+    def border_pairs(old: np.ndarray, new: np.ndarray) -> np.ndarray:
+        """Returns the distinct pairs of labels touching each other on a border.
+
+        Pairs are kept in order of first appearance along the border. Union-find roots depend on
+        the union order, so this gives the same labels as a union on every border pixel.
+
+        Args:
+            old (np.ndarray): Labels already stitched along the border
+            new (np.ndarray): Labels of the tile along the border
+
+        Returns:
+            np.ndarray: (N, 2) array of (old, new) labels
+        """
+        keep = (old > 0) & (new > 0)
+        old = old[keep].astype(np.int64)
+        new = new[keep].astype(np.int64)
 
-        for label in unique:
-            label_map[label] = dsu.find(label)
+        keys = old * (int(new.max(initial=0)) + 1) + new
+        _, first = np.unique(keys, return_index=True)
+        first.sort()
 
-        final_image = label_map[final_mask]
-        
-        return final_image
\ No newline at end of file
+        return np.stack([old[first], new[first]], axis=1)
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from sfai.operators.sam import SAMSegmentation
+
+@pytest.fixture
+def sam():
+    # Only the merge of the prompts is tested, no model is loaded
+    return SAMSegmentation.__new__(SAMSegmentation)
+
+@pytest.mark.parametrize('dist_thresh', [5, 10, 20, 20.5])
+def test_merge_centers_same_as_greedy(sam, dist_thresh):
+    rng = np.random.default_rng(0)
+
+    for _ in range(50):
+        centers = rng.integers(0, 200, (rng.integers(0, 200), 2)).tolist()
+
+        assert sam.merge_centers(centers, dist_thresh) == sam.merge_centers_greedy(centers, dist_thresh)
+
+def test_merge_centers_at_threshold(sam):
+    # Points exactly at the threshold are not merged
+    assert sam.merge_centers([[0, 0], [20, 0]], 20) == [[0, 0], [20, 0]]
+    assert sam.merge_centers([[0, 0], [19, 0]], 20) == [[9, 0]]
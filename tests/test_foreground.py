@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+import pytest
+
+from sfai.operators import BinaryTransform, ForegroundExtraction, HSVBackgroundRemoval
+from sfai.pipeline import PipelineContext
+
+def context(image):
+    return PipelineContext(index=0, image=image, image_info=None, metadata={})
+
+def blobs(rng, h, w):
+    # Blue background with colored blobs and a few saturated pixels, as the sample images
+    image = np.full((h, w, 3), (120, 60, 20), dtype=np.uint8)
+
+    for _ in range(rng.integers(1, 10)):
+        center = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(image, center, int(rng.integers(2, 20)), color, -1)
+
+    image[rng.random((h, w)) < 0.05] = 255
+
+    return image
+
+@pytest.mark.parametrize('kind', ['noise', 'white', 'black', 'background', 'blobs'])
+def test_same_as_background_removal_and_binary(kind):
+    rng = np.random.default_rng(0)
+    legacy = [HSVBackgroundRemoval(), BinaryTransform()]
+    fused = ForegroundExtraction()
+
+    for _ in range(10):
+        h, w = rng.integers(3, 120, 2)
+
+        if kind == 'noise':
+            image = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        elif kind == 'white':
+            image = np.full((h, w, 3), 255, dtype=np.uint8)
+        elif kind == 'black':
+            image = np.zeros((h, w, 3), dtype=np.uint8)
+        elif kind == 'background':
+            image = np.full((h, w, 3), (200, 80, 20), dtype=np.uint8)
+        else:
+            image = blobs(rng, h, w)
+
+        ctx = context(image)
+
+        for op in legacy:
+            ctx = op(ctx)
+
+        np.testing.assert_array_equal(fused(context(image)).binary_mask, ctx.binary_mask)
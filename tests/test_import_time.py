@@ -0,0 +1,39 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+HEAVY_MODULES = ['torch', 'ultralytics', 'skimage', 'matplotlib', 'shapely', 'pandas']
+
+BUDGET = 5.0
+"""Loose time budget in seconds, `benchmarks/import_time.py` has the tight one
+"""
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in json.loads(sys.argv[2]) if m in sys.modules]}))
+'''
+
+@pytest.mark.parametrize('statement', [
+    'import sfai.operators',
+    'import sfai.sfai',
+    'import sfai.sfai as cli\ntry:\n    cli.parser.parse_args(["segment", "--help"])\nexcept SystemExit:\n    pass',
+])
+def test_no_heavy_import(statement):
+    # Fresh interpreter, the modules imported by other tests do not count
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE, statement, json.dumps(HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).parent.parent / 'src',
+    )
+    result = json.loads(out.stdout.splitlines()[-1])
+
+    assert result['loaded'] == []
+    assert result['elapsed'] < BUDGET
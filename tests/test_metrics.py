@@ -0,0 +1,28 @@
+import threading
+import time
+
+from sfai.pipeline import Metrics
+
+def test_cpu_time_of_the_stage_thread_only():
+    metrics = Metrics()
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            pass
+
+    # Busy thread running meanwhile, as the classical operators run ahead of SAM
+    thread = threading.Thread(target=spin)
+    thread.start()
+
+    try:
+        with metrics.measure('idle'):
+            time.sleep(0.2)
+    finally:
+        stop.set()
+        thread.join()
+
+    stage = metrics.stages['idle']
+
+    assert stage.wall >= 0.2
+    assert stage.cpu < 0.05
@@ -0,0 +1,56 @@
+import threading
+import weakref
+from pathlib import Path
+
+import numpy as np
+
+from sfai.data import PrefetchDataset
+from sfai.data.dataset import Dataset
+
+SIZE = 1000
+
+class TrackingDataset(Dataset):
+    """Dataset of blank images, tracking the decoded images still alive
+    """
+    def __init__(self, length: int):
+        self.root = Path('.')
+        self.paths = [Path(f'{i}.png') for i in range(length)]
+        self.alive = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        for id, path in self.items():
+            yield self.read(id, path)
+
+    def read(self, id, path):
+        image = np.zeros(SIZE, dtype=np.uint8)
+
+        with self.lock:
+            self.alive += 1
+            self.peak = max(self.peak, self.alive)
+
+        weakref.finalize(image, self._release)
+
+        return id, image
+
+    def _release(self):
+        with self.lock:
+            self.alive -= 1
+
+    @property
+    def length(self):
+        return len(self.paths)
+
+def test_budget_counts_the_image_held_by_the_consumer(monkeypatch):
+    monkeypatch.setattr('sfai.data.prefetch.decoded_size', lambda path: SIZE)
+
+    dataset = TrackingDataset(10)
+    ids = []
+
+    # The loop variable holds the previous image while the next ones are decoded
+    for id, image in PrefetchDataset(dataset, depth=4, workers=2, max_bytes=2 * SIZE):
+        ids.append(id)
+
+    assert ids == list(range(1, 11))
+    assert dataset.peak <= 2
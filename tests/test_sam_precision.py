@@ -0,0 +1,42 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+MODEL = os.environ.get('SFAI_TEST_MODEL')
+"""SAM model the reduced precisions are checked with, e.g. models/sam2_t.pt. The test is skipped if not set
+"""
+
+MIN_OBJECT_IOU = 0.9
+
+pytestmark = pytest.mark.skipif(MODEL is None, reason='SFAI_TEST_MODEL is not set')
+
+@pytest.fixture(scope='module')
+def benchmark():
+    pytest.importorskip('ultralytics')
+
+    # Sample tiles and mask comparison of the precision benchmark
+    sys.path.insert(0, str(Path(__file__).parent.parent / 'benchmarks'))
+    import sam_precision
+
+    return sam_precision
+
+@pytest.fixture(scope='module')
+def tiles(benchmark):
+    from sfai.data import ImageTiler
+
+    return benchmark.sample_tiles([], 2, ImageTiler(tile_size=1024))
+
+@pytest.fixture(scope='module')
+def reference(benchmark, tiles):
+    masks, _ = benchmark.segment(Path(MODEL), 'fp32', tiles, batch_size=1)
+
+    return masks
+
+@pytest.mark.parametrize('precision', ['bf16', 'dynamic-int8'])
+def test_precision_close_to_fp32(benchmark, tiles, reference, precision):
+    masks, _ = benchmark.segment(Path(MODEL), precision, tiles, batch_size=1)
+    scores = benchmark.compare(reference, masks)
+
+    assert scores['object_iou'] >= MIN_OBJECT_IOU
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from sfai.data import ImageTiler, Tile
+from sfai.stitch.mask import MaskStitcher
+
+def reference_stitch(tiles, masks, counts, image_shape):
+    """Stitcher with a union on every border pixel and a list-backed union-find, as `MaskStitcher` was first written
+    """
+    H, W = image_shape
+    final_mask = np.zeros((H, W), dtype=np.int64)
+    parent = list(range(sum(counts) + 1))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(a, b):
+        pa, pb = find(a), find(b)
+        if pa != pb:
+            parent[pb] = pa
+
+    offset = 0
+
+    for tile, tile_mask, count in zip(tiles, masks, counts):
+        x1, y1, x2, y2 = tile.coords
+        h, w = tile_mask.shape
+        tile_mask = np.where(tile_mask > 0, tile_mask.astype(np.int64) + offset, 0)
+        offset += count
+
+        borders = []
+
+        if x1 > 0:
+            borders.append((final_mask[y1:y2, x1], tile_mask[:, 0]))
+        if x2 < W:
+            borders.append((final_mask[y1:y2, x2 - 1], tile_mask[:, w - 1]))
+        if y1 > 0:
+            borders.append((final_mask[y1, x1:x2], tile_mask[0, :]))
+        if y2 < H:
+            borders.append((final_mask[y2 - 1, x1:x2], tile_mask[h - 1, :]))
+
+        for old, new in borders:
+            for a, b in zip(old, new):
+                if a > 0 and b > 0:
+                    union(a, b)
+
+        final_mask[y1:y2, x1:x2] = np.maximum(final_mask[y1:y2, x1:x2], tile_mask)
+
+    label_map = np.array([find(label) for label in range(len(parent))])
+
+    return label_map[final_mask]
+
+def _tile(x1, y1, x2, y2):
+    return Tile(image=None, center=((x1 + x2) // 2, (y1 + y2) // 2), coords=(x1, y1, x2, y2), width=x2 - x1, height=y2 - y1)
+
+@pytest.mark.parametrize('out_of_core', [False, True])
+def test_more_labels_than_uint16(tmp_path, out_of_core):
+    # 40 x 40 tiles of 10 x 10 pixels, each inner pixel its own label: 102400 labels, none on a tile border
+    stitcher = MaskStitcher(canvas_dir=tmp_path if out_of_core else None)
+    stitcher.begin((400, 400))
+
+    tile_mask = np.zeros((10, 10), dtype=np.uint16)
+    tile_mask[1:-1, 1:-1] = np.arange(1, 65).reshape(8, 8)
+
+    for y in range(0, 400, 10):
+        for x in range(0, 400, 10):
+            stitcher.add(_tile(x, y, x + 10, y + 10), tile_mask, 64)
+
+    image = stitcher.finish()
+
+    assert image.dtype == np.uint32
+    assert image.max() == 1600 * 64
+    assert len(np.unique(image)) == 1600 * 64 + 1
+
+@pytest.mark.parametrize('seed', range(5))
+def test_same_as_reference(seed):
+    rng = np.random.default_rng(seed)
+    shape = (rng.integers(100, 300), rng.integers(100, 300))
+
+    # Blobs crossing the tile borders, labelled in each tile on its own
+    blobs = ndimage.gaussian_filter(rng.random(shape), 3) > 0.52
+    tiles = ImageTiler(rows=rng.integers(1, 5), cols=rng.integers(1, 5), overlap=int(rng.integers(0, 15))).split(blobs)
+
+    masks, counts = [], []
+
+    for tile in tiles:
+        mask, count = ndimage.label(tile.image)
+        masks.append(mask.astype(np.uint16))
+        counts.append(count)
+
+    stitcher = MaskStitcher()
+    stitcher.begin(shape)
+
+    for tile, mask, count in zip(tiles, masks, counts):
+        stitcher.add(tile, mask, count)
+
+    np.testing.assert_array_equal(stitcher.finish(), reference_stitch(tiles, masks, counts, shape))
@@ -0,0 +1,60 @@
+import sys
+
+import numpy as np
+import pytest
+
+from sfai.data.windowed import open_windowed, remove_windowed_cache
+
+tifffile = pytest.importorskip('tifffile')
+
+@pytest.fixture
+def rgba():
+    rng = np.random.default_rng(0)
+    
+    return rng.integers(0, 256, (70, 50, 4), dtype=np.uint8)
+
+@pytest.mark.parametrize('samples', [1, 2, 3, 4])
+@pytest.mark.parametrize('planarconfig', ['contig', 'separate'])
+def test_tiff_layouts(tmp_path, monkeypatch, rgba, samples, planarconfig):
+    # Blocks smaller than the image, so the conversion runs on several blocks
+    monkeypatch.setattr('sfai.data.windowed.BLOCK_ROWS', 32)
+
+    if samples == 1:
+        data, expected = rgba[..., 0], np.repeat(rgba[..., :1], 3, axis=2)
+    elif samples == 2:
+        data, expected = rgba[..., :2], np.repeat(rgba[..., :1], 3, axis=2)
+    else:
+        data, expected = rgba[..., :samples], rgba[..., 2::-1]
+    
+    if planarconfig == 'separate' and samples > 1:
+        data = np.moveaxis(data, -1, 0)
+
+    path = tmp_path / 'image.tif'
+    extrasamples = {'extrasamples': [2]} if samples in (2, 4) else {}
+    photometric = 'minisblack' if samples < 3 else 'rgb'
+    tifffile.imwrite(path, data, photometric=photometric, planarconfig=planarconfig, **extrasamples)
+
+    image = open_windowed(path, tmp_path / 'cache')
+
+    assert image.shape == (70, 50, 3)
+    np.testing.assert_array_equal(image, expected)
+
+def test_remove_cache(tmp_path, rgba):
+    path = tmp_path / 'image.tif'
+    tifffile.imwrite(path, rgba[..., :3], photometric='rgb')
+
+    image = open_windowed(path, tmp_path / 'cache')
+    remove_windowed_cache(path, tmp_path / 'cache')
+
+    assert not any((tmp_path / 'cache').iterdir())
+    # Opened images stay readable
+    np.testing.assert_array_equal(image, rgba[..., 2::-1])
+
+def test_tiff_without_tifffile(tmp_path, monkeypatch, rgba):
+    path = tmp_path / 'image.tif'
+    tifffile.imwrite(path, rgba[..., :3], photometric='rgb')
+
+    monkeypatch.setitem(sys.modules, 'tifffile', None)
+
+    with pytest.raises(RuntimeError, match='tifffile'):
+        open_windowed(path, tmp_path / 'cache')